@@ -1,24 +1,49 @@
 #!/usr/bin/env python3
 """
 Скрипт для автоматического создания OAuth2 клиента
+
+Создание одного тестового клиента:
+    python add_oauth.py
+
+Создание клиентов по манифесту (JSON или YAML):
+    python add_oauth.py --manifest clients.yaml --env staging
+
+Манифест - список клиентов (или {'clients': [...]}) с полями name,
+description, redirect_uris, scopes, service_scopes. Клиенты создаются
+параллельно; клиент с уже существующим названием не создается повторно,
+а его параметры приводятся к манифесту. Учетные данные всех клиентов
+окружения записываются в один файл oauth_clients.<env>.json.
 """
 
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from requests.adapters import HTTPAdapter
+import argparse
+import os
 import requests
 import json
+import sys
+
+try:
+    import yaml
+except ImportError:  # YAML-манифесты необязательны
+    yaml = None
 
 # Настройки
 API_BASE = 'http://localhost:5000/api'
 ADMIN_EMAIL = 'admin@university.ru'
 ADMIN_PASSWORD = 'admin123'
+# Поля клиента, которые синхронизируются с манифестом
+MANIFEST_FIELDS = ('description', 'redirect_uris', 'scopes', 'service_scopes')
 
 
-def get_admin_token():
+def get_admin_token(http=requests, api_base=API_BASE, email=ADMIN_EMAIL, password=ADMIN_PASSWORD):
     """Получение JWT токена админа"""
     print("🔑 Получаем токен админа...")
 
-    response = requests.post(f'{API_BASE}/auth/login', json={
-        'email': ADMIN_EMAIL,
-        'password': ADMIN_PASSWORD
+    response = http.post(f'{api_base}/auth/login', json={
+        'email': email,
+        'password': password
     })
 
     if response.status_code == 200:
@@ -128,7 +153,178 @@ OAUTH_CONFIG = {{
         print("✅ Создан файл oauth_config.py с конфигурацией")
 
 
+def load_manifest(path):
+    """
+    Читает манифест клиентов.
+
+    Returns:
+        list[dict]: Описания клиентов с уникальными названиями.
+    """
+    with open(path, encoding='utf-8') as f:
+        if path.endswith(('.yaml', '.yml')):
+            if yaml is None:
+                raise ValueError('Для YAML-манифеста установите PyYAML (pip install pyyaml)')
+            data = yaml.safe_load(f)
+        else:
+            data = json.load(f)
+
+    clients = data.get('clients', []) if isinstance(data, dict) else data
+    if not isinstance(clients, list) or not all(isinstance(c, dict) and c.get('name') for c in clients):
+        raise ValueError('Манифест должен содержать список клиентов с полем name')
+
+    names = [client['name'].strip() for client in clients]
+    duplicates = sorted({name for name in names if names.count(name) > 1})
+    if duplicates:
+        raise ValueError(f"Повторяющиеся названия клиентов: {', '.join(duplicates)}")
+    return clients
+
+
+def _as_list(value):
+    return value.split() if isinstance(value, str) else list(value or [])
+
+
+def _normalized(value):
+    # Порядок URI и областей доступа не важен для сравнения с манифестом
+    return sorted(value) if isinstance(value, list) else (value or None)
+
+
+def provision_client(http, api_base, headers, spec, existing, known_secret, regenerate_missing):
+    """
+    Создает клиента или приводит существующего клиента с тем же названием к манифесту.
+
+    Returns:
+        tuple[str, dict]: Действие ('created', 'updated', 'unchanged') и данные клиента с client_secret
+        (None, если секрет существующего клиента неизвестен).
+    """
+    payload = {'name': spec['name'].strip(), 'description': spec.get('description')}
+    for field in ('redirect_uris', 'scopes', 'service_scopes'):
+        payload[field] = _as_list(spec.get(field))
+
+    if existing is None:
+        response = http.post(f'{api_base}/admin/oauth-clients', headers=headers, json=payload)
+        if response.status_code != 201:
+            raise RuntimeError(f"{payload['name']}: {response.status_code} {response.text}")
+        return 'created', response.json()
+
+    changes = {field: payload[field] for field in MANIFEST_FIELDS
+               if _normalized(payload[field]) != _normalized(existing.get(field))}
+    if not known_secret and regenerate_missing:
+        changes['regenerate_secret'] = True
+    if not changes:
+        return 'unchanged', dict(existing, client_secret=known_secret)
+
+    response = http.put(f"{api_base}/admin/oauth-clients/{existing['id']}", headers=headers, json=changes)
+    if response.status_code != 200:
+        raise RuntimeError(f"{payload['name']}: {response.status_code} {response.text}")
+    data = response.json()
+    return 'updated', dict(data, client_secret=data.get('client_secret', known_secret))
+
+
+def provision_manifest(manifest_path, env, api_base=API_BASE, workers=4, output=None,
+                       email=ADMIN_EMAIL, password=ADMIN_PASSWORD, regenerate_missing=False):
+    """
+    Создает клиентов по манифесту и записывает учетные данные окружения в один файл.
+
+    Returns:
+        bool: True, если все клиенты обработаны без ошибок.
+
+    Raises:
+        ValueError: Если манифест некорректен или в портале несколько клиентов
+            с названием из манифеста (неясно, какой из них обновлять).
+    """
+    clients = load_manifest(manifest_path)
+    output = output or f'oauth_clients.{env}.json'
+
+    http = requests.Session()
+    http.mount(api_base, HTTPAdapter(pool_connections=1, pool_maxsize=workers))
+    token = get_admin_token(http, api_base, email, password)
+    if not token:
+        return False
+    headers = {'Authorization': f'Bearer {token}'}
+
+    response = http.get(f'{api_base}/admin/oauth-clients', headers=headers)
+    response.raise_for_status()
+    existing = {}
+    duplicates = set()
+    for client in response.json():
+        name = client['name'].strip()
+        if name in existing:
+            duplicates.add(name)
+        existing[name] = client
+    duplicates &= {spec['name'].strip() for spec in clients}
+    if duplicates:
+        raise ValueError(f"В портале несколько клиентов с названием: {', '.join(sorted(duplicates))}")
+
+    config = {}
+    if os.path.exists(output):
+        with open(output, encoding='utf-8') as f:
+            config = json.load(f)
+    config.setdefault('clients', {})
+    secrets_by_id = {item.get('client_id'): item.get('client_secret') for item in config['clients'].values()}
+
+    def provision(spec):
+        current = existing.get(spec['name'].strip())
+        known_secret = secrets_by_id.get(current['client_id']) if current else None
+        return provision_client(http, api_base, headers, spec, current, known_secret, regenerate_missing)
+
+    print(f"🚀 Обработка {len(clients)} клиентов ({workers} потоков)...")
+    failed = 0
+    with ThreadPoolExecutor(workers) as pool:
+        futures = {spec['name'].strip(): pool.submit(provision, spec) for spec in clients}
+        for name, future in futures.items():
+            try:
+                action, client = future.result()
+            except Exception as e:
+                failed += 1
+                print(f"❌ {e}")
+                continue
+            icon = {'created': '✅', 'updated': '🔄', 'unchanged': '✔️'}[action]
+            print(f"{icon} {name}: {action} ({client['client_id']})")
+            if not client.get('client_secret'):
+                print(f"⚠️ {name}: секрет неизвестен, используйте --regenerate-missing-secrets")
+            config['clients'][name] = {
+                'client_id': client['client_id'],
+                'client_secret': client.get('client_secret'),
+                'redirect_uris': client.get('redirect_uris', []),
+                'scopes': client.get('scopes', []),
+                'service_scopes': client.get('service_scopes', [])
+            }
+
+    config.update(env=env, api_base=api_base, generated_at=datetime.utcnow().isoformat())
+    temp = f'{output}.tmp'
+    fd = os.open(temp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        json.dump(config, f, ensure_ascii=False, indent=2)
+    os.replace(temp, output)
+    print(f"📝 Учетные данные окружения {env} записаны в {output}")
+    return failed == 0
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Создание OAuth2 клиентов портала')
+    parser.add_argument('--manifest', help='JSON/YAML-файл со списком клиентов')
+    parser.add_argument('--env', default='dev', help='окружение: определяет имя файла учетных данных')
+    parser.add_argument('--api-base', default=API_BASE, help='адрес API портала')
+    parser.add_argument('--workers', type=int, default=4, help='количество параллельных запросов')
+    parser.add_argument('--output', help='файл учетных данных (по умолчанию oauth_clients.<env>.json)')
+    parser.add_argument('--email', default=ADMIN_EMAIL, help='email администратора')
+    parser.add_argument('--password', default=ADMIN_PASSWORD, help='пароль администратора')
+    parser.add_argument('--regenerate-missing-secrets', action='store_true',
+                        help='перевыпустить секрет существующего клиента, если его нет в файле учетных данных')
+    return parser.parse_args()
+
+
 def main():
+    args = parse_args()
+    if args.manifest:
+        try:
+            ok = provision_manifest(args.manifest, args.env, args.api_base, max(args.workers, 1), args.output,
+                                    args.email, args.password, args.regenerate_missing_secrets)
+        except ValueError as e:
+            print(f"❌ {e}")
+            ok = False
+        sys.exit(0 if ok else 1)
+
     print("🧪 Автоматическое создание OAuth2 клиента")
     print("=" * 50)
 
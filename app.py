@@ -1,15 +1,48 @@
-from flask import Flask, request, jsonify
-from flask_sqlalchemy import SQLAlchemy
+from flask import Flask, Response, request, jsonify, send_file, stream_with_context
+from sqlalchemy import event, inspect as sa_inspect, select, text
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm.exc import StaleDataError
 from flask_cors import CORS
-from flask_jwt_extended import JWTManager, create_access_token, create_refresh_token, jwt_required, get_jwt_identity
-from werkzeug.security import generate_password_hash, check_password_hash
-from datetime import datetime, timedelta
+from authlib.oauth2 import OAuth2Error
+from authlib.oauth2.rfc6749.util import extract_basic_authorization
+from flask_jwt_extended import (
+    JWTManager, create_access_token, create_refresh_token, jwt_required, get_jwt_identity, verify_jwt_in_request
+)
+from werkzeug.security import gen_salt, generate_password_hash, check_password_hash
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache, wraps
 import secrets
 import re
+import hashlib
 import json
+import math
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 import smtplib
+import os
+import threading
+import time
+import uuid
+
+from attachment_store import AttachmentStore, UploadOffsetError
+from db_engine import database_uri, engine_options, install_sqlite_pragmas, sqlite_pragmas
+from extensions import db
+from export_stream import CSV_MIMETYPE, XLSX_MIMETYPE, csv_stream, xlsx_stream
+from form_schema import FormDefinitionError, FormSchemaCache, FormValidationError, compile_form
+from authlib.integrations.flask_oauth2 import current_token
+from oauth_models import (
+    OAuth2AuthorizationCode, OAuth2Client, OAuth2Consent, OAuth2Token, authorization, client_registry, config_oauth,
+    refresh_token_expires_at, require_oauth, service_tokens, TokenRecord, WebhookOutbox, WebhookSubscription,
+    signing_keys, token_cache
+)
+from oauth_keys import SIGNING_ALG, is_jwt, jwt_header_unverified
+from report_aggregation import AggregationCache, DEFAULT_PERCENTILES, SubmissionFrame
+from report_scheduler import ReportScheduler, parse_periodicity
+from role_index import RoleMembershipIndex
+from schedule_index import ScheduleIndex, resource_keys
+from submission_ingest import BatchWriter
+from webhook_dispatcher import Subscription, WebhookDispatcher, make_event
 
 """
 Создание и конфигурация Flask приложения.
@@ -18,15 +51,25 @@ import smtplib
 app = Flask(__name__)
 
 app.config['SECRET_KEY'] = 'dev-secret-key-change-in-production'
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///university.db'
+app.config['SQLALCHEMY_DATABASE_URI'] = database_uri()
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config['SQLALCHEMY_DATABASE_URI'])
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['JWT_SECRET_KEY'] = 'jwt-secret-string'
 app.config['JWT_ACCESS_TOKEN_EXPIRES'] = timedelta(hours=1)
 app.config['JWT_REFRESH_TOKEN_EXPIRES'] = timedelta(days=30)
-
-db = SQLAlchemy(app)
+app.config['OAUTH2_REFRESH_TOKEN_GENERATOR'] = True
+app.config['OAUTH2_REFRESH_TOKEN_EXPIRES_IN'] = 30 * 86400
+app.config['OAUTH2_TOKEN_EXPIRES_IN'] = {'authorization_code': 3600, 'refresh_token': 3600, 'client_credentials': 3600}
+app.config['OAUTH2_JWT_ACCESS_TOKENS'] = False  # True - выдавать JWT access token (RFC 9068)
+app.config['OAUTH2_JWT_ISSUER'] = 'http://localhost:5000'
+app.config['OAUTH2_CODE_STORE'] = os.environ.get('OAUTH2_CODE_STORE', 'database')  # 'memory' - только для одного процесса
+
+db.init_app(app)
+with app.app_context():
+    install_sqlite_pragmas(db.engine, sqlite_pragmas())
 jwt = JWTManager(app)
 CORS(app, supports_credentials=True)
+config_oauth(app)
 
 app.config['MAIL_SERVER'] = 'email.melsu.ru'
 app.config['MAIL_PORT'] = 587
@@ -84,11 +127,14 @@ class UserProfile(db.Model):
         middle_name (str, optional): Отчество пользователя.
         birth_date (date, optional): Дата рождения пользователя.
         gender (str, optional): Пол пользователя.
-        department (str, optional): Отдел (для сотрудников).
+        department (str, optional): Название отдела (для сотрудников), устаревшее текстовое поле.
+        department_id (int, optional): Внешний ключ к 'department.id' (для сотрудников).
         position (str, optional): Должность (для сотрудников).
         course (int, optional): Курс (для студентов).
         group_name (str, optional): Название группы (для студентов).
         school (str, optional): Школа (для школьников).
+        version_id (int): Версия записи; параллельное изменение профиля отклоняется,
+            поэтому перенос между подразделениями не учитывается в численности дважды.
     """
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
@@ -99,10 +145,20 @@ class UserProfile(db.Model):
     gender = db.Column(db.String(10))
 
     department = db.Column(db.String(100))  # для сотрудников
+    department_id = db.column_property(  # для сотрудников
+        db.Column(db.Integer, db.ForeignKey('department.id'), index=True),
+        active_history=True
+    )
     position = db.Column(db.String(100))  # для сотрудников
     course = db.Column(db.Integer)  # для студентов
     group_name = db.Column(db.String(20))  # для студентов
     school = db.Column(db.String(200))  # для школьников
+    version_id = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+
+    __table_args__ = (
+        db.Index('ix_user_profile_course_group', 'course', 'group_name'),
+    )
+    __mapper_args__ = {'version_id_col': version_id}
 
 
 class Role(db.Model):
@@ -192,14 +248,216 @@ class Form(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(200), nullable=False)
     description = db.Column(db.Text)
-    form_type = db.Column(db.String(50))
-    responsible = db.Column(db.String(100))
-    period = db.Column(db.String(50))
+    form_type = db.Column(db.String(50), index=True)
+    responsible = db.Column(db.String(100), index=True)
+    period = db.Column(db.String(50), index=True)
     fields = db.Column(db.Text)
     created_by = db.Column(db.Integer, db.ForeignKey('user.id'))
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
 
+class FormSubmission(db.Model):
+    """
+    Модель заполненных форм (ответов пользователей на отчеты и заявки).
+    Для каждой формы, периода и пользователя хранится одна запись;
+    повторная отправка заменяет данные.
+
+    Атрибуты:
+        id (int): Уникальный идентификатор записи.
+        form_id (int): Внешний ключ к 'form.id'.
+        user_id (int): Внешний ключ к 'user.id' (автор ответа).
+        department_id (int, optional): Внешний ключ к 'department.id' (подразделение автора на момент отправки).
+        period (str): Отчетный период, к которому относится ответ (пустая строка для непериодических форм).
+        data (str): JSON-строка с проверенными значениями полей формы.
+        created_at (datetime): Дата и время первой отправки.
+        updated_at (datetime): Дата и время последнего изменения.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    form_id = db.Column(db.Integer, db.ForeignKey('form.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    department_id = db.Column(db.Integer, db.ForeignKey('department.id'))
+    period = db.Column(db.String(50), nullable=False, default='')
+    data = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.UniqueConstraint('form_id', 'period', 'user_id', name='uq_form_submission'),
+    )
+
+
+class ReportTask(db.Model):
+    """
+    Модель заданий на сдачу периодических отчетов.
+    Задания создаются планировщиком отчетов для ответственного за форму
+    на каждый отчетный период.
+
+    Атрибуты:
+        id (int): Уникальный идентификатор задания.
+        form_id (int): Внешний ключ к 'form.id'.
+        period (str): Метка отчетного периода (например, '2025-09', '2025-Q3').
+        responsible (str): Ответственный за форму (значение Form.responsible).
+        department_id (int, optional): Внешний ключ к 'department.id', если ответственный - подразделение.
+        due_at (datetime): Срок сдачи отчета.
+        status (str): Статус задания ('pending' или 'done').
+        created_at (datetime): Дата и время создания задания.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    form_id = db.Column(db.Integer, db.ForeignKey('form.id'), nullable=False)
+    period = db.Column(db.String(50), nullable=False)
+    responsible = db.Column(db.String(100), nullable=False, default='')
+    department_id = db.Column(db.Integer, db.ForeignKey('department.id'))
+    due_at = db.Column(db.DateTime, nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='pending')
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.UniqueConstraint('form_id', 'period', 'responsible', name='uq_report_task'),
+        db.Index('ix_report_task_status_due', 'status', 'due_at'),
+    )
+
+
+class Application(db.Model):
+    """
+    Модель заявок - ответов на формы типа 'заявки', проходящих рассмотрение.
+
+    Атрибуты:
+        id (int): Уникальный идентификатор заявки.
+        form_id (int): Внешний ключ к 'form.id'.
+        applicant_id (int): Внешний ключ к 'user.id' (автор заявки).
+        assignee_id (int, optional): Внешний ключ к 'user.id' (рассматривающий заявку).
+        status (str): Статус заявки ('submitted', 'in_review', 'approved', 'rejected').
+        data (str): JSON-строка с проверенными значениями полей формы.
+        comment (str, optional): Комментарий рассматривающего.
+        created_at (datetime): Дата и время подачи заявки.
+        updated_at (datetime): Дата и время последнего изменения статуса.
+        version_id (int): Версия записи; из двух параллельных изменений статуса или
+            назначения фиксируется только первое, и счетчики заявок не расходятся.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    form_id = db.Column(db.Integer, db.ForeignKey('form.id'), nullable=False)
+    applicant_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    assignee_id = db.column_property(
+        db.Column(db.Integer, db.ForeignKey('user.id')),
+        active_history=True
+    )
+    status = db.column_property(
+        db.Column(db.String(20), nullable=False, default='submitted'),
+        active_history=True
+    )
+    data = db.Column(db.Text, nullable=False)
+    comment = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+    version_id = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+
+    form = db.relationship('Form')
+    applicant = db.relationship('User', foreign_keys=[applicant_id])
+    assignee = db.relationship('User', foreign_keys=[assignee_id])
+
+    __table_args__ = (
+        db.Index('ix_application_assignee_status', 'assignee_id', 'status', 'id'),
+        db.Index('ix_application_applicant_status', 'applicant_id', 'status', 'id'),
+        db.Index('ix_application_status', 'status', 'id'),
+    )
+    __mapper_args__ = {'version_id_col': version_id}
+
+
+class ApplicationCounter(db.Model):
+    """
+    Предрассчитанное количество заявок по рассматривающему и статусу.
+    Используется для счетчиков на панели без COUNT(*) по заявкам.
+
+    Атрибуты:
+        assignee_id (int): Идентификатор рассматривающего (0 - заявка не назначена).
+        status (str): Статус заявки.
+        count (int): Количество заявок.
+    """
+    assignee_id = db.Column(db.Integer, primary_key=True)
+    status = db.Column(db.String(20), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+
+class UploadSession(db.Model):
+    """
+    Модель незавершенных загрузок вложений.
+    Принятые данные хранятся во временном файле хранилища вложений,
+    объем принятого определяется по размеру этого файла.
+
+    Атрибуты:
+        id (str): Идентификатор загрузки (UUID в шестнадцатеричном виде).
+        user_id (int): Внешний ключ к 'user.id' (кто загружает файл).
+        filename (str): Исходное имя файла.
+        content_type (str, optional): MIME-тип файла.
+        size (int): Заявленный размер файла в байтах.
+        created_at (datetime): Дата и время начала загрузки.
+    """
+    id = db.Column(db.String(32), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    filename = db.Column(db.String(255), nullable=False)
+    content_type = db.Column(db.String(100))
+    size = db.Column(db.BigInteger, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class Attachment(db.Model):
+    """
+    Модель вложений (файлов, прикрепленных к полям форм типа 'file').
+    Содержимое хранится один раз на каждый уникальный хеш SHA-256,
+    несколько вложений могут ссылаться на один объект хранилища.
+
+    Атрибуты:
+        id (str): Идентификатор вложения (значение поля формы типа 'file').
+        sha256 (str): Хеш содержимого (адрес объекта в хранилище).
+        size (int): Размер файла в байтах.
+        filename (str): Исходное имя файла.
+        content_type (str, optional): MIME-тип файла.
+        uploaded_by (int): Внешний ключ к 'user.id'.
+        created_at (datetime): Дата и время завершения загрузки.
+    """
+    id = db.Column(db.String(32), primary_key=True)
+    sha256 = db.Column(db.String(64), nullable=False, index=True)
+    size = db.Column(db.BigInteger, nullable=False)
+    filename = db.Column(db.String(255), nullable=False)
+    content_type = db.Column(db.String(100))
+    uploaded_by = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class ScheduleSlot(db.Model):
+    """
+    Модель занятий в расписании.
+    Каждое занятие - конкретный интервал времени, занимающий группу,
+    преподавателя и аудиторию; пересечения по любому из них запрещены.
+
+    Атрибуты:
+        id (int): Уникальный идентификатор занятия.
+        subject (str): Название дисциплины.
+        lesson_type (str, optional): Вид занятия (лекция, практика, лабораторная).
+        group_name (str, optional): Студенческая группа.
+        teacher_id (int, optional): Внешний ключ к 'user.id' (преподаватель).
+        room (str, optional): Аудитория.
+        starts_at (datetime): Начало занятия.
+        ends_at (datetime): Окончание занятия.
+        created_by (int, optional): Внешний ключ к 'user.id'.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    subject = db.Column(db.String(200), nullable=False)
+    lesson_type = db.Column(db.String(50))
+    group_name = db.Column(db.String(20))
+    teacher_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    room = db.Column(db.String(50))
+    starts_at = db.Column(db.DateTime, nullable=False)
+    ends_at = db.Column(db.DateTime, nullable=False)
+    created_by = db.Column(db.Integer, db.ForeignKey('user.id'))
+
+    __table_args__ = (
+        db.Index('ix_schedule_slot_group', 'group_name', 'starts_at'),
+        db.Index('ix_schedule_slot_teacher', 'teacher_id', 'starts_at'),
+        db.Index('ix_schedule_slot_room', 'room', 'starts_at'),
+    )
+
+
 class Department(db.Model):
     """
     Модель структурных подразделений университета.
@@ -213,6 +471,8 @@ class Department(db.Model):
         head_user_id (int, optional): Внешний ключ к 'user.id' (руководитель подразделения).
         created_by (int, optional): Внешний ключ к 'user.id' (создатель записи о подразделении).
         created_at (datetime): Дата и время создания записи.
+        headcount (int): Число сотрудников, непосредственно закрепленных за подразделением.
+        subtree_headcount (int): Число сотрудников подразделения вместе со всеми дочерними.
         parent (Department): Связь с родительским подразделением.
         children (list[Department]): Список дочерних подразделений.
         head (User): Пользователь, являющийся руководителем подразделения.
@@ -222,16 +482,368 @@ class Department(db.Model):
     name = db.Column(db.String(200), nullable=False)
     short_name = db.Column(db.String(50))
     description = db.Column(db.Text)
-    parent_id = db.Column(db.Integer, db.ForeignKey('department.id'))
+    parent_id = db.column_property(
+        db.Column(db.Integer, db.ForeignKey('department.id')),
+        active_history=True
+    )
     head_user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
     created_by = db.Column(db.Integer, db.ForeignKey('user.id'))
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    headcount = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    subtree_headcount = db.Column(db.Integer, nullable=False, default=0, server_default='0')
 
     parent = db.relationship('Department', remote_side=[id], backref='children')
+    staff = db.relationship('UserProfile', backref='department_ref')
     head = db.relationship('User', foreign_keys=[head_user_id], backref='headed_departments')
     creator = db.relationship('User', foreign_keys=[created_by], backref='created_departments')
 
 
+"""
+================= СЧЕТЧИКИ ЧИСЛЕННОСТИ =================
+Поддержание предрассчитанной численности подразделений.
+Изменения профилей и перемещения подразделений собираются перед flush
+и применяются атомарными UPDATE в той же транзакции, поэтому при чтении
+структуры не требуется ни одного COUNT(*). Параллельное изменение одного
+профиля отклоняется по столбцу версии UserProfile.version_id.
+"""
+
+def _department_chain(connection, dept_id):
+    """
+    Возвращает идентификаторы подразделения и всех его предков (снизу вверх).
+
+    Args:
+        connection: Соединение SQLAlchemy текущей транзакции.
+        dept_id (int): Идентификатор начального подразделения.
+
+    Returns:
+        list[int]: Цепочка идентификаторов до корня структуры.
+    """
+    chain = []
+    while dept_id is not None and dept_id not in chain:
+        chain.append(dept_id)
+        dept_id = connection.execute(
+            select(Department.parent_id).where(Department.id == dept_id)
+        ).scalar()
+    return chain
+
+
+@event.listens_for(db.session, 'before_flush')
+def _collect_headcount_changes(session, flush_context, instances):
+    """Собирает изменения численности из новых, измененных и удаленных профилей."""
+    profile_deltas = session.info.setdefault('headcount_deltas', {})
+    moves = session.info.setdefault('department_moves', [])
+
+    def add(dept_id, delta):
+        if dept_id is not None:
+            profile_deltas[dept_id] = profile_deltas.get(dept_id, 0) + delta
+
+    for obj in session.new:
+        if isinstance(obj, UserProfile):
+            add(obj.department_id, 1)
+
+    for obj in session.deleted:
+        if isinstance(obj, UserProfile):
+            history = sa_inspect(obj).attrs.department_id.history
+            add(history.deleted[0] if history.deleted else obj.department_id, -1)
+
+    for obj in session.dirty:
+        if isinstance(obj, UserProfile):
+            history = sa_inspect(obj).attrs.department_id.history
+            if history.has_changes():
+                add((history.deleted or [None])[0], -1)
+                add((history.added or [None])[0], 1)
+        elif isinstance(obj, Department) and obj.id is not None:
+            history = sa_inspect(obj).attrs.parent_id.history
+            if history.has_changes():
+                moves.append((obj.id, (history.deleted or [None])[0], obj.parent_id))
+
+
+@event.listens_for(db.session, 'after_flush')
+def _apply_headcount_changes(session, flush_context):
+    """Применяет накопленные изменения численности атомарными UPDATE."""
+    profile_deltas = session.info.pop('headcount_deltas', {})
+    moves = session.info.pop('department_moves', [])
+    if not any(profile_deltas.values()) and not moves:
+        return
+
+    connection = session.connection()
+    table = Department.__table__
+    touched = set()
+
+    def shift_subtree(dept_ids, delta):
+        if dept_ids and delta:
+            connection.execute(
+                table.update()
+                .where(table.c.id.in_(dept_ids))
+                .values(subtree_headcount=table.c.subtree_headcount + delta)
+            )
+            touched.update(dept_ids)
+
+    for dept_id, old_parent_id, new_parent_id in moves:
+        moved = connection.execute(
+            select(table.c.subtree_headcount).where(table.c.id == dept_id)
+        ).scalar() or 0
+        shift_subtree(_department_chain(connection, old_parent_id), -moved)
+        shift_subtree(_department_chain(connection, new_parent_id), moved)
+
+    for dept_id, delta in profile_deltas.items():
+        if not delta:
+            continue
+        connection.execute(
+            table.update()
+            .where(table.c.id == dept_id)
+            .values(headcount=table.c.headcount + delta)
+        )
+        shift_subtree(_department_chain(connection, dept_id), delta)
+
+    session.info['headcount_touched'] = touched
+
+
+@event.listens_for(db.session, 'after_flush_postexec')
+def _expire_headcounts(session, flush_context):
+    """Сбрасывает устаревшие значения счетчиков у загруженных подразделений."""
+    touched = session.info.pop('headcount_touched', None)
+    if not touched:
+        return
+    for obj in list(session.identity_map.values()):
+        if isinstance(obj, Department) and obj.id in touched:
+            session.expire(obj, ['headcount', 'subtree_headcount'])
+
+
+def recalculate_department_headcounts():
+    """
+    Полностью пересчитывает численность всех подразделений.
+    Используется после миграции и для восстановления счетчиков.
+    """
+    direct = dict(db.session.execute(
+        select(UserProfile.department_id, db.func.count(UserProfile.id))
+        .where(UserProfile.department_id.isnot(None))
+        .group_by(UserProfile.department_id)
+    ).all())
+    parents = dict(db.session.execute(select(Department.id, Department.parent_id)).all())
+
+    subtree = dict.fromkeys(parents, 0)
+    for dept_id, count in direct.items():
+        seen = set()
+        while dept_id in subtree and dept_id not in seen:
+            seen.add(dept_id)
+            subtree[dept_id] += count
+            dept_id = parents[dept_id]
+
+    table = Department.__table__
+    for dept_id in parents:
+        db.session.execute(
+            table.update()
+            .where(table.c.id == dept_id)
+            .values(headcount=direct.get(dept_id, 0), subtree_headcount=subtree[dept_id])
+        )
+    db.session.commit()
+    print("👥 Численность подразделений пересчитана")
+
+
+"""
+================= ИНДЕКС РОЛЕЙ =================
+Индекс принадлежности пользователей к ролям в памяти процесса.
+Изменения связи User.roles фиксируются при flush и применяются к индексу
+только после успешного commit; при откате они отбрасываются. Изменения,
+сделанные другими процессами, учитываются при перечитывании индекса
+раз в ROLE_INDEX_TTL секунд.
+"""
+
+ROLE_INDEX_TTL = 30
+
+role_index = RoleMembershipIndex()
+_role_index_expires = 0.0
+
+
+def _reload_role_index():
+    global _role_index_expires
+    expires = time.monotonic() + ROLE_INDEX_TTL
+    role_index.load(db.session.execute(select(user_roles.c.role_id, user_roles.c.user_id)).all())
+    _role_index_expires = expires
+
+
+def load_role_index():
+    """Заполняет индекс ролей из таблицы user_roles."""
+    _reload_role_index()
+    print(f"🧮 Индекс ролей загружен: {sum(role_index.counts().values())} назначений")
+
+
+def get_role_index():
+    """Возвращает индекс ролей, загружая его при первом обращении и по истечении ROLE_INDEX_TTL."""
+    if not role_index.loaded or _role_index_expires <= time.monotonic():
+        _reload_role_index()
+    return role_index
+
+
+@event.listens_for(db.session, 'after_flush')
+def _collect_role_changes(session, flush_context):
+    """Запоминает изменения назначений ролей до фиксации транзакции."""
+    ops = session.info.setdefault('role_ops', [])
+    for obj in session.deleted:
+        if isinstance(obj, User):
+            ops.append(('remove_user', None, obj.id))
+    for obj in (*session.new, *session.dirty):
+        if isinstance(obj, User):
+            history = sa_inspect(obj).attrs.roles.history
+            ops.extend(('add', role.id, obj.id) for role in history.added)
+            ops.extend(('remove', role.id, obj.id) for role in history.deleted)
+
+
+@event.listens_for(db.session, 'after_commit')
+def _apply_role_changes(session):
+    """Применяет зафиксированные изменения назначений ролей к индексу."""
+    ops = session.info.pop('role_ops', None)
+    if not ops or not role_index.loaded:
+        return
+    for op, role_id, user_id in ops:
+        if op == 'add':
+            role_index.add(role_id, user_id)
+        elif op == 'remove':
+            role_index.remove(role_id, user_id)
+        else:
+            role_index.remove_user(user_id)
+
+
+@event.listens_for(db.session, 'after_soft_rollback')
+def _discard_role_changes(session, previous_transaction):
+    """Отбрасывает изменения назначений ролей отмененной транзакции."""
+    session.info.pop('role_ops', None)
+
+
+"""
+================= СЧЕТЧИКИ ЗАЯВОК =================
+Количество заявок по рассматривающему и статусу хранится в таблице
+application_counter и обновляется в той же транзакции, что и сами заявки,
+поэтому счетчики на панели читаются без COUNT(*) по таблице заявок.
+Приращения считаются от прежних значений загруженной заявки; столбец
+версии отклоняет запись заявки, уже измененной параллельной транзакцией
+(StaleDataError), поэтому одно изменение не учитывается дважды.
+"""
+
+@event.listens_for(db.session, 'before_flush')
+def _collect_application_counts(session, flush_context, instances):
+    """Собирает изменения счетчиков заявок по рассматривающему и статусу."""
+    deltas = session.info.setdefault('application_deltas', {})
+
+    def add(assignee_id, status, delta):
+        key = (assignee_id or 0, status)
+        deltas[key] = deltas.get(key, 0) + delta
+
+    for obj in session.new:
+        if isinstance(obj, Application):
+            add(obj.assignee_id, obj.status or 'submitted', 1)
+
+    for obj in session.deleted:
+        if isinstance(obj, Application):
+            state = sa_inspect(obj).attrs
+            assignee = state.assignee_id.history.deleted or [obj.assignee_id]
+            status = state.status.history.deleted or [obj.status]
+            add(assignee[0], status[0], -1)
+
+    for obj in session.dirty:
+        if isinstance(obj, Application):
+            state = sa_inspect(obj).attrs
+            assignee, status = state.assignee_id.history, state.status.history
+            if assignee.has_changes() or status.has_changes():
+                add((assignee.deleted or [obj.assignee_id])[0], (status.deleted or [obj.status])[0], -1)
+                add(obj.assignee_id, obj.status, 1)
+
+
+@event.listens_for(db.session, 'after_flush')
+def _apply_application_counts(session, flush_context):
+    """Применяет изменения счетчиков заявок одним UPSERT в той же транзакции."""
+    deltas = {key: delta for key, delta in session.info.pop('application_deltas', {}).items() if delta}
+    if not deltas:
+        return
+
+    table = ApplicationCounter.__table__
+    dialect = postgresql if session.get_bind().dialect.name == 'postgresql' else sqlite
+    stmt = dialect.insert(table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['assignee_id', 'status'],
+        set_={'count': table.c.count + stmt.excluded.count}
+    )
+    session.connection().execute(stmt, [
+        {'assignee_id': assignee_id, 'status': status, 'count': delta}
+        for (assignee_id, status), delta in deltas.items()
+    ])
+
+
+"""
+================= МИГРАЦИИ =================
+Обновление схемы существующей базы данных: db.create_all() создает только
+отсутствующие таблицы, поэтому новые столбцы и индексы добавляются здесь.
+"""
+
+def ensure_schema():
+    """
+    Добавляет в существующие таблицы отсутствующие столбцы и индексы моделей.
+
+    Returns:
+        list[str]: Список добавленных столбцов в формате 'таблица.столбец'.
+    """
+    inspector = sa_inspect(db.engine)
+    existing_tables = set(inspector.get_table_names())
+    added = []
+
+    with db.engine.begin() as connection:
+        for table in db.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            existing_columns = {c['name'] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing_columns:
+                    continue
+                ddl = f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" ' \
+                      f'{column.type.compile(dialect=db.engine.dialect)}'
+                if column.server_default is not None:
+                    ddl += f" DEFAULT {column.server_default.arg}"
+                    if not column.nullable:
+                        ddl += " NOT NULL"
+                for fk in column.foreign_keys:
+                    ddl += f' REFERENCES "{fk.column.table.name}" ("{fk.column.name}")'
+                connection.execute(text(ddl))
+                added.append(f"{table.name}.{column.name}")
+
+            for index in table.indexes:
+                index.create(connection, checkfirst=True)
+
+    if added:
+        print(f"🛠️ Добавлены столбцы: {', '.join(added)}")
+    return added
+
+
+def migrate_profile_departments():
+    """
+    Сопоставляет текстовое поле UserProfile.department с подразделениями
+    по полному или краткому названию и заполняет department_id.
+    После сопоставления пересчитывает численность подразделений.
+    """
+    lookup = {}
+    for dept in Department.query.all():
+        for name in (dept.short_name, dept.name):
+            if name:
+                lookup[name.strip().lower()] = dept.id
+
+    profiles = UserProfile.query.filter(
+        UserProfile.department_id.is_(None),
+        UserProfile.department.isnot(None)
+    ).all()
+
+    mapped = 0
+    for profile in profiles:
+        dept_id = lookup.get(profile.department.strip().lower())
+        if dept_id:
+            profile.department_id = dept_id
+            mapped += 1
+
+    db.session.commit()
+    if profiles:
+        print(f"🔗 Сопоставлено подразделений в профилях: {mapped} из {len(profiles)}")
+    recalculate_department_headcounts()
+
+
 """
 ================= УТИЛИТЫ =================
 Вспомогательные функции, используемые в различных частях приложения.
@@ -347,6 +959,49 @@ def create_default_roles():
     print("✅ Базовые роли созданы")
 
 
+def _is_oauth_bearer():
+    """
+    Проверяет, передан ли в заголовке Authorization токен OAuth2, а не JWT портала.
+    Токены OAuth2 - непрозрачные строки или JWT с подписью ключом сервера (RS256),
+    JWT портала подписываются секретом приложения (HS256).
+    """
+    scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+    if scheme.lower() != 'bearer' or not token:
+        return False
+    if not is_jwt(token):
+        return True
+    try:
+        return jwt_header_unverified(token).get('alg') == SIGNING_ALG
+    except (ValueError, AttributeError):
+        return False
+
+
+def jwt_or_oauth_required(scope):
+    """
+    Декоратор эндпоинта, доступного и пользователям портала, и внешним
+    сервисам. Запрос принимается с JWT портала (проверки ролей остаются
+    в эндпоинте) или с access token OAuth2 с областью scope, в том числе
+    выданным сервису по client_credentials. При доступе по OAuth2 токен
+    доступен через current_token, JWT портала в запросе нет.
+
+    Args:
+        scope (str): Требуемая область доступа OAuth2.
+    """
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            if _is_oauth_bearer():
+                try:
+                    require_oauth.acquire_token([scope])
+                except OAuth2Error as error:
+                    require_oauth.raise_error_response(error)
+            else:
+                verify_jwt_in_request()
+            return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
 """
 ================= API РЕГИСТРАЦИИ =================
 Эндпоинты, отвечающие за многошаговый процесс регистрации новых пользователей.
@@ -737,6 +1392,7 @@ def get_profile():
             'middle_name': user.profile.middle_name,
             'gender': user.profile.gender,
             'department': user.profile.department,
+            'department_id': user.profile.department_id,
             'position': user.profile.position,
             'course': user.profile.course,
             'group_name': user.profile.group_name,
@@ -752,15 +1408,46 @@ def get_profile():
 Доступно только для администраторов.
 """
 
+form_schema_cache = FormSchemaCache()
+
+
+def get_compiled_form(form):
+    """
+    Возвращает скомпилированную схему формы из LRU-кэша.
+
+    Args:
+        form (Form): Форма, схему которой нужно получить.
+
+    Returns:
+        CompiledForm: Схема с проверками полей.
+    """
+    return form_schema_cache.get(form.id, form.fields)
+
+
+FORMS_PAGE_SIZE = 50
+FORMS_MAX_PAGE_SIZE = 200
+FORM_LIST_FIELDS = ('id', 'name', 'description', 'type', 'responsible', 'period', 'fields', 'create', 'status')
+
+
 @app.route('/api/forms', methods=['GET'])
 @jwt_required()
 def get_forms():
     """
-    Получение списка всех созданных форм.
+    Получение списка созданных форм.
     Доступно только пользователям с ролью 'admin'.
 
+    Без параметров limit и cursor возвращается список всех форм, как и
+    раньше. Keyset-пагинация включается, если передан хотя бы один из них.
+
+    Параметры запроса:
+        type, period, responsible: фильтры по соответствующим атрибутам формы.
+        fields: список возвращаемых атрибутов через запятую (например, 'id,name,type').
+            Если 'fields' в него не входит, описание полей формы не загружается и не разбирается.
+        limit: размер страницы.
+        cursor: значение next_cursor из предыдущего ответа (для первой страницы - 0).
+
     Returns:
-        JSON: Список форм с их атрибутами.
+        JSON: Список форм или, при пагинации, {'items': [...], 'next_cursor': int | None}
     """
     current_user_id = get_jwt_identity()
     user = User.query.get(current_user_id)
@@ -768,22 +1455,53 @@ def get_forms():
     if 'admin' not in user_roles:
         return jsonify({'error': 'Недостаточно прав'}), 403
 
-    forms = Form.query.all()
+    requested = request.args.get('fields')
+    if requested:
+        selected = [name.strip() for name in requested.split(',') if name.strip()]
+        unknown = [name for name in selected if name not in FORM_LIST_FIELDS]
+        if unknown:
+            return jsonify({'error': f"Неизвестные поля: {', '.join(unknown)}"}), 400
+    else:
+        selected = list(FORM_LIST_FIELDS)
+
+    paginated = 'limit' in request.args or 'cursor' in request.args
+    limit = min(max(request.args.get('limit', FORMS_PAGE_SIZE, type=int), 1), FORMS_MAX_PAGE_SIZE)
+    cursor = request.args.get('cursor', 0, type=int)
+
+    query = Form.query.filter(Form.id > cursor)
+    for param, column in (('type', Form.form_type), ('period', Form.period), ('responsible', Form.responsible)):
+        value = request.args.get(param)
+        if value is not None:
+            query = query.filter(column == value)
+    if 'fields' not in selected:
+        query = query.options(db.defer(Form.fields))
+    if 'description' not in selected:
+        query = query.options(db.defer(Form.description))
+
+    query = query.order_by(Form.id)
+    forms = query.limit(limit + 1).all() if paginated else query.all()
+
     forms_data = []
-    for form in forms:
-        fields = json.loads(form.fields) if form.fields else []
-        forms_data.append({
+    for form in (forms[:limit] if paginated else forms):
+        form_data = {
             'id': form.id,
             'name': form.name,
-            'description': form.description,
             'type': form.form_type,
             'responsible': form.responsible,
             'period': form.period,
-            'fields': fields,
             'create': form.created_at.strftime('%d.%m.%Y'),
             'status': 'Активна'
-        })
-    return jsonify(forms_data), 200
+        }
+        if 'description' in selected:
+            form_data['description'] = form.description
+        if 'fields' in selected:
+            form_data['fields'] = json.loads(form.fields) if form.fields else []
+        forms_data.append({name: form_data[name] for name in selected})
+
+    if not paginated:
+        return jsonify(forms_data), 200
+    next_cursor = forms[limit - 1].id if len(forms) > limit else None
+    return jsonify({'items': forms_data, 'next_cursor': next_cursor}), 200
 
 
 @app.route('/api/forms', methods=['POST'])
@@ -804,6 +1522,12 @@ def create_form():
         return jsonify({'error': 'Недостаточно прав'}), 403
 
     data = request.get_json()
+    fields_json = json.dumps(data.get('fields', []))
+    try:
+        compile_form(fields_json)
+    except FormDefinitionError as e:
+        return jsonify({'error': str(e)}), 400
+
     try:
         form = Form(
             name=data.get('name'),
@@ -811,11 +1535,12 @@ def create_form():
             form_type=data.get('type'),
             responsible=data.get('responsible'),
             period=data.get('period'),
-            fields=json.dumps(data.get('fields', [])),
+            fields=fields_json,
             created_by=current_user_id
         )
         db.session.add(form)
         db.session.commit()
+        schedule_form_reports(form)
 
         print(f"📄 Создана форма '{form.name}' пользователем {user.username}")
         return jsonify({
@@ -854,8 +1579,15 @@ def delete_form(form_id):
 
     try:
         form_name = form.name
+        FormSubmission.query.filter_by(form_id=form_id).delete()
+        ReportTask.query.filter_by(form_id=form_id).delete()
+        for application in Application.query.filter_by(form_id=form_id):
+            db.session.delete(application)
         db.session.delete(form)
         db.session.commit()
+        form_schema_cache.invalidate(form_id)
+        report_cache.invalidate_form(form_id)
+        report_scheduler.unschedule(form_id)
 
         print(f"🗑️ Удалена форма '{form_name}' пользователем {user.username}")
         return jsonify({'message': 'Форма удалена'}), 200
@@ -866,109 +1598,2539 @@ def delete_form(form_id):
         return jsonify({'error': 'Ошибка удаления формы'}), 500
 
 
+@app.route('/api/forms/<int:form_id>/validate', methods=['POST'])
+@jwt_required()
+def validate_form_data(form_id):
+    """
+    Проверка данных формы без сохранения.
+    Принимает JSON: {'data': {ключ поля: значение}}.
+
+    Args:
+        form_id (int): Идентификатор формы.
+
+    Returns:
+        JSON: Проверенные данные или ошибки по полям.
+    """
+    form = Form.query.get(form_id)
+    if not form:
+        return jsonify({'error': 'Форма не найдена'}), 404
+
+    data = request.get_json()
+    try:
+        cleaned = get_compiled_form(form).validate(data.get('data'))
+    except FormDefinitionError as e:
+        return jsonify({'error': str(e)}), 500
+    except FormValidationError as e:
+        return jsonify({'error': 'Данные формы содержат ошибки', 'fields': e.errors}), 400
+
+    return jsonify({'data': cleaned}), 200
+
+
 """
-================= API СТРУКТУРЫ =================
-Эндпоинты для управления структурными подразделениями университета.
-Доступно только для администраторов.
+================= API ОТВЕТОВ НА ФОРМЫ =================
+Прием заполненных форм. Проверенные ответы ставятся в очередь групповой
+записи и сохраняются пакетами в одной транзакции, поэтому массовая сдача
+отчетов не превращается в очередь однострочных commit в SQLite.
 """
 
-@app.route('/api/departments', methods=['GET'])
+SUBMISSION_COMMIT_TIMEOUT = 10
+SUBMISSIONS_MAX_BATCH = 500
+
+
+def _write_submissions(items):
+    """
+    Сохраняет пакет ответов одной транзакцией (INSERT ... ON CONFLICT DO UPDATE).
+    Повторы одного ключа внутри пакета сводятся к последнему значению.
+    В той же транзакции задания на отчет по форме и периоду отмечаются
+    выполненными (см. _complete_report_tasks).
+    """
+    unique = {(item['form_id'], item['period'], item['user_id']): item for item in items}
+    with app.app_context():
+        dialect = postgresql if db.engine.dialect.name == 'postgresql' else sqlite
+        stmt = dialect.insert(FormSubmission.__table__)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['form_id', 'period', 'user_id'],
+            set_={
+                'data': stmt.excluded.data,
+                'department_id': stmt.excluded.department_id,
+                'updated_at': stmt.excluded.updated_at
+            }
+        )
+        with db.engine.begin() as connection:
+            connection.execute(stmt, list(unique.values()))
+            _complete_report_tasks(connection, unique.values())
+
+
+def _complete_report_tasks(connection, items):
+    """
+    Отмечает выполненными ('done') задания на отчет, по которым поступили ответы.
+    Задание подразделения закрывает ответ сотрудника этого подразделения,
+    задание без подразделения - любой ответ на форму за период.
+    """
+    departments = {}
+    for item in items:
+        departments.setdefault((item['form_id'], item['period']), set()).add(item['department_id'])
+    tasks = ReportTask.__table__
+    for (form_id, period), department_ids in departments.items():
+        department_ids.discard(None)
+        connection.execute(tasks.update().where(
+            tasks.c.form_id == form_id,
+            tasks.c.period == period,
+            tasks.c.status == 'pending',
+            db.or_(tasks.c.department_id.is_(None), tasks.c.department_id.in_(department_ids))
+        ).values(status='done'))
+
+
+report_cache = AggregationCache()
+
+
+def _on_submissions_committed(items):
+    """Сбрасывает кэш агрегатов для форм и периодов, получивших новые ответы."""
+    for form_id, period in {(item['form_id'], item['period']) for item in items}:
+        report_cache.invalidate(form_id, period)
+
+
+submission_writer = BatchWriter(_write_submissions, on_commit=_on_submissions_committed)
+
+
+def _prepare_submission(form, user, period, data):
+    """
+    Проверяет ответ по схеме формы и формирует строку для записи.
+
+    Raises:
+        FormValidationError: Если данные не прошли проверку.
+    """
+    cleaned = get_compiled_form(form).validate(data)
+    now = datetime.utcnow()
+    return {
+        'form_id': form.id,
+        'user_id': user.id,
+        'department_id': user.profile.department_id if user.profile else None,
+        'period': period or '',
+        'data': json.dumps(cleaned, ensure_ascii=False),
+        'created_at': now,
+        'updated_at': now
+    }
+
+
+def _wait_for_commit(future):
+    """
+    Ожидает фиксации группы записей.
+
+    Returns:
+        tuple[Response, int] | None: Ответ об ошибке или None, если записи сохранены.
+    """
+    try:
+        future.result(timeout=SUBMISSION_COMMIT_TIMEOUT)
+    except FutureTimeoutError:
+        # Запись идемпотентна (повторная отправка заменяет ответ), поэтому
+        # запрос можно безопасно повторить, даже если группа еще будет записана
+        written = not future.cancel()
+        print(f"⏳ Ответы не сохранены за {SUBMISSION_COMMIT_TIMEOUT} с"
+              f"{' (запись продолжается)' if written else ''}")
+        response = jsonify({'error': 'Сервер занят, повторите отправку', 'retry': True})
+        response.headers['Retry-After'] = '1'
+        return response, 503
+    except Exception as e:
+        print(f"❌ Ошибка сохранения ответов: {e}")
+        return jsonify({'error': 'Ошибка сохранения ответа'}), 500
+    return None
+
+
+@app.route('/api/forms/<int:form_id>/submissions', methods=['POST'])
 @jwt_required()
-def get_departments():
+def submit_form(form_id):
     """
-    Получение иерархической структуры всех подразделений.
-    Доступно только пользователям с ролью 'admin'.
+    Отправка заполненной формы текущим пользователем.
+    Принимает JSON: {'period': '2025-09', 'data': {ключ поля: значение}}.
+    Повторная отправка за тот же период заменяет предыдущий ответ.
+
+    Args:
+        form_id (int): Идентификатор формы.
 
     Returns:
-        JSON: Древовидная структура подразделений.
+        JSON: Сообщение об успехе или ошибки проверки по полям.
     """
     current_user_id = get_jwt_identity()
     user = User.query.get(current_user_id)
-    user_roles = [role.name for role in user.roles]
-    if 'admin' not in user_roles:
-        return jsonify({'error': 'Недостаточно прав'}), 403
 
-    departments = Department.query.all()
+    form = Form.query.get(form_id)
+    if not form:
+        return jsonify({'error': 'Форма не найдена'}), 404
 
-    def build_tree(parent_id=None):
-        result = []
-        for dept in departments:
-            if dept.parent_id == parent_id:
-                dept_data = {
-                    'id': dept.id,
-                    'name': dept.name,
-                    'short_name': dept.short_name,
-                    'description': dept.description,
-                    'parent_id': dept.parent_id,
-                    'head': {
-                        'id': dept.head.id,
-                        'name': f"{dept.head.profile.last_name} {dept.head.profile.first_name}" if dept.head and dept.head.profile else None
-                    } if dept.head else None,
-                    'children': build_tree(dept.id),
-                    'created_at': dept.created_at.strftime('%d.%m.%Y')
-                }
-                result.append(dept_data)
-        return result
+    data = request.get_json()
+    try:
+        row = _prepare_submission(form, user, data.get('period'), data.get('data'))
+    except FormDefinitionError as e:
+        return jsonify({'error': str(e)}), 500
+    except FormValidationError as e:
+        return jsonify({'error': 'Данные формы содержат ошибки', 'fields': e.errors}), 400
 
-    tree = build_tree()
-    return jsonify(tree), 200
+    error = _wait_for_commit(submission_writer.submit(row))
+    if error:
+        return error
+    return jsonify({'message': 'Ответ сохранен'}), 201
 
 
-@app.route('/api/departments', methods=['POST'])
+@app.route('/api/submissions/batch', methods=['POST'])
 @jwt_required()
-def create_department():
+def submit_forms_batch():
     """
-    Создание нового структурного подразделения.
-    Доступно только пользователям с ролью 'admin'.
-    Принимает JSON с данными подразделения: name, short_name, description, parent_id, head_user_id.
+    Пакетная отправка заполненных форм текущим пользователем.
+    Принимает JSON: {'submissions': [{'form_id': 1, 'period': '2025-09', 'data': {...}}, ...]}.
+    Если хотя бы один ответ не проходит проверку, ничего не сохраняется;
+    проверенные ответы записываются одной транзакцией. При ответе 503
+    отправку можно повторить: повторные ответы заменяют сохраненные.
 
     Returns:
-        JSON: ID созданного подразделения и сообщение об успехе или ошибке.
+        JSON: Количество сохраненных ответов или ошибки по номерам ответов.
     """
     current_user_id = get_jwt_identity()
     user = User.query.get(current_user_id)
-    user_roles = [role.name for role in user.roles]
-    if 'admin' not in user_roles:
-        return jsonify({'error': 'Недостаточно прав'}), 403
 
-    data = request.get_json()
-    try:
-        department = Department(
-            name=data.get('name'),
+    submissions = (request.get_json() or {}).get('submissions') or []
+    if not isinstance(submissions, list) or not submissions:
+        return jsonify({'error': 'Список ответов пуст'}), 400
+    if len(submissions) > SUBMISSIONS_MAX_BATCH:
+        return jsonify({'error': f'Не более {SUBMISSIONS_MAX_BATCH} ответов за запрос'}), 400
+
+    def form_id_of(item):
+        form_id = item.get('form_id') if isinstance(item, dict) else None
+        return form_id if isinstance(form_id, int) and not isinstance(form_id, bool) else None
+
+    form_ids = {form_id_of(item) for item in submissions} - {None}
+    forms = {form.id: form for form in Form.query.filter(Form.id.in_(form_ids))} if form_ids else {}
+
+    rows, errors = [], {}
+    for position, item in enumerate(submissions):
+        if not isinstance(item, dict):
+            errors[position] = 'Ожидается объект'
+            continue
+        if form_id_of(item) is None:
+            errors[position] = 'Некорректный идентификатор формы'
+            continue
+        form = forms.get(item['form_id'])
+        if not form:
+            errors[position] = 'Форма не найдена'
+            continue
+        try:
+            rows.append(_prepare_submission(form, user, item.get('period'), item.get('data')))
+        except (FormDefinitionError, FormValidationError) as e:
+            errors[position] = getattr(e, 'errors', str(e))
+
+    if errors:
+        return jsonify({'error': 'Ответы содержат ошибки', 'submissions': errors}), 400
+
+    error = _wait_for_commit(submission_writer.submit_many(rows))
+    if error:
+        return error
+
+    print(f"📥 Пользователь {user.username} отправил {len(rows)} ответов")
+    return jsonify({'message': 'Ответы сохранены', 'count': len(rows)}), 201
+
+
+"""
+================= API СВОДНЫХ ОТЧЕТОВ =================
+Агрегация числовых полей ответов на отчетные формы. Ответы за период
+загружаются один раз в колоночные массивы NumPy; таблица и рассчитанные
+показатели хранятся в кэше до поступления новых ответов.
+"""
+
+def _load_submission_frame(form, period, keys):
+    """Загружает ответы на форму за период в колоночную таблицу."""
+    query = select(FormSubmission.department_id, FormSubmission.data).where(
+        FormSubmission.form_id == form.id,
+        FormSubmission.period == period
+    )
+    size = db.session.execute(
+        select(db.func.count()).select_from(query.subquery())
+    ).scalar()
+    rows = db.session.execute(query.execution_options(yield_per=10000))
+    return SubmissionFrame.from_rows(rows, keys, size_hint=size)
+
+
+def _department_descendants():
+    """
+    Возвращает для каждого подразделения множество из него самого и всех дочерних.
+
+    Returns:
+        dict[int, set[int]]: Потомки по идентификаторам подразделений.
+    """
+    parents = dict(db.session.execute(select(Department.id, Department.parent_id)).all())
+    descendants = {dept_id: {dept_id} for dept_id in parents}
+    for dept_id in parents:
+        parent_id, seen = parents[dept_id], {dept_id}
+        while parent_id is not None and parent_id in descendants and parent_id not in seen:
+            descendants[parent_id].add(dept_id)
+            seen.add(parent_id)
+            parent_id = parents[parent_id]
+    return descendants
+
+
+@app.route('/api/forms/<int:form_id>/report', methods=['GET'])
+@jwt_required()
+def get_form_report(form_id):
+    """
+    Сводный отчет по числовым полям формы за период.
+    Доступно только пользователям с ролью 'admin'.
+
+    Параметры запроса:
+        period: отчетный период (по умолчанию - ответы без периода).
+        group_by: 'department' (по подразделению автора) или 'subtree' (по поддеревьям структуры).
+        percentiles: перцентили через запятую (по умолчанию 50,90).
+        field: ключ поля, если нужен отчет только по нему.
+
+    Args:
+        form_id (int): Идентификатор формы.
+
+    Returns:
+        JSON: Количество ответов и показатели (count, sum, mean, min, max, перцентили) по полям.
+    """
+    current_user_id = get_jwt_identity()
+    user = User.query.get(current_user_id)
+    user_roles = [role.name for role in user.roles]
+    if 'admin' not in user_roles:
+        return jsonify({'error': 'Недостаточно прав'}), 403
+
+    form = Form.query.get(form_id)
+    if not form:
+        return jsonify({'error': 'Форма не найдена'}), 404
+
+    period = request.args.get('period', '')
+    group_by = request.args.get('group_by')
+    if group_by not in (None, 'department', 'subtree'):
+        return jsonify({'error': "group_by должен быть 'department' или 'subtree'"}), 400
+
+    try:
+        percentiles = tuple(
+            float(p) for p in request.args.get('percentiles', '').split(',') if p.strip()
+        ) or DEFAULT_PERCENTILES
+    except ValueError:
+        return jsonify({'error': 'Неверный формат перцентилей'}), 400
+    if any(not math.isfinite(p) or p < 0 or p > 100 for p in percentiles):
+        return jsonify({'error': 'Перцентили должны быть в диапазоне 0..100'}), 400
+
+    numeric = [field for field in get_compiled_form(form).fields if field.is_numeric]
+    keys = [field.key for field in numeric]
+    if request.args.get('field'):
+        numeric = [field for field in numeric if field.key == request.args['field']]
+        if not numeric:
+            return jsonify({'error': 'Числовое поле не найдено'}), 404
+
+    frame = report_cache.get(form.id, period, lambda: _load_submission_frame(form, period, keys))
+
+    names = {}
+    descendants = None
+    if group_by:
+        names = dict(db.session.execute(select(Department.id, Department.name)).all())
+        if group_by == 'subtree':
+            descendants = _department_descendants()
+
+    def compute(field):
+        report = {'label': field.label, 'summary': frame.summary(field.key, percentiles)}
+        if group_by == 'department':
+            groups = frame.by_department(field.key, percentiles)
+        elif group_by == 'subtree':
+            groups = frame.by_subtree(field.key, descendants, percentiles)
+        else:
+            return report
+        report['groups'] = [
+            {'department_id': None if dept_id == -1 else dept_id,
+             'department': names.get(dept_id), **stats}
+            for dept_id, stats in groups.items()
+        ]
+        return report
+
+    fields = {
+        field.key: frame.cached((field.key, group_by, percentiles), lambda field=field: compute(field))
+        for field in numeric
+    }
+    return jsonify({
+        'form_id': form.id,
+        'period': period,
+        'submissions': frame.size,
+        'fields': fields
+    }), 200
+
+
+"""
+================= API ВЫГРУЗКИ =================
+Потоковая выгрузка форм и ответов в CSV и XLSX. Строки читаются из БД
+порциями (yield_per) и сразу кодируются в ответ, поэтому расход памяти
+не зависит от размера выгрузки.
+"""
+
+EXPORT_BATCH_SIZE = 1000
+EXPORT_FORMATS = {
+    'csv': (csv_stream, CSV_MIMETYPE),
+    'xlsx': (xlsx_stream, XLSX_MIMETYPE)
+}
+
+
+def _export_response(header, rows, filename, export_format):
+    """
+    Формирует потоковый HTTP-ответ с файлом выгрузки.
+
+    Args:
+        header (list[str]): Заголовки столбцов.
+        rows (iterable[list]): Генератор строк таблицы.
+        filename (str): Имя файла без расширения.
+        export_format (str): 'csv' или 'xlsx'.
+    """
+    stream, mimetype = EXPORT_FORMATS[export_format]
+    response = Response(stream_with_context(stream(header, rows)), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}.{export_format}"'
+    return response
+
+
+@app.route('/api/forms/export', methods=['GET'])
+@jwt_required()
+def export_forms():
+    """
+    Выгрузка списка форм.
+    Доступно только пользователям с ролью 'admin'.
+    Параметр запроса format: 'csv' (по умолчанию) или 'xlsx'.
+
+    Returns:
+        Файл с атрибутами всех форм.
+    """
+    current_user_id = get_jwt_identity()
+    user = User.query.get(current_user_id)
+    user_roles = [role.name for role in user.roles]
+    if 'admin' not in user_roles:
+        return jsonify({'error': 'Недостаточно прав'}), 403
+
+    export_format = request.args.get('format', 'csv')
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({'error': 'Поддерживаются форматы csv и xlsx'}), 400
+
+    def rows():
+        result = db.session.execute(
+            select(Form.id, Form.name, Form.description, Form.form_type,
+                   Form.responsible, Form.period, Form.created_at)
+            .order_by(Form.id)
+            .execution_options(yield_per=EXPORT_BATCH_SIZE)
+        )
+        for row in result:
+            yield list(row)
+
+    header = ['ID', 'Название', 'Описание', 'Тип', 'Ответственный', 'Периодичность', 'Создана']
+    return _export_response(header, rows(), 'forms', export_format)
+
+
+@app.route('/api/forms/<int:form_id>/submissions/export', methods=['GET'])
+@jwt_required()
+def export_form_submissions(form_id):
+    """
+    Выгрузка ответов на форму.
+    Доступно только пользователям с ролью 'admin'.
+    Столбцы с данными строятся по описанию полей формы.
+
+    Параметры запроса:
+        format: 'csv' (по умолчанию) или 'xlsx'.
+        period: отчетный период; без параметра выгружаются все периоды.
+
+    Args:
+        form_id (int): Идентификатор формы.
+
+    Returns:
+        Файл с ответами на форму.
+    """
+    current_user_id = get_jwt_identity()
+    user = User.query.get(current_user_id)
+    user_roles = [role.name for role in user.roles]
+    if 'admin' not in user_roles:
+        return jsonify({'error': 'Недостаточно прав'}), 403
+
+    form = Form.query.get(form_id)
+    if not form:
+        return jsonify({'error': 'Форма не найдена'}), 404
+
+    export_format = request.args.get('format', 'csv')
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({'error': 'Поддерживаются форматы csv и xlsx'}), 400
+
+    fields = get_compiled_form(form).fields
+    period = request.args.get('period')
+
+    query = (
+        select(FormSubmission.id, FormSubmission.period, User.username, Department.name,
+               FormSubmission.updated_at, FormSubmission.data)
+        .join(User, User.id == FormSubmission.user_id)
+        .outerjoin(Department, Department.id == FormSubmission.department_id)
+        .where(FormSubmission.form_id == form.id)
+        .order_by(FormSubmission.id)
+    )
+    if period is not None:
+        query = query.where(FormSubmission.period == period)
+
+    def rows():
+        keys = [field.key for field in fields]
+        result = db.session.execute(query.execution_options(yield_per=EXPORT_BATCH_SIZE))
+        for submission_id, submission_period, username, department, updated_at, data in result:
+            values = json.loads(data) if data else {}
+            yield [submission_id, submission_period, username, department, updated_at] + \
+                [values.get(key) for key in keys]
+
+    header = ['ID', 'Период', 'Пользователь', 'Подразделение', 'Обновлено'] + [field.label for field in fields]
+    return _export_response(header, rows(), f'form-{form.id}-submissions', export_format)
+
+
+"""
+================= ПЛАНИРОВЩИК ОТЧЕТОВ =================
+Расписание отчетных периодов форм. Для каждой периодической формы
+в min-куче хранится момент выдачи заданий на очередной период;
+фоновый поток просыпается к ближайшему моменту и создает задания
+для ответственных одной транзакцией. Поток работает в каждом процессе:
+задания не дублируются благодаря уникальному ключу, а расписание раз в
+REPORT_SCHEDULE_SYNC_INTERVAL секунд сверяется с формами в БД, чтобы
+учесть формы, измененные другими процессами.
+"""
+
+REPORT_SCHEDULER_MAX_SLEEP = 60
+REPORT_SCHEDULE_SYNC_INTERVAL = 60
+
+report_scheduler = ReportScheduler()
+_report_scheduler_wakeup = threading.Event()
+
+
+def schedule_form_reports(form):
+    """Добавляет форму в расписание отчетов, если ее периодичность распознана."""
+    periodicity = parse_periodicity(form.period)
+    if periodicity:
+        report_scheduler.schedule(form.id, periodicity)
+        _report_scheduler_wakeup.set()
+
+
+def sync_report_schedule():
+    """Приводит расписание к периодическим формам в БД, не сбрасывая неизмененные формы."""
+    periodicities = {}
+    for form_id, period in db.session.execute(select(Form.id, Form.period).where(Form.period.isnot(None))):
+        periodicity = parse_periodicity(period)
+        if periodicity:
+            periodicities[form_id] = periodicity
+    report_scheduler.sync(periodicities)
+
+
+def load_report_schedule():
+    """Заполняет расписание по всем периодическим формам."""
+    sync_report_schedule()
+    print(f"📅 Расписание отчетов загружено: {len(report_scheduler)} форм")
+
+
+def issue_due_report_tasks(now=None):
+    """
+    Создает задания по всем наступившим отчетным периодам одной транзакцией.
+    Уже существующие задания не дублируются. Если транзакция не удалась,
+    периоды возвращаются в расписание и будут выданы на следующем такте.
+
+    Returns:
+        int: Количество периодов, по которым выданы задания.
+    """
+    due = report_scheduler.pop_due(now)
+    if not due:
+        return 0
+    try:
+        _insert_report_tasks(due)
+    except Exception:
+        db.session.rollback()
+        report_scheduler.restore(due)
+        raise
+    return len(due)
+
+
+def _insert_report_tasks(due):
+    forms = dict(db.session.execute(
+        select(Form.id, Form.responsible).where(Form.id.in_({entry.form_id for entry in due}))
+    ).all())
+    departments = {}
+    for dept_id, name, short_name in db.session.execute(
+        select(Department.id, Department.name, Department.short_name)
+    ):
+        for key in (short_name, name):
+            if key:
+                departments[key.strip().lower()] = dept_id
+
+    rows = []
+    for entry in due:
+        if entry.form_id not in forms:
+            continue
+        responsible = forms[entry.form_id] or ''
+        rows.append({
+            'form_id': entry.form_id,
+            'period': entry.label,
+            'responsible': responsible,
+            'department_id': departments.get(responsible.strip().lower()),
+            'due_at': entry.due_at,
+            'status': 'pending',
+            'created_at': datetime.utcnow()
+        })
+
+    if rows:
+        dialect = postgresql if db.engine.dialect.name == 'postgresql' else sqlite
+        stmt = dialect.insert(ReportTask.__table__).on_conflict_do_nothing(
+            index_elements=['form_id', 'period', 'responsible']
+        )
+        db.session.execute(stmt, rows)
+        db.session.commit()
+        print(f"📅 Выданы задания на отчеты: {len(rows)}")
+
+
+def _run_report_scheduler():
+    next_sync = time.monotonic() + REPORT_SCHEDULE_SYNC_INTERVAL
+    while True:
+        wakeup = report_scheduler.next_wakeup()
+        delay = min(REPORT_SCHEDULER_MAX_SLEEP, max(next_sync - time.monotonic(), 0))
+        if wakeup is not None:
+            delay = min(max((wakeup - datetime.utcnow()).total_seconds(), 0), delay)
+        _report_scheduler_wakeup.wait(delay)
+        _report_scheduler_wakeup.clear()
+        try:
+            with app.app_context():
+                if time.monotonic() >= next_sync:
+                    next_sync = time.monotonic() + REPORT_SCHEDULE_SYNC_INTERVAL
+                    sync_report_schedule()
+                issue_due_report_tasks()
+        except Exception as e:
+            print(f"❌ Ошибка планировщика отчетов: {e}")
+            time.sleep(1)
+
+
+def start_report_scheduler():
+    """Загружает расписание и запускает фоновый поток выдачи заданий."""
+    load_report_schedule()
+    threading.Thread(target=_run_report_scheduler, name='report-scheduler', daemon=True).start()
+
+
+@app.route('/api/admin/report-deadlines', methods=['GET'])
+@jwt_required()
+def get_report_deadlines():
+    """
+    Получение ближайших сроков сдачи отчетов.
+    Доступно только пользователям с ролью 'admin'.
+    Параметр запроса limit ограничивает размер каждого списка.
+
+    Returns:
+        JSON: {'pending': невыполненные задания по сроку сдачи,
+               'scheduled': следующие периоды из расписания}
+    """
+    current_user_id = get_jwt_identity()
+    user = User.query.get(current_user_id)
+    user_roles = [role.name for role in user.roles]
+    if 'admin' not in user_roles:
+        return jsonify({'error': 'Недостаточно прав'}), 403
+
+    limit = min(max(request.args.get('limit', 50, type=int), 1), 500)
+
+    tasks = db.session.execute(
+        select(ReportTask, Form.name)
+        .join(Form, Form.id == ReportTask.form_id)
+        .where(ReportTask.status == 'pending')
+        .order_by(ReportTask.due_at)
+        .limit(limit)
+    ).all()
+    scheduled = report_scheduler.upcoming(limit)
+    names = dict(db.session.execute(
+        select(Form.id, Form.name).where(Form.id.in_({entry.form_id for entry in scheduled}))
+    ).all()) if scheduled else {}
+
+    return jsonify({
+        'pending': [{
+            'id': task.id,
+            'form_id': task.form_id,
+            'form': form_name,
+            'period': task.period,
+            'responsible': task.responsible,
+            'department_id': task.department_id,
+            'due_at': task.due_at.isoformat()
+        } for task, form_name in tasks],
+        'scheduled': [{
+            'form_id': entry.form_id,
+            'form': names.get(entry.form_id),
+            'period': entry.label,
+            'opens_at': entry.opens_at.isoformat(),
+            'due_at': entry.due_at.isoformat()
+        } for entry in scheduled]
+    }), 200
+
+
+"""
+================= API ЗАЯВОК =================
+Рассмотрение заявок: submitted -> in_review -> approved | rejected.
+Очереди "мои заявки" и "на рассмотрении у меня" читаются по составным
+индексам (пользователь, статус, id) с keyset-пагинацией, счетчики берутся
+из предрассчитанной таблицы application_counter.
+"""
+
+APPLICATION_STATUSES = ('submitted', 'in_review', 'approved', 'rejected')
+APPLICATION_TRANSITIONS = {
+    'submitted': {'in_review', 'rejected'},
+    'in_review': {'approved', 'rejected', 'submitted'},
+    'approved': set(),
+    'rejected': set()
+}
+APPLICATIONS_PAGE_SIZE = 50
+APPLICATIONS_MAX_PAGE_SIZE = 200
+
+
+def _default_assignee(form):
+    """Руководитель подразделения, указанного ответственным за форму, или None."""
+    responsible = (form.responsible or '').strip()
+    if not responsible:
+        return None
+    return db.session.execute(
+        select(Department.head_user_id)
+        .where(db.or_(Department.short_name == responsible, Department.name == responsible))
+        .limit(1)
+    ).scalar()
+
+
+def _application_dict(application):
+    return {
+        'id': application.id,
+        'form_id': application.form_id,
+        'applicant_id': application.applicant_id,
+        'assignee_id': application.assignee_id,
+        'status': application.status,
+        'data': json.loads(application.data),
+        'comment': application.comment,
+        'created_at': application.created_at.isoformat() if application.created_at else None,
+        'updated_at': application.updated_at.isoformat() if application.updated_at else None
+    }
+
+
+@app.route('/api/forms/<int:form_id>/applications', methods=['POST'])
+@jwt_required()
+def create_application(form_id):
+    """
+    Подача заявки по форме типа 'заявки'.
+    Принимает JSON: {'data': {ключ поля: значение}}.
+    Заявка назначается руководителю подразделения, ответственного за форму.
+
+    Args:
+        form_id (int): Идентификатор формы.
+
+    Returns:
+        JSON: Созданная заявка или ошибки проверки по полям.
+    """
+    current_user_id = get_jwt_identity()
+
+    form = Form.query.get(form_id)
+    if not form:
+        return jsonify({'error': 'Форма не найдена'}), 404
+    if form.form_type != 'заявки':
+        return jsonify({'error': 'Форма не принимает заявки'}), 400
+
+    data = request.get_json() or {}
+    try:
+        cleaned = get_compiled_form(form).validate(data.get('data'))
+    except FormDefinitionError as e:
+        return jsonify({'error': str(e)}), 500
+    except FormValidationError as e:
+        return jsonify({'error': 'Данные формы содержат ошибки', 'fields': e.errors}), 400
+
+    try:
+        application = Application(
+            form_id=form.id,
+            applicant_id=int(current_user_id),
+            assignee_id=_default_assignee(form),
+            status='submitted',
+            data=json.dumps(cleaned, ensure_ascii=False)
+        )
+        db.session.add(application)
+        db.session.commit()
+
+        print(f"📨 Подана заявка #{application.id} по форме '{form.name}'")
+        return jsonify(_application_dict(application)), 201
+
+    except Exception as e:
+        db.session.rollback()
+        print(f"❌ Ошибка подачи заявки: {e}")
+        return jsonify({'error': 'Ошибка подачи заявки'}), 500
+
+
+@app.route('/api/applications', methods=['GET'])
+@jwt_required()
+def get_applications():
+    """
+    Очередь заявок текущего пользователя с keyset-пагинацией.
+    Параметры запроса: box ('mine' - поданные мной, 'assigned' - на рассмотрении
+    у меня, 'all' - все заявки, только для 'admin'), status, limit, cursor.
+
+    Returns:
+        JSON: {'items': [...], 'next_cursor': int | None}
+    """
+    current_user_id = int(get_jwt_identity())
+    box = request.args.get('box', 'assigned')
+    status = request.args.get('status')
+    if status and status not in APPLICATION_STATUSES:
+        return jsonify({'error': 'Неизвестный статус заявки'}), 400
+
+    query = select(Application)
+    if box == 'mine':
+        query = query.where(Application.applicant_id == current_user_id)
+    elif box == 'assigned':
+        query = query.where(Application.assignee_id == current_user_id)
+    elif box == 'all':
+        user = User.query.get(current_user_id)
+        if 'admin' not in [role.name for role in user.roles]:
+            return jsonify({'error': 'Недостаточно прав'}), 403
+    else:
+        return jsonify({'error': 'Неизвестная очередь заявок'}), 400
+    if status:
+        query = query.where(Application.status == status)
+
+    limit = min(max(request.args.get('limit', APPLICATIONS_PAGE_SIZE, type=int), 1), APPLICATIONS_MAX_PAGE_SIZE)
+    cursor = request.args.get('cursor', 0, type=int)
+    rows = db.session.execute(
+        query.where(Application.id > cursor).order_by(Application.id).limit(limit + 1)
+    ).scalars().all()
+
+    next_cursor = rows[limit - 1].id if len(rows) > limit else None
+    return jsonify({
+        'items': [_application_dict(application) for application in rows[:limit]],
+        'next_cursor': next_cursor
+    }), 200
+
+
+@app.route('/api/applications/<int:application_id>/status', methods=['POST'])
+@jwt_required()
+def change_application_status(application_id):
+    """
+    Перевод заявки в новый статус.
+    Доступно назначенному рассматривающему и пользователям с ролью 'admin'.
+    Принимает JSON: {'status': 'approved', 'comment': '...'}.
+
+    Args:
+        application_id (int): Идентификатор заявки.
+
+    Returns:
+        JSON: Обновленная заявка или сообщение об ошибке.
+    """
+    current_user_id = int(get_jwt_identity())
+    user = User.query.get(current_user_id)
+
+    application = Application.query.get(application_id)
+    if not application:
+        return jsonify({'error': 'Заявка не найдена'}), 404
+    if application.assignee_id != current_user_id and 'admin' not in [role.name for role in user.roles]:
+        return jsonify({'error': 'Недостаточно прав'}), 403
+
+    data = request.get_json() or {}
+    new_status = data.get('status')
+    if not isinstance(new_status, str):
+        return jsonify({'error': 'Некорректный статус'}), 400
+    if new_status not in APPLICATION_TRANSITIONS.get(application.status, ()):
+        return jsonify({'error': f"Недопустимый переход: {application.status} -> {new_status}"}), 409
+
+    try:
+        application.status = new_status
+        if 'comment' in data:
+            application.comment = data.get('comment')
+        application.updated_at = datetime.utcnow()
+        db.session.commit()
+
+        print(f"📋 Заявка #{application.id} переведена в статус '{new_status}' пользователем {user.username}")
+        return jsonify(_application_dict(application)), 200
+
+    except StaleDataError:
+        db.session.rollback()
+        return jsonify({'error': 'Заявка изменена другим пользователем, обновите данные'}), 409
+    except Exception as e:
+        db.session.rollback()
+        print(f"❌ Ошибка изменения статуса заявки: {e}")
+        return jsonify({'error': 'Ошибка изменения статуса заявки'}), 500
+
+
+@app.route('/api/applications/<int:application_id>/assignee', methods=['PUT'])
+@jwt_required()
+def assign_application(application_id):
+    """
+    Назначение рассматривающего заявки.
+    Доступно только пользователям с ролью 'admin'.
+    Принимает JSON: {'assignee_id': 5} (null - снять назначение).
+
+    Args:
+        application_id (int): Идентификатор заявки.
+
+    Returns:
+        JSON: Обновленная заявка или сообщение об ошибке.
+    """
+    current_user_id = get_jwt_identity()
+    user = User.query.get(current_user_id)
+    user_roles = [role.name for role in user.roles]
+    if 'admin' not in user_roles:
+        return jsonify({'error': 'Недостаточно прав'}), 403
+
+    application = Application.query.get(application_id)
+    if not application:
+        return jsonify({'error': 'Заявка не найдена'}), 404
+
+    assignee_id = (request.get_json() or {}).get('assignee_id')
+    if assignee_id is not None and (isinstance(assignee_id, bool) or not isinstance(assignee_id, int)):
+        return jsonify({'error': 'Некорректный идентификатор пользователя'}), 400
+    if assignee_id is not None and not User.query.get(assignee_id):
+        return jsonify({'error': 'Пользователь не найден'}), 404
+
+    try:
+        application.assignee_id = assignee_id
+        application.updated_at = datetime.utcnow()
+        db.session.commit()
+        return jsonify(_application_dict(application)), 200
+
+    except StaleDataError:
+        db.session.rollback()
+        return jsonify({'error': 'Заявка изменена другим пользователем, обновите данные'}), 409
+    except Exception as e:
+        db.session.rollback()
+        print(f"❌ Ошибка назначения заявки: {e}")
+        return jsonify({'error': 'Ошибка назначения заявки'}), 500
+
+
+@app.route('/api/applications/counters', methods=['GET'])
+@jwt_required()
+def get_application_counters():
+    """
+    Счетчики заявок для панели текущего пользователя.
+    Пользователям с ролью 'admin' дополнительно возвращаются итоги по всем заявкам.
+
+    Returns:
+        JSON: {'assigned': {статус: количество}, 'total': {...}}
+    """
+    current_user_id = int(get_jwt_identity())
+    user = User.query.get(current_user_id)
+
+    assigned = dict.fromkeys(APPLICATION_STATUSES, 0)
+    assigned.update(db.session.execute(
+        select(ApplicationCounter.status, ApplicationCounter.count)
+        .where(ApplicationCounter.assignee_id == current_user_id)
+    ).all())
+    result = {'assigned': assigned}
+
+    if 'admin' in [role.name for role in user.roles]:
+        total = dict.fromkeys(APPLICATION_STATUSES, 0)
+        total.update(db.session.execute(
+            select(ApplicationCounter.status, db.func.sum(ApplicationCounter.count))
+            .group_by(ApplicationCounter.status)
+        ).all())
+        result['total'] = {status: int(count) for status, count in total.items()}
+
+    return jsonify(result), 200
+
+
+"""
+================= API ВЛОЖЕНИЙ =================
+Загрузка файлов частями с возможностью продолжения после обрыва.
+Каждая часть пишется на диск прямо из потока запроса; завершенный файл
+сохраняется в хранилище по хешу содержимого, одинаковые файлы хранятся
+один раз. Выдача файлов поддерживает запросы диапазонов (Range).
+"""
+
+ATTACHMENT_CHUNK_SIZE = 8 * 1024 * 1024
+ATTACHMENT_MAX_SIZE = 512 * 1024 * 1024
+UPLOAD_MAX_IDLE = timedelta(hours=24)  # незавершенная загрузка без новых частей удаляется
+UPLOAD_CLEANUP_INTERVAL = 3600
+
+attachment_store = AttachmentStore(os.path.join(app.instance_path, 'attachments'))
+_uploads_cleaned_at = 0
+
+
+def cleanup_stale_uploads():
+    """
+    Удаляет незавершенные загрузки, в которые не поступало данных дольше
+    UPLOAD_MAX_IDLE, и временные файлы загрузок без записи в БД.
+
+    Returns:
+        int: Количество удаленных загрузок.
+    """
+    cutoff = datetime.utcnow() - UPLOAD_MAX_IDLE
+    cutoff_ts = time.time() - UPLOAD_MAX_IDLE.total_seconds()
+    removed = 0
+    try:
+        for upload in UploadSession.query.filter(UploadSession.created_at < cutoff).all():
+            if (attachment_store.last_modified(upload.id) or 0) < cutoff_ts:
+                attachment_store.discard(upload.id)
+                db.session.delete(upload)
+                removed += 1
+        db.session.commit()
+
+        stale = attachment_store.stale_uploads(cutoff_ts)
+        if stale:
+            active = {row.id for row in UploadSession.query.filter(UploadSession.id.in_(stale))}
+            for upload_id in stale:
+                if upload_id not in active:
+                    attachment_store.discard(upload_id)
+                    removed += 1
+    except Exception as e:
+        db.session.rollback()
+        print(f"❌ Ошибка очистки загрузок: {e}")
+    if removed:
+        print(f"🧹 Удалено незавершенных загрузок: {removed}")
+    return removed
+
+
+def _maybe_cleanup_uploads():
+    # Очистка выполняется не чаще раза в UPLOAD_CLEANUP_INTERVAL секунд на процесс
+    global _uploads_cleaned_at
+    if time.monotonic() - _uploads_cleaned_at > UPLOAD_CLEANUP_INTERVAL:
+        _uploads_cleaned_at = time.monotonic()
+        cleanup_stale_uploads()
+
+
+def _attachment_dict(attachment):
+    return {
+        'id': attachment.id,
+        'filename': attachment.filename,
+        'content_type': attachment.content_type,
+        'size': attachment.size,
+        'sha256': attachment.sha256
+    }
+
+
+def _get_own_upload(upload_id):
+    """Возвращает загрузку текущего пользователя или None."""
+    upload = UploadSession.query.get(upload_id)
+    if upload is None or upload.user_id != int(get_jwt_identity()):
+        return None
+    return upload
+
+
+@app.route('/api/attachments/uploads', methods=['POST'])
+@jwt_required()
+def create_upload():
+    """
+    Начало загрузки вложения.
+    Принимает JSON: {'filename': 'scan.pdf', 'size': 1048576, 'content_type': 'application/pdf'}.
+
+    Returns:
+        JSON: Идентификатор загрузки и рекомендуемый размер части.
+    """
+    current_user_id = get_jwt_identity()
+    data = request.get_json() or {}
+
+    filename = (data.get('filename') or '').strip()
+    size = data.get('size')
+    if not filename:
+        return jsonify({'error': 'Не указано имя файла'}), 400
+    if isinstance(size, bool) or not isinstance(size, int) or size < 0:
+        return jsonify({'error': 'Некорректный размер файла'}), 400
+    if size == 0:
+        # Для пустого файла не будет ни одной части, завершать загрузку нечего
+        return jsonify({'error': 'Файл пуст'}), 400
+    if size > ATTACHMENT_MAX_SIZE:
+        return jsonify({'error': 'Файл слишком большой'}), 413
+
+    _maybe_cleanup_uploads()
+
+    try:
+        upload = UploadSession(
+            id=uuid.uuid4().hex,
+            user_id=int(current_user_id),
+            filename=filename[:255],
+            content_type=data.get('content_type'),
+            size=size
+        )
+        db.session.add(upload)
+        db.session.commit()
+        return jsonify({'upload_id': upload.id, 'chunk_size': ATTACHMENT_CHUNK_SIZE}), 201
+
+    except Exception as e:
+        db.session.rollback()
+        print(f"❌ Ошибка создания загрузки: {e}")
+        return jsonify({'error': 'Ошибка создания загрузки'}), 500
+
+
+@app.route('/api/attachments/uploads/<upload_id>', methods=['GET'])
+@jwt_required()
+def get_upload_status(upload_id):
+    """
+    Состояние загрузки: сколько байтов уже принято.
+    Используется клиентом для продолжения загрузки после обрыва.
+
+    Args:
+        upload_id (str): Идентификатор загрузки.
+
+    Returns:
+        JSON: {'received': int, 'size': int}
+    """
+    upload = _get_own_upload(upload_id)
+    if not upload:
+        return jsonify({'error': 'Загрузка не найдена'}), 404
+    return jsonify({'received': attachment_store.received(upload.id), 'size': upload.size}), 200
+
+
+@app.route('/api/attachments/uploads/<upload_id>', methods=['PUT'])
+@jwt_required()
+def upload_chunk(upload_id):
+    """
+    Прием очередной части файла.
+    Тело запроса - двоичные данные части, параметр offset - ее смещение в файле.
+    Смещение должно совпадать с объемом уже принятых данных.
+
+    Args:
+        upload_id (str): Идентификатор загрузки.
+
+    Returns:
+        JSON: {'received': int, 'size': int}
+    """
+    upload = _get_own_upload(upload_id)
+    if not upload:
+        return jsonify({'error': 'Загрузка не найдена'}), 404
+
+    offset = request.args.get('offset', type=int)
+    length = request.content_length
+    if offset is None or length is None:
+        return jsonify({'error': 'Не указаны смещение или длина части'}), 400
+    if length > ATTACHMENT_CHUNK_SIZE:
+        return jsonify({'error': 'Часть слишком большая'}), 413
+    if offset + length > upload.size:
+        return jsonify({'error': 'Данные превышают заявленный размер файла'}), 400
+
+    try:
+        received = attachment_store.write_chunk(upload.id, offset, request.stream, length)
+    except UploadOffsetError as e:
+        return jsonify({'error': str(e), 'received': e.received}), 409
+    return jsonify({'received': received, 'size': upload.size}), 200
+
+
+@app.route('/api/attachments/uploads/<upload_id>/complete', methods=['POST'])
+@jwt_required()
+def complete_upload(upload_id):
+    """
+    Завершение загрузки: файл переносится в хранилище и становится вложением.
+
+    Args:
+        upload_id (str): Идентификатор загрузки.
+
+    Returns:
+        JSON: Данные вложения; его id используется как значение поля формы.
+    """
+    upload = _get_own_upload(upload_id)
+    if not upload:
+        return jsonify({'error': 'Загрузка не найдена'}), 404
+
+    received = attachment_store.received(upload.id)
+    if received != upload.size:
+        return jsonify({'error': 'Файл загружен не полностью', 'received': received}), 409
+
+    try:
+        sha256, size = attachment_store.finalize(upload.id)
+        attachment = Attachment(
+            id=uuid.uuid4().hex,
+            sha256=sha256,
+            size=size,
+            filename=upload.filename,
+            content_type=upload.content_type,
+            uploaded_by=upload.user_id
+        )
+        db.session.add(attachment)
+        db.session.delete(upload)
+        db.session.commit()
+
+        print(f"📎 Загружен файл '{attachment.filename}' ({size} байт)")
+        return jsonify(_attachment_dict(attachment)), 201
+
+    except Exception as e:
+        db.session.rollback()
+        print(f"❌ Ошибка завершения загрузки: {e}")
+        return jsonify({'error': 'Ошибка завершения загрузки'}), 500
+
+
+@app.route('/api/attachments/uploads/<upload_id>', methods=['DELETE'])
+@jwt_required()
+def cancel_upload(upload_id):
+    """
+    Отмена загрузки и удаление принятых данных.
+
+    Args:
+        upload_id (str): Идентификатор загрузки.
+
+    Returns:
+        JSON: Сообщение об успехе или ошибке.
+    """
+    upload = _get_own_upload(upload_id)
+    if not upload:
+        return jsonify({'error': 'Загрузка не найдена'}), 404
+
+    attachment_store.discard(upload.id)
+    db.session.delete(upload)
+    db.session.commit()
+    return jsonify({'message': 'Загрузка отменена'}), 200
+
+
+@app.route('/api/attachments/<attachment_id>', methods=['GET'])
+@jwt_required()
+def download_attachment(attachment_id):
+    """
+    Скачивание вложения.
+    Доступно загрузившему файл и пользователям с ролями 'admin', 'teacher' или 'employee'.
+    Поддерживаются запросы диапазонов (Range) и условные запросы (ETag);
+    файл отдается через send_file без чтения в память.
+
+    Args:
+        attachment_id (str): Идентификатор вложения.
+
+    Returns:
+        Response: Содержимое файла или сообщение об ошибке.
+    """
+    current_user_id = int(get_jwt_identity())
+    attachment = Attachment.query.get(attachment_id)
+    if not attachment:
+        return jsonify({'error': 'Вложение не найдено'}), 404
+
+    if attachment.uploaded_by != current_user_id:
+        user = User.query.get(current_user_id)
+        if not {'admin', 'teacher', 'employee'} & {role.name for role in user.roles}:
+            return jsonify({'error': 'Недостаточно прав'}), 403
+
+    path = attachment_store.object_path(attachment.sha256)
+    if not os.path.exists(path):
+        return jsonify({'error': 'Файл вложения отсутствует в хранилище'}), 410
+
+    response = send_file(
+        path,
+        mimetype=attachment.content_type or 'application/octet-stream',
+        as_attachment=True,
+        download_name=attachment.filename,
+        conditional=True,
+        etag=attachment.sha256
+    )
+    response.cache_control.no_cache = None
+    response.cache_control.private = True
+    response.cache_control.max_age = 86400
+    return response
+
+
+"""
+================= API РАСПИСАНИЯ =================
+Расписание занятий групп, преподавателей и аудиторий. Источник данных -
+база: выборка за неделю идет по индексам (ресурс, начало занятия), а
+проверка конфликтов выполняется под блокировкой записи расписания в БД,
+общей для всех процессов. Занятия, пересекающиеся по времени с новыми,
+загружаются в интервальный индекс, и пересечения по ресурсам (в том
+числе внутри пакета) ищутся в нем двоичным поиском.
+"""
+
+SCHEDULE_MAX_BATCH = 50000
+# Ограничение длительности занятия позволяет искать пересечения по индексу начала
+SCHEDULE_MAX_SLOT_DURATION = timedelta(hours=12)
+
+
+def _parse_datetime(value):
+    """
+    Разбирает дату и время в формате ISO 8601. Время со смещением
+    переводится в UTC без указания зоны, как хранятся занятия.
+
+    Raises:
+        TypeError, ValueError: Если значение не является датой и временем ISO 8601.
+    """
+    moment = datetime.fromisoformat(value)
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+    return moment
+
+
+def _lock_schedule_writes():
+    """
+    Берет блокировку записи расписания до конца транзакции сессии.
+    Блокировка действует между процессами: проверка конфликтов и запись
+    занятий в разных процессах выполняются по очереди.
+    """
+    if db.engine.dialect.name == 'postgresql':
+        db.session.execute(text("SELECT pg_advisory_xact_lock(hashtext('schedule_slot'))"))
+    else:
+        # Пустой UPDATE открывает пишущую транзакцию SQLite: другие писатели ждут ее завершения
+        db.session.execute(text('UPDATE schedule_slot SET id = id WHERE 0 = 1'))
+
+
+def _load_schedule_window(start, end):
+    """
+    Строит интервальный индекс из занятий базы, пересекающихся с [start, end).
+
+    Returns:
+        ScheduleIndex: Индекс занятий интервала.
+    """
+    index = ScheduleIndex()
+    index.load(db.session.execute(select(
+        ScheduleSlot.id, ScheduleSlot.starts_at, ScheduleSlot.ends_at,
+        ScheduleSlot.group_name, ScheduleSlot.teacher_id, ScheduleSlot.room
+    ).where(
+        ScheduleSlot.starts_at < end,
+        ScheduleSlot.starts_at > start - SCHEDULE_MAX_SLOT_DURATION,
+        ScheduleSlot.ends_at > start
+    )))
+    return index
+
+
+def _parse_slot(item):
+    """
+    Проверяет описание занятия и формирует строку для записи.
+
+    Returns:
+        tuple[dict | None, str | None]: Строка для ScheduleSlot и текст ошибки.
+    """
+    if not isinstance(item, dict):
+        return None, 'Ожидается объект'
+    if not item.get('subject'):
+        return None, 'Не указана дисциплина'
+    try:
+        starts_at = _parse_datetime(item.get('starts_at'))
+        ends_at = _parse_datetime(item.get('ends_at'))
+    except (TypeError, ValueError):
+        return None, 'Некорректное время занятия'
+    if ends_at <= starts_at:
+        return None, 'Окончание занятия должно быть позже начала'
+    if ends_at - starts_at > SCHEDULE_MAX_SLOT_DURATION:
+        return None, 'Занятие не может длиться дольше 12 часов'
+    teacher_id = item.get('teacher_id')
+    if teacher_id is not None and (isinstance(teacher_id, bool) or not isinstance(teacher_id, int)):
+        return None, 'Некорректный идентификатор преподавателя'
+    if not (item.get('group_name') or teacher_id or item.get('room')):
+        return None, 'Не указаны группа, преподаватель или аудитория'
+    return {
+        'subject': item['subject'],
+        'lesson_type': item.get('lesson_type'),
+        'group_name': item.get('group_name'),
+        'teacher_id': teacher_id,
+        'room': item.get('room'),
+        'starts_at': starts_at,
+        'ends_at': ends_at
+    }, None
+
+
+def _slot_keys(row):
+    return resource_keys(row['group_name'], row['teacher_id'], row['room'])
+
+
+def _slot_dict(slot):
+    return {
+        'id': slot.id,
+        'subject': slot.subject,
+        'lesson_type': slot.lesson_type,
+        'group_name': slot.group_name,
+        'teacher_id': slot.teacher_id,
+        'room': slot.room,
+        'starts_at': slot.starts_at.isoformat(),
+        'ends_at': slot.ends_at.isoformat()
+    }
+
+
+def _conflict_list(conflicts):
+    return [{'kind': kind, 'resource': value, 'slot_id': slot_id} for kind, value, slot_id in conflicts]
+
+
+@app.route('/api/schedule', methods=['GET'])
+@jwt_or_oauth_required('read:schedule')
+def get_schedule():
+    """
+    Занятия группы, преподавателя или аудитории за интервал.
+    Доступно пользователям портала и сервисам с областью read:schedule.
+    Параметры запроса: один из group, teacher_id, room; from и to
+    (ISO-дата или дата и время, по умолчанию - текущая неделя).
+
+    Returns:
+        JSON: Список занятий по времени начала.
+    """
+    if request.args.get('group'):
+        kind, value = 'group', request.args['group']
+    elif request.args.get('teacher_id', type=int):
+        kind, value = 'teacher', request.args.get('teacher_id', type=int)
+    elif request.args.get('room'):
+        kind, value = 'room', request.args['room']
+    else:
+        return jsonify({'error': 'Укажите группу, преподавателя или аудиторию'}), 400
+
+    today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    week_start = today - timedelta(days=today.weekday())
+    try:
+        start = _parse_datetime(request.args['from']) if request.args.get('from') else week_start
+        end = _parse_datetime(request.args['to']) if request.args.get('to') else start + timedelta(days=7)
+    except ValueError:
+        return jsonify({'error': 'Некорректный интервал'}), 400
+
+    column = {'group': ScheduleSlot.group_name, 'teacher': ScheduleSlot.teacher_id, 'room': ScheduleSlot.room}[kind]
+    slots = ScheduleSlot.query.filter(
+        column == value,
+        ScheduleSlot.starts_at < end,
+        ScheduleSlot.starts_at > start - SCHEDULE_MAX_SLOT_DURATION,
+        ScheduleSlot.ends_at > start
+    ).order_by(ScheduleSlot.starts_at).all()
+    return jsonify([_slot_dict(slot) for slot in slots]), 200
+
+
+@app.route('/api/schedule', methods=['POST'])
+@jwt_or_oauth_required('write:schedule')
+def create_schedule_slot():
+    """
+    Добавление занятия в расписание.
+    Доступно пользователям с ролью 'admin' и сервисам с областью write:schedule.
+    Принимает JSON: subject, lesson_type, group_name, teacher_id, room, starts_at, ends_at.
+
+    Returns:
+        JSON: Созданное занятие или список конфликтующих занятий.
+    """
+    if current_token:
+        created_by, author = current_token.user_id, f'клиентом {current_token.client_id}'
+    else:
+        current_user_id = get_jwt_identity()
+        user = User.query.get(current_user_id)
+        user_roles = [role.name for role in user.roles]
+        if 'admin' not in user_roles:
+            return jsonify({'error': 'Недостаточно прав'}), 403
+        created_by, author = int(current_user_id), f'пользователем {user.username}'
+
+    row, error = _parse_slot(request.get_json())
+    if error:
+        return jsonify({'error': error}), 400
+
+    try:
+        _lock_schedule_writes()
+        index = _load_schedule_window(row['starts_at'], row['ends_at'])
+        conflicts = index.conflicts(row['starts_at'], row['ends_at'], _slot_keys(row))
+        if conflicts:
+            db.session.rollback()
+            return jsonify({'error': 'Занятие пересекается с расписанием', 'conflicts': _conflict_list(conflicts)}), 409
+
+        slot = ScheduleSlot(created_by=created_by, **row)
+        db.session.add(slot)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        print(f"❌ Ошибка добавления занятия: {e}")
+        return jsonify({'error': 'Ошибка добавления занятия'}), 500
+
+    print(f"🗓️ Добавлено занятие #{slot.id} '{slot.subject}' {author}")
+    return jsonify(_slot_dict(slot)), 201
+
+
+@app.route('/api/schedule/bulk', methods=['POST'])
+@jwt_or_oauth_required('write:schedule')
+def load_schedule_bulk():
+    """
+    Загрузка расписания на семестр одним пакетом.
+    Доступно пользователям с ролью 'admin' и сервисам с областью write:schedule.
+    Принимает JSON: {'slots': [{...}, ...]} в формате POST /api/schedule.
+    Пакет проверяется на пересечения с расписанием и между собой; при
+    любой ошибке ничего не сохраняется.
+
+    Returns:
+        JSON: Количество добавленных занятий или ошибки по позициям пакета.
+    """
+    if current_token:
+        created_by, author = current_token.user_id, f'клиентом {current_token.client_id}'
+    else:
+        current_user_id = get_jwt_identity()
+        user = User.query.get(current_user_id)
+        user_roles = [role.name for role in user.roles]
+        if 'admin' not in user_roles:
+            return jsonify({'error': 'Недостаточно прав'}), 403
+        created_by, author = int(current_user_id), f'пользователем {user.username}'
+
+    items = (request.get_json() or {}).get('slots') or []
+    if not isinstance(items, list) or not items:
+        return jsonify({'error': 'Список занятий пуст'}), 400
+    if len(items) > SCHEDULE_MAX_BATCH:
+        return jsonify({'error': f'Не более {SCHEDULE_MAX_BATCH} занятий за запрос'}), 400
+
+    rows, errors = [], {}
+    for position, item in enumerate(items):
+        row, error = _parse_slot(item)
+        if error:
+            errors[position] = error
+        else:
+            row['created_by'] = created_by
+            rows.append(row)
+    if errors:
+        return jsonify({'error': 'Занятия содержат ошибки', 'slots': errors}), 400
+
+    batch = [(row['starts_at'], row['ends_at'], _slot_keys(row)) for row in rows]
+    try:
+        _lock_schedule_writes()
+        index = _load_schedule_window(min(row['starts_at'] for row in rows), max(row['ends_at'] for row in rows))
+        conflicts = index.batch_conflicts(batch)
+        if conflicts:
+            db.session.rollback()
+            return jsonify({'error': 'Занятия пересекаются', 'conflicts': conflicts}), 409
+
+        db.session.execute(db.insert(ScheduleSlot), rows)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        print(f"❌ Ошибка загрузки расписания: {e}")
+        return jsonify({'error': 'Ошибка загрузки расписания'}), 500
+
+    print(f"🗓️ Загружено занятий: {len(rows)} {author}")
+    return jsonify({'message': 'Расписание загружено', 'count': len(rows)}), 201
+
+
+@app.route('/api/schedule/<int:slot_id>', methods=['DELETE'])
+@jwt_or_oauth_required('write:schedule')
+def delete_schedule_slot(slot_id):
+    """
+    Удаление занятия из расписания.
+    Доступно пользователям с ролью 'admin' и сервисам с областью write:schedule.
+
+    Args:
+        slot_id (int): Идентификатор занятия.
+
+    Returns:
+        JSON: Сообщение об успехе или ошибке.
+    """
+    if not current_token:
+        current_user_id = get_jwt_identity()
+        user = User.query.get(current_user_id)
+        user_roles = [role.name for role in user.roles]
+        if 'admin' not in user_roles:
+            return jsonify({'error': 'Недостаточно прав'}), 403
+
+    slot = ScheduleSlot.query.get(slot_id)
+    if not slot:
+        return jsonify({'error': 'Занятие не найдено'}), 404
+
+    try:
+        db.session.delete(slot)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        print(f"❌ Ошибка удаления занятия: {e}")
+        return jsonify({'error': 'Ошибка удаления занятия'}), 500
+
+    return jsonify({'message': 'Занятие удалено'}), 200
+
+
+"""
+================= API СТРУКТУРЫ =================
+Эндпоинты для управления структурными подразделениями университета.
+Доступно только для администраторов.
+"""
+
+@app.route('/api/departments', methods=['GET'])
+@jwt_required()
+def get_departments():
+    """
+    Получение иерархической структуры всех подразделений.
+    Доступно только пользователям с ролью 'admin'.
+
+    Returns:
+        JSON: Древовидная структура подразделений.
+    """
+    current_user_id = get_jwt_identity()
+    user = User.query.get(current_user_id)
+    user_roles = [role.name for role in user.roles]
+    if 'admin' not in user_roles:
+        return jsonify({'error': 'Недостаточно прав'}), 403
+
+    departments = Department.query.all()
+
+    def build_tree(parent_id=None):
+        result = []
+        for dept in departments:
+            if dept.parent_id == parent_id:
+                dept_data = {
+                    'id': dept.id,
+                    'name': dept.name,
+                    'short_name': dept.short_name,
+                    'description': dept.description,
+                    'parent_id': dept.parent_id,
+                    'head': {
+                        'id': dept.head.id,
+                        'name': f"{dept.head.profile.last_name} {dept.head.profile.first_name}" if dept.head and dept.head.profile else None
+                    } if dept.head else None,
+                    'headcount': dept.headcount,
+                    'subtree_headcount': dept.subtree_headcount,
+                    'children': build_tree(dept.id),
+                    'created_at': dept.created_at.strftime('%d.%m.%Y')
+                }
+                result.append(dept_data)
+        return result
+
+    tree = build_tree()
+    return jsonify(tree), 200
+
+
+@app.route('/api/departments', methods=['POST'])
+@jwt_required()
+def create_department():
+    """
+    Создание нового структурного подразделения.
+    Доступно только пользователям с ролью 'admin'.
+    Принимает JSON с данными подразделения: name, short_name, description, parent_id, head_user_id.
+
+    Returns:
+        JSON: ID созданного подразделения и сообщение об успехе или ошибке.
+    """
+    current_user_id = get_jwt_identity()
+    user = User.query.get(current_user_id)
+    user_roles = [role.name for role in user.roles]
+    if 'admin' not in user_roles:
+        return jsonify({'error': 'Недостаточно прав'}), 403
+
+    data = request.get_json()
+    try:
+        department = Department(
+            name=data.get('name'),
             short_name=data.get('short_name'),
             description=data.get('description'),
             parent_id=data.get('parent_id') if data.get('parent_id') else None,
             head_user_id=data.get('head_user_id') if data.get('head_user_id') else None,
             created_by=current_user_id
         )
-        db.session.add(department)
+        db.session.add(department)
+        db.session.commit()
+
+        print(f"🏢 Создано подразделение '{department.name}' пользователем {user.username}")
+        return jsonify({
+            'id': department.id,
+            'message': 'Подразделение создано'
+        }), 201
+
+    except Exception as e:
+        db.session.rollback()
+        print(f"❌ Ошибка создания подразделения: {e}")
+        return jsonify({'error': 'Ошибка создания подразделения'}), 500
+
+
+@app.route('/api/departments/<int:dept_id>', methods=['PUT'])
+@jwt_required()
+def update_department(dept_id):
+    """
+    Обновление существующего структурного подразделения.
+    Доступно только пользователям с ролью 'admin'.
+    Принимает JSON с обновляемыми данными.
+
+    Args:
+        dept_id (int): Идентификатор обновляемого подразделения.
+
+    Returns:
+        JSON: Сообщение об успехе или ошибке.
+    """
+    current_user_id = get_jwt_identity()
+    user = User.query.get(current_user_id)
+    user_roles = [role.name for role in user.roles]
+    if 'admin' not in user_roles:
+        return jsonify({'error': 'Недостаточно прав'}), 403
+
+    department = Department.query.get(dept_id)
+    if not department:
+        return jsonify({'error': 'Подразделение не найдено'}), 404
+
+    data = request.get_json()
+    try:
+        department.name = data.get('name', department.name)
+        department.short_name = data.get('short_name', department.short_name)
+        department.description = data.get('description', department.description)
+        department.parent_id = data.get('parent_id') if data.get('parent_id') is not None else department.parent_id # Allow setting parent_id to None
+        department.head_user_id = data.get('head_user_id') if data.get('head_user_id') is not None else department.head_user_id # Allow setting head_user_id to None
+
+        db.session.commit()
+        print(f"✏️ Обновлено подразделение '{department.name}'")
+        return jsonify({'message': 'Подразделение обновлено'}), 200
+
+    except Exception as e:
+        db.session.rollback()
+        print(f"❌ Ошибка обновления подразделения: {e}")
+        return jsonify({'error': 'Ошибка обновления подразделения'}), 500
+
+
+@app.route('/api/departments/<int:dept_id>', methods=['DELETE'])
+@jwt_required()
+def delete_department(dept_id):
+    """
+    Удаление структурного подразделения.
+    Доступно только пользователям с ролью 'admin'.
+    Нельзя удалить подразделение, если у него есть дочерние элементы.
+
+    Args:
+        dept_id (int): Идентификатор удаляемого подразделения.
+
+    Returns:
+        JSON: Сообщение об успехе или ошибке.
+    """
+    current_user_id = get_jwt_identity()
+    user = User.query.get(current_user_id)
+    user_roles = [role.name for role in user.roles]
+    if 'admin' not in user_roles:
+        return jsonify({'error': 'Недостаточно прав'}), 403
+
+    department = Department.query.get(dept_id)
+    if not department:
+        return jsonify({'error': 'Подразделение не найдено'}), 404
+
+    if department.children:
+        return jsonify({'error': 'Нельзя удалить подразделение с дочерними элементами'}), 400
+
+    if department.headcount:
+        return jsonify({'error': 'Нельзя удалить подразделение, за которым закреплены сотрудники'}), 400
+
+    try:
+        dept_name = department.name
+        db.session.delete(department)
+        db.session.commit()
+
+        print(f"🗑️ Удалено подразделение '{dept_name}'")
+        return jsonify({'message': 'Подразделение удалено'}), 200
+
+    except Exception as e:
+        db.session.rollback()
+        print(f"❌ Ошибка удаления подразделения: {e}")
+        return jsonify({'error': 'Ошибка удаления подразделения'}), 500
+
+
+@app.route('/api/users/employees', methods=['GET'])
+@jwt_or_oauth_required('read:users')
+def get_employees():
+    """
+    Получение списка сотрудников и преподавателей.
+    Используется, например, для выбора руководителя подразделения.
+    Доступно пользователям с ролью 'admin' и сервисам с областью read:users.
+
+    Returns:
+        JSON: Список пользователей с ролями 'employee' или 'teacher'.
+    """
+    if not current_token:
+        current_user_id = get_jwt_identity()
+        user = User.query.get(current_user_id)
+        user_roles = [role.name for role in user.roles]
+        if 'admin' not in user_roles:
+            return jsonify({'error': 'Недостаточно прав'}), 403
+
+    role_ids = [role.id for role in Role.query.filter(Role.name.in_(['employee', 'teacher']))]
+    employee_ids = get_role_index().union(role_ids)
+
+    unique_employees = User.query.options(db.joinedload(User.profile)).filter(
+        User.id.in_(employee_ids)
+    ).order_by(User.id).all() if employee_ids else []
+    result = []
+    for emp in unique_employees:
+        if emp.profile:
+            full_name = f"{emp.profile.last_name or ''} {emp.profile.first_name or ''}".strip()
+            if emp.profile.middle_name:
+                full_name += f" {emp.profile.middle_name}"
+        else:
+            full_name = emp.username
+        if not full_name: # Fallback if profile names are empty
+            full_name = emp.username
+
+
+        result.append({
+            'id': emp.id,
+            'name': full_name.strip(),
+            'username': emp.username,
+            'email': emp.email
+        })
+    return jsonify(result), 200
+
+
+@app.route('/api/users/<int:user_id>/profile', methods=['PUT'])
+@jwt_required()
+def update_user_profile(user_id):
+    """
+    Обновление служебных данных профиля пользователя.
+    Доступно только пользователям с ролью 'admin'.
+    Принимает JSON: department_id, position, course, group_name.
+    Текстовое поле department синхронизируется с названием подразделения.
+
+    Args:
+        user_id (int): Идентификатор пользователя, чей профиль обновляется.
+
+    Returns:
+        JSON: Сообщение об успехе или ошибке.
+    """
+    current_user_id = get_jwt_identity()
+    user = User.query.get(current_user_id)
+    user_roles = [role.name for role in user.roles]
+    if 'admin' not in user_roles:
+        return jsonify({'error': 'Недостаточно прав'}), 403
+
+    target = User.query.get(user_id)
+    if not target:
+        return jsonify({'error': 'Пользователь не найден'}), 404
+
+    data = request.get_json()
+    profile = target.profile or UserProfile(user_id=target.id)
+
+    if 'department_id' in data:
+        department = None
+        if data['department_id']:
+            department = Department.query.get(data['department_id'])
+            if not department:
+                return jsonify({'error': 'Подразделение не найдено'}), 404
+        profile.department_id = department.id if department else None
+        profile.department = department.name if department else None
+
+    profile.position = data.get('position', profile.position)
+    profile.course = data.get('course', profile.course)
+    profile.group_name = data.get('group_name', profile.group_name)
+
+    try:
+        db.session.add(profile)
+        db.session.commit()
+
+        print(f"✏️ Обновлен профиль пользователя {target.username}")
+        return jsonify({'message': 'Профиль обновлен'}), 200
+
+    except StaleDataError:
+        db.session.rollback()
+        return jsonify({'error': 'Профиль изменен другим пользователем, обновите данные'}), 409
+    except Exception as e:
+        db.session.rollback()
+        print(f"❌ Ошибка обновления профиля: {e}")
+        return jsonify({'error': 'Ошибка обновления профиля'}), 500
+
+
+"""
+================= API ГРУПП =================
+Списки студенческих групп по курсу и названию группы.
+Сводка численности групп кэшируется в памяти процесса и сбрасывается
+при любом изменении профилей в этом процессе; изменения, сделанные
+другими процессами, учитываются по истечении GROUP_SUMMARY_TTL секунд.
+"""
+
+ROSTER_PAGE_SIZE = 50
+ROSTER_MAX_PAGE_SIZE = 200
+GROUP_SUMMARY_TTL = 30
+
+_group_summary_cache = {'groups': None, 'expires': 0.0}
+
+
+@event.listens_for(db.session, 'before_flush')
+def _invalidate_group_summary(session, flush_context, instances):
+    """Сбрасывает кэш сводки групп, если в сессии изменяются профили."""
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(obj, UserProfile):
+            _group_summary_cache['groups'] = None
+            return
+
+
+def get_group_summary():
+    """
+    Возвращает сводку численности всех студенческих групп.
+    Результат берется из кэша; при его отсутствии или устаревании выполняется один
+    GROUP BY по индексу (course, group_name).
+
+    Returns:
+        list[dict]: Группы с полями course, group_name и members.
+    """
+    groups = _group_summary_cache['groups']
+    if groups is None or _group_summary_cache['expires'] <= time.monotonic():
+        expires = time.monotonic() + GROUP_SUMMARY_TTL
+        rows = db.session.execute(
+            select(UserProfile.course, UserProfile.group_name, db.func.count(UserProfile.id))
+            .where(UserProfile.course.isnot(None), UserProfile.group_name.isnot(None))
+            .group_by(UserProfile.course, UserProfile.group_name)
+            .order_by(UserProfile.course, UserProfile.group_name)
+        ).all()
+        groups = [
+            {'course': course, 'group_name': group_name, 'members': members}
+            for course, group_name, members in rows
+        ]
+        _group_summary_cache.update(groups=groups, expires=expires)
+    return groups
+
+
+@app.route('/api/groups', methods=['GET'])
+@jwt_required()
+def get_groups():
+    """
+    Получение списка студенческих групп с численностью.
+    Доступно пользователям с ролями 'admin', 'teacher' или 'employee'.
+    Необязательный параметр запроса course ограничивает список одним курсом.
+
+    Returns:
+        JSON: Список групп с количеством студентов.
+    """
+    current_user_id = get_jwt_identity()
+    user = User.query.get(current_user_id)
+    user_roles = [role.name for role in user.roles]
+    if not {'admin', 'teacher', 'employee'} & set(user_roles):
+        return jsonify({'error': 'Недостаточно прав'}), 403
+
+    groups = get_group_summary()
+    course = request.args.get('course', type=int)
+    if course is not None:
+        groups = [group for group in groups if group['course'] == course]
+    return jsonify(groups), 200
+
+
+@app.route('/api/groups/<int:course>/<group_name>/members', methods=['GET'])
+@jwt_required()
+def get_group_members(course, group_name):
+    """
+    Получение состава студенческой группы с keyset-пагинацией.
+    Доступно пользователям с ролями 'admin', 'teacher' или 'employee'.
+    Параметры запроса: limit (размер страницы), cursor (значение next_cursor
+    из предыдущего ответа).
+
+    Args:
+        course (int): Курс.
+        group_name (str): Название группы.
+
+    Returns:
+        JSON: {'items': [...], 'next_cursor': int | None}
+    """
+    current_user_id = get_jwt_identity()
+    user = User.query.get(current_user_id)
+    user_roles = [role.name for role in user.roles]
+    if not {'admin', 'teacher', 'employee'} & set(user_roles):
+        return jsonify({'error': 'Недостаточно прав'}), 403
+
+    limit = min(max(request.args.get('limit', ROSTER_PAGE_SIZE, type=int), 1), ROSTER_MAX_PAGE_SIZE)
+    cursor = request.args.get('cursor', 0, type=int)
+
+    rows = db.session.execute(
+        select(UserProfile, User)
+        .join(User, User.id == UserProfile.user_id)
+        .where(
+            UserProfile.course == course,
+            UserProfile.group_name == group_name,
+            UserProfile.id > cursor
+        )
+        .order_by(UserProfile.id)
+        .limit(limit + 1)
+    ).all()
+
+    items = []
+    for profile, member in rows[:limit]:
+        names = [profile.last_name, profile.first_name, profile.middle_name]
+        items.append({
+            'id': member.id,
+            'username': member.username,
+            'email': member.email,
+            'full_name': ' '.join(filter(None, names)) or member.username
+        })
+
+    next_cursor = rows[limit - 1][0].id if len(rows) > limit else None
+    return jsonify({'items': items, 'next_cursor': next_cursor}), 200
+
+
+"""
+================= API СТАТИСТИКИ =================
+Сводные показатели, рассчитываемые по индексам в памяти процесса.
+"""
+
+@app.route('/api/stats/roles', methods=['GET'])
+@jwt_required()
+def get_role_stats():
+    """
+    Получение количества пользователей по каждой роли.
+    Доступно только пользователям с ролью 'admin'.
+    Количество берется из индекса ролей без обращения к таблице user_roles.
+
+    Returns:
+        JSON: Список ролей с количеством пользователей.
+    """
+    current_user_id = get_jwt_identity()
+    user = User.query.get(current_user_id)
+    user_roles = [role.name for role in user.roles]
+    if 'admin' not in user_roles:
+        return jsonify({'error': 'Недостаточно прав'}), 403
+
+    index = get_role_index()
+    return jsonify([{
+        'id': role.id,
+        'name': role.name,
+        'display_name': role.display_name,
+        'count': index.count(role.id)
+    } for role in Role.query.order_by(Role.id).all()]), 200
+
+
+"""
+================= OAUTH2 =================
+Авторизация сторонних приложений университета по OAuth2 (authorization
+code + refresh token) и управление зарегистрированными клиентами.
+Клиенты для проверок authlib берутся из реестра в памяти, который
+сбрасывается при изменении клиента через API администратора.
+"""
+
+INTROSPECTION_MAX_BATCH = 500
+INTROSPECTION_MAX_AGE = 300
+
+OAUTH_SCOPES = {
+    'read:profile': 'Имя и данные профиля',
+    'read:email': 'Адрес электронной почты',
+    'read:roles': 'Роли в системе'
+}
+
+# Служебные области доступа для сервисов без пользователя (grant_type=client_credentials)
+SERVICE_SCOPES = {
+    'read:users': 'Чтение пользователей и профилей',
+    'read:schedule': 'Чтение расписания',
+    'write:schedule': 'Загрузка расписания'
+}
+
+
+def _parse_client_list(value):
+    """Принимает строку, разделенную пробелами, или список; возвращает список без повторов."""
+    if isinstance(value, str):
+        value = value.split()
+    if not isinstance(value, list):
+        return None
+    return list(dict.fromkeys(str(item).strip() for item in value if str(item).strip()))
+
+
+def _oauth_client_dict(client, include_secret=False):
+    result = {
+        'id': client.id,
+        'client_id': client.client_id,
+        'name': client.client_name,
+        'description': client.client_description,
+        'redirect_uris': (client.redirect_uris or '').split(),
+        'scopes': (client.default_scopes or '').split(),
+        'service_scopes': (client.service_scopes or '').split(),
+        'created_at': client.created_at.isoformat() if client.created_at else None
+    }
+    if include_secret:
+        result['client_secret'] = client.client_secret
+    return result
+
+
+def remember_consent(user_id, client_id, scope):
+    """
+    Запоминает согласие пользователя: области доступа объединяются
+    с ранее разрешенными одним UPSERT по (user_id, client_id).
+    """
+    consent = db.session.get(OAuth2Consent, (user_id, client_id))
+    scopes = set((scope or '').split()) | set(consent.scope.split() if consent else ())
+    now = datetime.utcnow()
+
+    table = OAuth2Consent.__table__
+    dialect = postgresql if db.engine.dialect.name == 'postgresql' else sqlite
+    stmt = dialect.insert(table).values(user_id=user_id, client_id=client_id, scope=' '.join(sorted(scopes)),
+                                        granted_at=now, updated_at=now)
+    db.session.execute(stmt.on_conflict_do_update(
+        index_elements=['user_id', 'client_id'],
+        set_={'scope': stmt.excluded.scope, 'updated_at': stmt.excluded.updated_at}
+    ))
+
+
+@app.route('/oauth/authorize', methods=['GET'])
+@jwt_required(optional=True)
+def oauth_authorize_info():
+    """
+    Проверка запроса авторизации стороннего приложения.
+    Используется страницей подтверждения доступа: возвращает название
+    приложения и запрашиваемые области доступа.
+    Если пользователь авторизован и уже разрешил этому приложению все
+    запрошенные области доступа, код выдается сразу и страница
+    подтверждения не показывается.
+
+    Returns:
+        JSON: Данные клиента и областей доступа, {'redirect_to': ...} для
+        запомненного согласия или ошибка OAuth2.
+    """
+    current_user_id = get_jwt_identity()
+    user = User.query.get(current_user_id) if current_user_id else None
+
+    try:
+        grant = authorization.get_consent_grant(end_user=user)
+    except Exception as e:
+        return jsonify({'error': getattr(e, 'error', 'invalid_request'),
+                        'error_description': getattr(e, 'description', str(e))}), 400
+
+    if user:
+        consent = db.session.get(OAuth2Consent, (user.id, grant.client.client_id))
+        if consent and consent.covers(grant.request.payload.scope):
+            response = authorization.create_authorization_response(grant=grant, grant_user=user)
+            location = response.headers.get('Location')
+            if location:
+                return jsonify({'redirect_to': location, 'remembered': True}), 200
+
+    scopes = (grant.request.payload.scope or '').split()
+    return jsonify({
+        'client_id': grant.client.client_id,
+        'client_name': grant.client.client_name,
+        'redirect_uri': grant.request.payload.redirect_uri,
+        'scopes': [{'name': scope, 'description': OAUTH_SCOPES.get(scope, scope)} for scope in scopes]
+    }), 200
+
+
+@app.route('/oauth/authorize', methods=['POST'])
+@jwt_required()
+def oauth_authorize():
+    """
+    Подтверждение (или отказ в) доступе стороннего приложения текущим пользователем.
+    Параметры запроса авторизации передаются в строке запроса, в теле
+    формы - confirm ('true' или 'false').
+
+    Returns:
+        JSON: {'redirect_to': адрес возврата в приложение с кодом или ошибкой}.
+    """
+    current_user_id = get_jwt_identity()
+    user = User.query.get(current_user_id)
+
+    try:
+        grant = authorization.get_consent_grant(end_user=user)
+    except Exception as e:
+        return jsonify({'error': getattr(e, 'error', 'invalid_request'),
+                        'error_description': getattr(e, 'description', str(e))}), 400
+
+    confirmed = request.form.get('confirm', request.args.get('confirm', 'false')).lower() == 'true'
+    response = authorization.create_authorization_response(grant=grant, grant_user=user if confirmed else None)
+    location = response.headers.get('Location')
+    if not location:
+        return response
+
+    if confirmed:
+        remember_consent(user.id, grant.client.client_id, grant.request.payload.scope)
+        db.session.commit()
+        print(f"🔓 Пользователь {user.username} разрешил доступ приложению {request.args.get('client_id')}")
+    return jsonify({'redirect_to': location}), 200
+
+
+@app.route('/oauth/token', methods=['POST'])
+def oauth_token():
+    """
+    Выдача токенов доступа (grant_type: authorization_code, refresh_token или client_credentials).
+
+    Returns:
+        JSON: Ответ token endpoint по RFC 6749.
+    """
+    return authorization.create_token_response()
+
+
+@app.route('/oauth/jwks', methods=['GET'])
+@app.route('/.well-known/jwks.json', methods=['GET'])
+def oauth_jwks():
+    """
+    Публичные ключи для проверки JWT access token (JWKS).
+    Сервисы-партнеры проверяют подпись токенов локально, без запросов к порталу.
+
+    Returns:
+        JSON: {'keys': [...]}
+    """
+    response = jsonify(signing_keys.public_jwks())
+    response.cache_control.public = True
+    response.cache_control.max_age = 300
+    return response
+
+
+def _authenticate_oauth_client():
+    """
+    Аутентифицирует клиента по client_secret_basic или client_secret_post.
+    Клиент берется из реестра в памяти, без обращения к БД.
+
+    Returns:
+        ClientRecord | None: Клиент или None при неверных учетных данных.
+    """
+    client_id, client_secret = extract_basic_authorization(request.headers)
+    if not client_id:
+        client_id, client_secret = request.form.get('client_id'), request.form.get('client_secret')
+    client = client_registry.get(client_id)
+    if client is None or not client_secret or not client.check_client_secret(client_secret):
+        return None
+    return client
+
+
+def _introspect_tokens(tokens):
+    """
+    Находит записи токенов. Подпись JWT проверяется локально, непрозрачные
+    токены берутся из кэша проверки. Остальные непрозрачные токены и jti
+    всех JWT загружаются одним запросом IN по access_token и refresh_token:
+    JWT, запись которого удалена (обновление, отзыв, удаление клиента),
+    считается недействительным.
+
+    Returns:
+        list[tuple[TokenRecord | None, bool]]: Запись и признак refresh token в порядке tokens.
+    """
+    records, missing, signed = {}, set(), {}
+    for token in tokens:
+        if is_jwt(token):
+            try:
+                record = TokenRecord.from_claims(signing_keys.decode(token))
+            except Exception:
+                continue
+            signed.setdefault(record.access_token, []).append((token, record))
+            continue
+        cached, record = token_cache.peek(token)
+        if cached:
+            records[token] = (record, False)
+        else:
+            missing.add(token)
+
+    if missing or signed:
+        rows = OAuth2Token.query.filter(db.or_(
+            OAuth2Token.access_token.in_(missing | set(signed)),
+            OAuth2Token.refresh_token.in_(missing)
+        )).all()
+        for row in rows:
+            for token, record in signed.get(row.access_token, ()):
+                records[token] = (record, False)
+            if row.access_token in missing:
+                record = TokenRecord(row)
+                records[row.access_token] = (record, False)
+                token_cache.put(record)
+            if row.refresh_token in missing:
+                records[row.refresh_token] = (TokenRecord(row), True)
+
+    return [records.get(token, (None, False)) for token in tokens]
+
+
+def _introspection_result(record, refresh, client, now):
+    if record is None or record.client_id != client.client_id:
+        return {'active': False}
+    # Refresh token действует дольше access token, выданного вместе с ним
+    expires_at = refresh_token_expires_at(record.issued_at) if refresh else record.expires_at
+    if expires_at <= now:
+        return {'active': False}
+    result = {
+        'active': True,
+        'scope': record.scope,
+        'client_id': record.client_id,
+        'exp': expires_at,
+        'iat': record.issued_at
+    }
+    if not refresh:
+        result['token_type'] = 'Bearer'
+    if record.user_id:
+        result['sub'] = str(record.user_id)
+    return result
+
+
+@app.route('/oauth/introspect', methods=['POST'])
+def oauth_introspect():
+    """
+    Проверка токенов по RFC 7662.
+    Клиент аутентифицируется через client_secret_basic или client_secret_post
+    и может проверять только выданные ему токены.
+    Принимает форму {'token': '...'} (ответ по RFC 7662) или
+    JSON {'tokens': ['...', ...]} для пакетной проверки.
+    Ответ кэшируется до истечения ближайшего из активных токенов,
+    но не дольше INTROSPECTION_MAX_AGE секунд.
+
+    Returns:
+        JSON: Результат проверки токена или {'tokens': [...]} в порядке запроса.
+    """
+    client = _authenticate_oauth_client()
+    if client is None:
+        response = jsonify({'error': 'invalid_client'})
+        response.status_code = 401
+        response.headers['WWW-Authenticate'] = 'Basic'
+        return response
+
+    batch = request.is_json
+    tokens = (request.get_json(silent=True) or {}).get('tokens') if batch else [request.form.get('token')]
+    if not isinstance(tokens, list) or not tokens or not all(isinstance(t, str) and t for t in tokens):
+        return jsonify({'error': 'invalid_request'}), 400
+    if len(tokens) > INTROSPECTION_MAX_BATCH:
+        return jsonify({'error': 'invalid_request',
+                        'error_description': f'Не более {INTROSPECTION_MAX_BATCH} токенов за запрос'}), 400
+
+    now = int(time.time())
+    results = [_introspection_result(record, refresh, client, now) for record, refresh in _introspect_tokens(tokens)]
+
+    response = jsonify({'tokens': results} if batch else results[0])
+    expirations = [result['exp'] for result in results if result['active']]
+    max_age = min([INTROSPECTION_MAX_AGE] + [exp - now for exp in expirations])
+    response.cache_control.private = True
+    response.cache_control.max_age = max(max_age, 0)
+    return response
+
+
+"""
+================= OAUTH USERINFO =================
+Данные пользователя для приложений-партнеров по OAuth2 токену.
+Разделы ответа строятся один раз при загрузке пользователя и хранятся
+в кэше процесса; для каждого набора областей доступа ответ и его ETag
+вычисляются один раз. Кэш сбрасывается после commit, изменившего
+пользователя, его профиль или роли.
+"""
+
+USERINFO_CACHE_TTL = 60
+
+
+def _userinfo_profile(user):
+    profile = user.profile
+    if profile is None:
+        return {'full_name': None, 'profile': None}
+    return {
+        'full_name': ' '.join(filter(None, [profile.last_name, profile.first_name, profile.middle_name])) or None,
+        'profile': {
+            'first_name': profile.first_name,
+            'last_name': profile.last_name,
+            'middle_name': profile.middle_name,
+            'gender': profile.gender,
+            'department': profile.department,
+            'department_id': profile.department_id,
+            'position': profile.position,
+            'course': profile.course,
+            'group_name': profile.group_name,
+            'school': profile.school
+        }
+    }
+
+
+def _userinfo_email(user):
+    return {'email': user.email, 'email_verified': bool(user.is_verified)}
+
+
+def _userinfo_roles(user):
+    return {
+        'roles': [role.name for role in user.roles],
+        'display_roles': [role.display_name or role.name for role in user.roles]
+    }
+
+
+USERINFO_SECTIONS = {
+    'read:profile': _userinfo_profile,
+    'read:email': _userinfo_email,
+    'read:roles': _userinfo_roles
+}
+
+
+@lru_cache(maxsize=64)
+def _userinfo_projection(scopes):
+    """Разделы ответа для набора областей доступа (frozenset) в постоянном порядке."""
+    return tuple(scope for scope in USERINFO_SECTIONS if scope in scopes)
+
+
+def _load_userinfo_sections(user_id):
+    """
+    Загружает пользователя с профилем и ролями одним запросом и строит все разделы ответа.
+
+    Returns:
+        dict | None: Разделы по области доступа ('' - общие поля) или None, если пользователя нет.
+    """
+    user = db.session.execute(
+        select(User)
+        .options(db.joinedload(User.profile), db.joinedload(User.roles))
+        .where(User.id == user_id)
+    ).unique().scalar_one_or_none()
+    if user is None:
+        return None
+    sections = {scope: build(user) for scope, build in USERINFO_SECTIONS.items()}
+    sections[''] = {'id': user.id, 'sub': str(user.id), 'username': user.username}
+    return sections
+
+
+class UserInfoCache:
+    """
+    Кэш ответов userinfo по пользователю.
+
+    Запись хранит разделы ответа и уже собранные представления по наборам
+    областей доступа вместе с ETag. Счетчик версий не дает сохранить данные,
+    загруженные до сброса, который произошел во время загрузки.
+
+    Атрибуты:
+        ttl (int): Срок жизни записи в секундах.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._entries = {}
+        self._version = 0
+        self._lock = threading.Lock()
+
+    def get(self, user_id, scopes, load):
+        """
+        Returns:
+            tuple[dict, str] | None: Ответ для набора областей доступа и его ETag.
+        """
+        now = time.monotonic()
+        entry = self._entries.get(user_id)
+        if entry is None or entry['expires_at'] <= now:
+            version = self._version
+            sections = load(user_id)
+            if sections is None:
+                return None
+            entry = {'sections': sections, 'views': {}, 'expires_at': now + self.ttl}
+            with self._lock:
+                if version == self._version:
+                    self._entries[user_id] = entry
+
+        view = entry['views'].get(scopes)
+        if view is None:
+            data = dict(entry['sections'][''])
+            for scope in _userinfo_projection(scopes):
+                data.update(entry['sections'][scope])
+            encoded = json.dumps(data, sort_keys=True, ensure_ascii=False).encode()
+            view = entry['views'][scopes] = (data, hashlib.sha256(encoded).hexdigest()[:32])
+        return view
+
+    def evict(self, *user_ids):
+        with self._lock:
+            self._version += 1
+            for user_id in user_ids:
+                self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._version += 1
+            self._entries = {}
+
+
+userinfo_cache = UserInfoCache(USERINFO_CACHE_TTL)
+
+
+@event.listens_for(db.session, 'after_flush')
+def _collect_userinfo_changes(session, flush_context):
+    """Запоминает пользователей, чьи данные userinfo изменились в транзакции."""
+    changed = session.info.setdefault('userinfo_changed', set())
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(obj, User):
+            changed.add(obj.id)
+        elif isinstance(obj, UserProfile):
+            changed.add(obj.user_id)
+        elif isinstance(obj, Role):
+            changed.add(None)
+
+
+@event.listens_for(db.session, 'after_commit')
+def _apply_userinfo_changes(session):
+    """Сбрасывает кэш userinfo для пользователей зафиксированной транзакции."""
+    changed = session.info.pop('userinfo_changed', None)
+    if not changed:
+        return
+    if None in changed:
+        userinfo_cache.clear()
+    else:
+        userinfo_cache.evict(*changed)
+
+
+@event.listens_for(db.session, 'after_soft_rollback')
+def _discard_userinfo_changes(session, previous_transaction):
+    session.info.pop('userinfo_changed', None)
+
+
+@app.route('/api/oauth/user', methods=['GET'])
+@require_oauth()
+def oauth_userinfo():
+    """
+    Данные пользователя по OAuth2 access token.
+    Набор полей зависит от областей доступа токена: read:profile - ФИО и
+    профиль, read:email - email, read:roles - роли. Поддерживает условные
+    запросы: при совпадении If-None-Match возвращается 304 без тела.
+
+    Returns:
+        JSON: Данные пользователя.
+    """
+    if not current_token.user_id:
+        return jsonify({'error': 'Токен не связан с пользователем'}), 403
+
+    view = userinfo_cache.get(current_token.user_id, frozenset((current_token.scope or '').split()),
+                              _load_userinfo_sections)
+    if view is None:
+        return jsonify({'error': 'Пользователь не найден'}), 404
+
+    data, etag = view
+    response = jsonify(data)
+    response.set_etag(etag)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+
+@app.route('/api/admin/oauth-keys/rotate', methods=['POST'])
+@jwt_required()
+def rotate_oauth_keys():
+    """
+    Ротация ключа подписи JWT access token.
+    Доступно только пользователям с ролью 'admin'. Прежний ключ остается
+    в JWKS до истечения срока выданных им токенов.
+
+    Returns:
+        JSON: Идентификатор нового ключа.
+    """
+    current_user_id = get_jwt_identity()
+    user = User.query.get(current_user_id)
+    user_roles = [role.name for role in user.roles]
+    if 'admin' not in user_roles:
+        return jsonify({'error': 'Недостаточно прав'}), 403
+
+    kid = signing_keys.rotate()
+    print(f"🔑 Выпущен новый ключ подписи токенов {kid} пользователем {user.username}")
+    return jsonify({'kid': kid}), 201
+
+
+@app.route('/api/admin/oauth-clients', methods=['GET'])
+@jwt_required()
+def get_oauth_clients():
+    """
+    Получение списка зарегистрированных OAuth2 клиентов.
+    Доступно только пользователям с ролью 'admin'.
+
+    Returns:
+        JSON: Список клиентов (без секретов).
+    """
+    current_user_id = get_jwt_identity()
+    user = User.query.get(current_user_id)
+    user_roles = [role.name for role in user.roles]
+    if 'admin' not in user_roles:
+        return jsonify({'error': 'Недостаточно прав'}), 403
+
+    clients = OAuth2Client.query.order_by(OAuth2Client.id).all()
+    return jsonify([_oauth_client_dict(client) for client in clients]), 200
+
+
+@app.route('/api/admin/oauth-clients', methods=['POST'])
+@jwt_required()
+def create_oauth_client():
+    """
+    Регистрация нового OAuth2 клиента.
+    Доступно только пользователям с ролью 'admin'.
+    Принимает JSON: name, description, redirect_uris, scopes, service_scopes
+    (строки, разделенные пробелами, или списки). Клиенту только со
+    служебными областями доступа адреса перенаправления не нужны.
+
+    Returns:
+        JSON: Данные клиента вместе с client_secret (показывается один раз).
+    """
+    current_user_id = get_jwt_identity()
+    user = User.query.get(current_user_id)
+    user_roles = [role.name for role in user.roles]
+    if 'admin' not in user_roles:
+        return jsonify({'error': 'Недостаточно прав'}), 403
+
+    data = request.get_json() or {}
+    name = (data.get('name') or '').strip()
+    redirect_uris = _parse_client_list(data.get('redirect_uris', []))
+    scopes = _parse_client_list(data.get('scopes', []))
+    service_scopes = _parse_client_list(data.get('service_scopes', []))
+    if not name:
+        return jsonify({'error': 'Не указано название клиента'}), 400
+    if redirect_uris is None or not (redirect_uris or service_scopes):
+        return jsonify({'error': 'Не указаны адреса перенаправления'}), 400
+    if scopes is None or set(scopes) - set(OAUTH_SCOPES):
+        return jsonify({'error': 'Неизвестные области доступа'}), 400
+    if service_scopes is None or set(service_scopes) - set(SERVICE_SCOPES):
+        return jsonify({'error': 'Неизвестные служебные области доступа'}), 400
+
+    try:
+        client = OAuth2Client(
+            client_id=gen_salt(24),
+            client_secret=gen_salt(48),
+            client_name=name,
+            client_description=data.get('description'),
+            redirect_uris=' '.join(redirect_uris),
+            default_scopes=' '.join(scopes),
+            service_scopes=' '.join(service_scopes),
+            created_by=int(current_user_id)
+        )
+        db.session.add(client)
         db.session.commit()
+        client_registry.invalidate(client.client_id)
 
-        print(f"🏢 Создано подразделение '{department.name}' пользователем {user.username}")
-        return jsonify({
-            'id': department.id,
-            'message': 'Подразделение создано'
-        }), 201
+        print(f"🔌 Зарегистрирован OAuth2 клиент '{client.client_name}' пользователем {user.username}")
+        return jsonify(_oauth_client_dict(client, include_secret=True)), 201
 
     except Exception as e:
         db.session.rollback()
-        print(f"❌ Ошибка создания подразделения: {e}")
-        return jsonify({'error': 'Ошибка создания подразделения'}), 500
+        print(f"❌ Ошибка регистрации OAuth2 клиента: {e}")
+        return jsonify({'error': 'Ошибка регистрации клиента'}), 500
 
 
-@app.route('/api/departments/<int:dept_id>', methods=['PUT'])
+@app.route('/api/admin/oauth-clients/<int:client_pk>', methods=['PUT'])
 @jwt_required()
-def update_department(dept_id):
+def update_oauth_client(client_pk):
     """
-    Обновление существующего структурного подразделения.
+    Изменение OAuth2 клиента.
     Доступно только пользователям с ролью 'admin'.
-    Принимает JSON с обновляемыми данными.
+    Принимает JSON: name, description, redirect_uris, scopes, service_scopes, regenerate_secret.
 
     Args:
-        dept_id (int): Идентификатор обновляемого подразделения.
+        client_pk (int): Идентификатор записи клиента.
 
     Returns:
-        JSON: Сообщение об успехе или ошибке.
+        JSON: Обновленные данные клиента (с новым секретом, если он перевыпущен).
     """
     current_user_id = get_jwt_identity()
     user = User.query.get(current_user_id)
@@ -976,38 +4138,57 @@ def update_department(dept_id):
     if 'admin' not in user_roles:
         return jsonify({'error': 'Недостаточно прав'}), 403
 
-    department = Department.query.get(dept_id)
-    if not department:
-        return jsonify({'error': 'Подразделение не найдено'}), 404
+    client = OAuth2Client.query.get(client_pk)
+    if not client:
+        return jsonify({'error': 'Клиент не найден'}), 404
+
+    data = request.get_json() or {}
+    if 'redirect_uris' in data:
+        redirect_uris = _parse_client_list(data['redirect_uris'])
+        if redirect_uris is None:
+            return jsonify({'error': 'Не указаны адреса перенаправления'}), 400
+        client.redirect_uris = ' '.join(redirect_uris)
+    if 'scopes' in data:
+        scopes = _parse_client_list(data['scopes'])
+        if scopes is None or set(scopes) - set(OAUTH_SCOPES):
+            return jsonify({'error': 'Неизвестные области доступа'}), 400
+        client.default_scopes = ' '.join(scopes)
+    if 'service_scopes' in data:
+        service_scopes = _parse_client_list(data['service_scopes'])
+        if service_scopes is None or set(service_scopes) - set(SERVICE_SCOPES):
+            return jsonify({'error': 'Неизвестные служебные области доступа'}), 400
+        client.service_scopes = ' '.join(service_scopes)
+    if not (client.redirect_uris or client.service_scopes):
+        return jsonify({'error': 'Не указаны адреса перенаправления'}), 400
+    if data.get('name'):
+        client.client_name = data['name'].strip()
+    if 'description' in data:
+        client.client_description = data['description']
+    regenerate = bool(data.get('regenerate_secret'))
+    if regenerate:
+        client.client_secret = gen_salt(48)
 
-    data = request.get_json()
     try:
-        department.name = data.get('name', department.name)
-        department.short_name = data.get('short_name', department.short_name)
-        department.description = data.get('description', department.description)
-        department.parent_id = data.get('parent_id') if data.get('parent_id') is not None else department.parent_id # Allow setting parent_id to None
-        department.head_user_id = data.get('head_user_id') if data.get('head_user_id') is not None else department.head_user_id # Allow setting head_user_id to None
-
         db.session.commit()
-        print(f"✏️ Обновлено подразделение '{department.name}'")
-        return jsonify({'message': 'Подразделение обновлено'}), 200
+        client_registry.invalidate(client.client_id)
+        invalidate_webhook_subscriptions()
+        return jsonify(_oauth_client_dict(client, include_secret=regenerate)), 200
 
     except Exception as e:
         db.session.rollback()
-        print(f"❌ Ошибка обновления подразделения: {e}")
-        return jsonify({'error': 'Ошибка обновления подразделения'}), 500
+        print(f"❌ Ошибка изменения OAuth2 клиента: {e}")
+        return jsonify({'error': 'Ошибка изменения клиента'}), 500
 
 
-@app.route('/api/departments/<int:dept_id>', methods=['DELETE'])
+@app.route('/api/admin/oauth-clients/<int:client_pk>', methods=['DELETE'])
 @jwt_required()
-def delete_department(dept_id):
+def delete_oauth_client(client_pk):
     """
-    Удаление структурного подразделения.
+    Удаление OAuth2 клиента вместе с его кодами авторизации и токенами.
     Доступно только пользователям с ролью 'admin'.
-    Нельзя удалить подразделение, если у него есть дочерние элементы.
 
     Args:
-        dept_id (int): Идентификатор удаляемого подразделения.
+        client_pk (int): Идентификатор записи клиента.
 
     Returns:
         JSON: Сообщение об успехе или ошибке.
@@ -1018,37 +4199,42 @@ def delete_department(dept_id):
     if 'admin' not in user_roles:
         return jsonify({'error': 'Недостаточно прав'}), 403
 
-    department = Department.query.get(dept_id)
-    if not department:
-        return jsonify({'error': 'Подразделение не найдено'}), 404
-
-    if department.children:
-        return jsonify({'error': 'Нельзя удалить подразделение с дочерними элементами'}), 400
+    client = OAuth2Client.query.get(client_pk)
+    if not client:
+        return jsonify({'error': 'Клиент не найден'}), 404
 
     try:
-        dept_name = department.name
-        db.session.delete(department)
+        client_id, client_name = client.client_id, client.client_name
+        OAuth2AuthorizationCode.query.filter_by(client_id=client_id).delete()
+        OAuth2Token.query.filter_by(client_id=client_id).delete()
+        OAuth2Consent.query.filter_by(client_id=client_id).delete()
+        WebhookSubscription.query.filter_by(client_id=client_id).delete()
+        db.session.delete(client)
         db.session.commit()
+        client_registry.invalidate(client_id)
+        token_cache.evict_client(client_id)
+        service_tokens.evict_client(client_id)
+        invalidate_webhook_subscriptions()
 
-        print(f"🗑️ Удалено подразделение '{dept_name}'")
-        return jsonify({'message': 'Подразделение удалено'}), 200
+        print(f"🗑️ Удален OAuth2 клиент '{client_name}' пользователем {user.username}")
+        return jsonify({'message': 'Клиент удален'}), 200
 
     except Exception as e:
         db.session.rollback()
-        print(f"❌ Ошибка удаления подразделения: {e}")
-        return jsonify({'error': 'Ошибка удаления подразделения'}), 500
+        print(f"❌ Ошибка удаления OAuth2 клиента: {e}")
+        return jsonify({'error': 'Ошибка удаления клиента'}), 500
 
 
-@app.route('/api/users/employees', methods=['GET'])
+@app.route('/api/admin/oauth-consents', methods=['GET'])
 @jwt_required()
-def get_employees():
+def get_oauth_consents():
     """
-    Получение списка сотрудников и преподавателей.
-    Используется, например, для выбора руководителя подразделения.
+    Список запомненных согласий пользователей на доступ приложений.
     Доступно только пользователям с ролью 'admin'.
+    Query-параметры: user_id, client_id - фильтры.
 
     Returns:
-        JSON: Список пользователей с ролями 'employee' или 'teacher'.
+        JSON: Список согласий.
     """
     current_user_id = get_jwt_identity()
     user = User.query.get(current_user_id)
@@ -1056,35 +4242,354 @@ def get_employees():
     if 'admin' not in user_roles:
         return jsonify({'error': 'Недостаточно прав'}), 403
 
-    employee_role = Role.query.filter_by(name='employee').first()
-    teacher_role = Role.query.filter_by(name='teacher').first()
+    query = OAuth2Consent.query
+    if request.args.get('user_id', type=int):
+        query = query.filter_by(user_id=request.args.get('user_id', type=int))
+    if request.args.get('client_id'):
+        query = query.filter_by(client_id=request.args.get('client_id'))
 
-    employees = []
-    if employee_role:
-        employees.extend(employee_role.users)
-    if teacher_role:
-        employees.extend(teacher_role.users)
+    return jsonify([{
+        'user_id': consent.user_id,
+        'client_id': consent.client_id,
+        'scopes': consent.scope.split(),
+        'granted_at': consent.granted_at.isoformat() if consent.granted_at else None,
+        'updated_at': consent.updated_at.isoformat() if consent.updated_at else None
+    } for consent in query.order_by(OAuth2Consent.updated_at.desc()).all()]), 200
 
-    unique_employees = {emp.id: emp for emp in employees}.values()
-    result = []
-    for emp in unique_employees:
-        if emp.profile:
-            full_name = f"{emp.profile.last_name or ''} {emp.profile.first_name or ''}".strip()
-            if emp.profile.middle_name:
-                full_name += f" {emp.profile.middle_name}"
-        else:
-            full_name = emp.username
-        if not full_name: # Fallback if profile names are empty
-            full_name = emp.username
 
+@app.route('/api/admin/oauth-consents/<int:user_id>/<client_id>', methods=['DELETE'])
+@jwt_required()
+def revoke_oauth_consent(user_id, client_id):
+    """
+    Отзыв согласия пользователя вместе с выданными по нему токенами.
+    При следующем входе приложение снова запросит подтверждение.
+    Доступно только пользователям с ролью 'admin'.
+
+    Args:
+        user_id (int): Идентификатор пользователя.
+        client_id (str): Идентификатор клиента.
+
+    Returns:
+        JSON: Сообщение об успехе или ошибке.
+    """
+    current_user_id = get_jwt_identity()
+    user = User.query.get(current_user_id)
+    user_roles = [role.name for role in user.roles]
+    if 'admin' not in user_roles:
+        return jsonify({'error': 'Недостаточно прав'}), 403
+
+    consent = db.session.get(OAuth2Consent, (user_id, client_id))
+    if not consent:
+        return jsonify({'error': 'Согласие не найдено'}), 404
+
+    tokens = OAuth2Token.query.filter_by(user_id=user_id, client_id=client_id).all()
+    access_tokens = [token.access_token for token in tokens]
+    for token in tokens:
+        db.session.delete(token)
+    db.session.delete(consent)
+    db.session.commit()
+    token_cache.evict(*access_tokens)
+
+    print(f"🚫 Отозвано согласие пользователя {user_id} для приложения {client_id} "
+          f"(токенов: {len(access_tokens)}) пользователем {user.username}")
+    return jsonify({'message': 'Согласие отозвано', 'revoked_tokens': len(access_tokens)}), 200
+
+
+"""
+================= WEBHOOK-СОБЫТИЯ =================
+Уведомления приложений-партнеров об изменениях пользователей и
+подразделений вместо опроса API. События записываются в таблицу
+webhook_outbox в той же транзакции, что и изменения, поэтому не теряются,
+если в процессе, зафиксировавшем изменение, диспетчер не запущен.
+Диспетчер любого процесса забирает события из таблицы (удаляя их) и
+доставляет пакетами; после commit диспетчер своего процесса опрашивает
+таблицу сразу. Доставка забранных событий - не более одного раза: при
+остановке процесса до успешной отправки они теряются.
+События о пользователе получают только клиенты, которым пользователь
+дал согласие, и клиенты со служебной областью доступа read:users.
+"""
+
+WEBHOOK_EVENTS = {
+    'user.created': 'Пользователь зарегистрирован',
+    'user.updated': 'Изменены данные, профиль или роли пользователя',
+    'user.deleted': 'Пользователь удален',
+    'department.created': 'Создано подразделение',
+    'department.updated': 'Изменено подразделение',
+    'department.deleted': 'Подразделение удалено'
+}
+# Изменения этих атрибутов не порождают событий
+WEBHOOK_IGNORED_ATTRIBUTES = frozenset({'last_login', 'password_hash', 'headcount', 'subtree_headcount'})
+# Подписки, измененные в другом процессе, учитываются не позже чем через столько секунд
+WEBHOOK_SUBSCRIPTIONS_TTL = 10
+
+_webhook_subscriptions = None
+_webhook_subscriptions_expires = 0.0
+_webhook_subscriptions_version = 0
+
+
+def get_webhook_subscriptions():
+    """
+    Активные подписки. Список хранится в памяти процесса
+    WEBHOOK_SUBSCRIPTIONS_TTL секунд и сбрасывается при изменении
+    подписок в этом процессе.
+    """
+    global _webhook_subscriptions, _webhook_subscriptions_expires
+    subscriptions = _webhook_subscriptions
+    if subscriptions is None or _webhook_subscriptions_expires <= time.monotonic():
+        version = _webhook_subscriptions_version
+        expires = time.monotonic() + WEBHOOK_SUBSCRIPTIONS_TTL
+        rows = db.session.execute(
+            select(WebhookSubscription, OAuth2Client.service_scopes)
+            .join(OAuth2Client, OAuth2Client.client_id == WebhookSubscription.client_id)
+            .where(WebhookSubscription.is_active.is_(True))
+        ).all()
+        subscriptions = [
+            Subscription(sub.id, sub.client_id, sub.url, sub.secret, frozenset((sub.events or '').split()),
+                         'read:users' in (service_scopes or '').split())
+            for sub, service_scopes in rows
+        ]
+        if version == _webhook_subscriptions_version:
+            _webhook_subscriptions, _webhook_subscriptions_expires = subscriptions, expires
+    return subscriptions
+
+
+def invalidate_webhook_subscriptions():
+    global _webhook_subscriptions, _webhook_subscriptions_version
+    _webhook_subscriptions_version += 1
+    _webhook_subscriptions = None
+
+
+def _route_webhook_events(events):
+    """
+    Распределяет события по подпискам (выполняется в потоке диспетчера).
+
+    Returns:
+        list[tuple]: Пары (Subscription, событие).
+    """
+    with app.app_context():
+        subscriptions = get_webhook_subscriptions()
+        if not subscriptions:
+            return []
+        user_ids = {event['object']['id'] for event in events if event['type'].startswith('user.')}
+        audience = {}
+        if user_ids:
+            for user_id, client_id in db.session.execute(
+                select(OAuth2Consent.user_id, OAuth2Consent.client_id).where(OAuth2Consent.user_id.in_(user_ids))
+            ):
+                audience.setdefault(user_id, set()).add(client_id)
+
+    routed = []
+    for event in events:
+        about_user = event['type'].startswith('user.')
+        for subscription in subscriptions:
+            if subscription.events and event['type'] not in subscription.events:
+                continue
+            if about_user and not subscription.all_users and \
+                    subscription.client_id not in audience.get(event['object']['id'], ()):
+                continue
+            routed.append((subscription, event))
+    return routed
+
+
+def _claim_webhook_events(limit):
+    """
+    Забирает из webhook_outbox не более limit событий (выполняется в потоке
+    диспетчера). Строки удаляются в той же транзакции, поэтому каждое событие
+    забирает только один процесс.
+
+    Returns:
+        list[dict]: События в порядке записи.
+    """
+    table = WebhookOutbox.__table__
+    claimed = select(table.c.id).order_by(table.c.id).limit(limit)
+    with app.app_context():
+        if db.engine.dialect.name == 'postgresql':
+            claimed = claimed.with_for_update(skip_locked=True)
+        try:
+            rows = db.session.execute(
+                table.delete().where(table.c.id.in_(claimed.scalar_subquery())).returning(table.c.id, table.c.payload)
+            ).all()
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+    return [json.loads(payload) for _, payload in sorted(rows)]
+
+
+webhook_dispatcher = WebhookDispatcher(_route_webhook_events, fetch=_claim_webhook_events)
+
+
+def _has_webhook_changes(obj):
+    state = sa_inspect(obj)
+    return any(attr.history.has_changes() for attr in state.attrs if attr.key not in WEBHOOK_IGNORED_ATTRIBUTES)
+
+
+@event.listens_for(db.session, 'after_flush')
+def _collect_webhook_events(session, flush_context):
+    """Записывает события об изменениях пользователей и подразделений в webhook_outbox."""
+    changes = {}
+
+    def add(kind, object_id, action):
+        key = (kind, object_id)
+        if not (changes.get(key) == 'created' and action == 'updated'):
+            changes[key] = action
+
+    for obj in session.new:
+        if isinstance(obj, (User, Department)):
+            add(obj.__tablename__, obj.id, 'created')
+        elif isinstance(obj, UserProfile):
+            add('user', obj.user_id, 'updated')
+    for obj in session.dirty:
+        if isinstance(obj, (User, Department, UserProfile)) and _has_webhook_changes(obj):
+            if isinstance(obj, UserProfile):
+                add('user', obj.user_id, 'updated')
+            else:
+                add(obj.__tablename__, obj.id, 'updated')
+    for obj in session.deleted:
+        if isinstance(obj, (User, Department)):
+            add(obj.__tablename__, obj.id, 'deleted')
+        elif isinstance(obj, UserProfile):
+            add('user', obj.user_id, 'updated')
+
+    if changes:
+        session.connection().execute(WebhookOutbox.__table__.insert(), [
+            {'payload': json.dumps(make_event(f'{kind}.{action}', object_id)), 'created_at': datetime.utcnow()}
+            for (kind, object_id), action in changes.items()
+        ])
+        session.info['webhook_outbox'] = True
+
+
+@event.listens_for(db.session, 'after_commit')
+def _wake_webhook_dispatcher(session):
+    """Сообщает диспетчеру о новых событиях зафиксированной транзакции."""
+    if session.info.pop('webhook_outbox', None):
+        webhook_dispatcher.wake()
+
+
+@event.listens_for(db.session, 'after_soft_rollback')
+def _discard_webhook_events(session, previous_transaction):
+    session.info.pop('webhook_outbox', None)
+
+
+def _webhook_dict(subscription, include_secret=False):
+    result = {
+        'id': subscription.id,
+        'client_id': subscription.client_id,
+        'url': subscription.url,
+        'events': (subscription.events or '').split(),
+        'is_active': subscription.is_active,
+        'created_at': subscription.created_at.isoformat() if subscription.created_at else None,
+        'delivery': webhook_dispatcher.stats(subscription.id)
+    }
+    if include_secret:
+        result['secret'] = subscription.secret
+    return result
 
-        result.append({
-            'id': emp.id,
-            'name': full_name.strip(),
-            'username': emp.username,
-            'email': emp.email
-        })
-    return jsonify(result), 200
+
+@app.route('/api/admin/oauth-clients/<int:client_pk>/webhooks', methods=['GET'])
+@jwt_required()
+def get_client_webhooks(client_pk):
+    """
+    Список webhook-подписок OAuth2 клиента со статистикой доставки.
+    Доступно только пользователям с ролью 'admin'.
+
+    Args:
+        client_pk (int): Идентификатор записи клиента.
+
+    Returns:
+        JSON: Список подписок.
+    """
+    current_user_id = get_jwt_identity()
+    user = User.query.get(current_user_id)
+    user_roles = [role.name for role in user.roles]
+    if 'admin' not in user_roles:
+        return jsonify({'error': 'Недостаточно прав'}), 403
+
+    client = OAuth2Client.query.get(client_pk)
+    if not client:
+        return jsonify({'error': 'Клиент не найден'}), 404
+
+    subscriptions = WebhookSubscription.query.filter_by(client_id=client.client_id) \
+        .order_by(WebhookSubscription.id).all()
+    return jsonify([_webhook_dict(subscription) for subscription in subscriptions]), 200
+
+
+@app.route('/api/admin/oauth-clients/<int:client_pk>/webhooks', methods=['POST'])
+@jwt_required()
+def create_client_webhook(client_pk):
+    """
+    Создание webhook-подписки OAuth2 клиента.
+    Доступно только пользователям с ролью 'admin'.
+    Принимает JSON: url, events (типы событий; по умолчанию все).
+    Запросы подписываются заголовком X-Webhook-Signature:
+    sha256=HMAC-SHA256(secret, '<X-Webhook-Timestamp>.<тело запроса>').
+
+    Args:
+        client_pk (int): Идентификатор записи клиента.
+
+    Returns:
+        JSON: Подписка вместе с secret (показывается один раз).
+    """
+    current_user_id = get_jwt_identity()
+    user = User.query.get(current_user_id)
+    user_roles = [role.name for role in user.roles]
+    if 'admin' not in user_roles:
+        return jsonify({'error': 'Недостаточно прав'}), 403
+
+    client = OAuth2Client.query.get(client_pk)
+    if not client:
+        return jsonify({'error': 'Клиент не найден'}), 404
+
+    data = request.get_json() or {}
+    url = (data.get('url') or '').strip()
+    events = _parse_client_list(data.get('events', []))
+    if not re.match(r'^https?://', url):
+        return jsonify({'error': 'Укажите адрес http(s) для доставки событий'}), 400
+    if events is None or set(events) - set(WEBHOOK_EVENTS):
+        return jsonify({'error': 'Неизвестные типы событий'}), 400
+
+    subscription = WebhookSubscription(
+        client_id=client.client_id,
+        url=url,
+        secret=gen_salt(48),
+        events=' '.join(events),
+        created_by=int(current_user_id)
+    )
+    db.session.add(subscription)
+    db.session.commit()
+    invalidate_webhook_subscriptions()
+
+    print(f"🪝 Создана webhook-подписка клиента '{client.client_name}' на {url}")
+    return jsonify(_webhook_dict(subscription, include_secret=True)), 201
+
+
+@app.route('/api/admin/webhooks/<int:webhook_id>', methods=['DELETE'])
+@jwt_required()
+def delete_webhook(webhook_id):
+    """
+    Удаление webhook-подписки.
+    Доступно только пользователям с ролью 'admin'.
+
+    Args:
+        webhook_id (int): Идентификатор подписки.
+
+    Returns:
+        JSON: Сообщение об успехе или ошибке.
+    """
+    current_user_id = get_jwt_identity()
+    user = User.query.get(current_user_id)
+    user_roles = [role.name for role in user.roles]
+    if 'admin' not in user_roles:
+        return jsonify({'error': 'Недостаточно прав'}), 403
+
+    subscription = db.session.get(WebhookSubscription, webhook_id)
+    if not subscription:
+        return jsonify({'error': 'Подписка не найдена'}), 404
+
+    db.session.delete(subscription)
+    db.session.commit()
+    invalidate_webhook_subscriptions()
+    return jsonify({'message': 'Подписка удалена'}), 200
 
 
 """
@@ -1153,6 +4658,7 @@ def cleanup_database():
     """
     try:
         cleanup_old_records()
+        cleanup_stale_uploads()
         return jsonify({'message': 'База данных очищена'}), 200
     except Exception as e:
         return jsonify({'error': f'Ошибка очистки: {e}'}), 500
@@ -1160,20 +4666,64 @@ def cleanup_database():
 
 """
 ================= ИНИЦИАЛИЗАЦИЯ ПРИЛОЖЕНИЯ =================
-Этот блок выполняется при запуске скрипта напрямую.
-Создает таблицы базы данных, базовые роли и очищает устаревшие записи.
-Запускает Flask development server.
+init_database() готовит базу: создает таблицы и недостающие столбцы,
+выполняет миграции, создает базовые роли, ключ подписи JWT и очищает устаревшие записи.
+Выполняется один раз при запуске, до создания рабочих процессов.
+start_worker() загружает кэши и запускает фоновые потоки процесса.
+Выполняется в каждом рабочем процессе: под gunicorn - хуками из
+gunicorn.conf.py, при запуске скрипта напрямую - перед Flask development server.
+
+Кэши в памяти процесса и задержка, с которой они видят изменения,
+сделанные другими процессами:
+    client_registry       - ClientRegistry.POSITIVE_TTL (10 с);
+    token_cache           - TokenCache.POSITIVE_TTL (5 с);
+    userinfo_cache        - USERINFO_CACHE_TTL (60 с);
+    report_cache          - время жизни сводок AggregationCache (60 с);
+    role_index            - ROLE_INDEX_TTL (30 с);
+    сводка групп          - GROUP_SUMMARY_TTL (30 с);
+    подписки webhook      - WEBHOOK_SUBSCRIPTIONS_TTL (10 с);
+    report_scheduler      - REPORT_SCHEDULE_SYNC_INTERVAL (60 с);
+    form_schema_cache     - без задержки: ключ кэша включает хэш описания формы.
+Расписание занятий, коды авторизации (OAUTH2_CODE_STORE='database') и
+webhook-события хранятся в БД и общие для всех процессов.
 """
-if __name__ == '__main__':
+
+
+def init_database():
+    """Создает и обновляет схему базы, выполняет миграции и очистку."""
     with app.app_context():
         db.create_all()
+        ensure_schema()
         print("🗄️ База данных инициализирована")
 
+        migrate_profile_departments()
+
         create_default_roles()
         cleanup_old_records()
+        cleanup_stale_uploads()
+        # Ключ подписи создается до запуска рабочих процессов, чтобы все они подписывали одним ключом
+        signing_keys.ensure_key()
+        # Соединения не должны переходить в рабочие процессы после fork
+        db.engine.dispose()
+
+
+def start_worker():
+    """Загружает кэши процесса и запускает планировщик отчетов и доставку webhook."""
+    with app.app_context():
+        # Пул, унаследованный от родительского процесса, не используется и не закрывается
+        db.engine.dispose(close=False)
+        load_role_index()
+        client_registry.load()
+        start_report_scheduler()
+        webhook_dispatcher.start()
+
+
+if __name__ == '__main__':
+    init_database()
+    start_worker()
 
     print("🚀 Сервер запущен на http://localhost:5000")
     print("📋 Для создания тестового админа: POST /api/test/create-admin")
     print("🧹 Для очистки базы: POST /api/test/cleanup")
 
-    app.run(debug=True, port=5000, host='0.0.0.0')
\ No newline at end of file
+    app.run(debug=True, port=5000, host='0.0.0.0')
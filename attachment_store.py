@@ -0,0 +1,167 @@
+# attachment_store.py - хранилище вложений с адресацией по содержимому
+from contextlib import contextmanager
+from threading import Lock
+from weakref import WeakValueDictionary
+import hashlib
+import os
+
+try:
+    import fcntl
+except ImportError:  # Windows: блокировка только в пределах процесса
+    fcntl = None
+
+COPY_BUFFER = 1024 * 1024
+
+
+class UploadOffsetError(Exception):
+    """Смещение части не совпадает с объемом уже принятых данных."""
+
+    def __init__(self, received):
+        super().__init__(f'Ожидается смещение {received}')
+        self.received = received
+
+
+class AttachmentStore:
+    """
+    Файловое хранилище вложений.
+
+    Незавершенные загрузки лежат в uploads/<id>.part и дописываются частями
+    прямо из входного потока запроса, поэтому файл не держится в памяти.
+    Завершенный файл переносится в objects/<sha256[:2]>/<sha256>; файл с
+    уже известным хешем не сохраняется повторно.
+
+    Запись части выполняется под исключительной блокировкой файла загрузки
+    (flock, действует между процессами), поэтому параллельные запросы с
+    одним смещением не пишут в файл одновременно: второй дождется первого
+    и получит UploadOffsetError.
+
+    Атрибуты:
+        root (str): Корневой каталог хранилища.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.uploads_dir = os.path.join(root, 'uploads')
+        self.objects_dir = os.path.join(root, 'objects')
+        self._locks = WeakValueDictionary()
+        self._locks_guard = Lock()
+
+    def _ensure_dirs(self):
+        os.makedirs(self.uploads_dir, exist_ok=True)
+        os.makedirs(self.objects_dir, exist_ok=True)
+
+    def part_path(self, upload_id):
+        return os.path.join(self.uploads_dir, f'{upload_id}.part')
+
+    def object_path(self, sha256):
+        return os.path.join(self.objects_dir, sha256[:2], sha256)
+
+    @contextmanager
+    def _locked(self, upload_id, part):
+        if fcntl is not None:
+            fcntl.flock(part.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(part.fileno(), fcntl.LOCK_UN)
+            return
+        with self._locks_guard:
+            lock = self._locks.get(upload_id)
+            if lock is None:
+                lock = self._locks[upload_id] = Lock()
+        with lock:
+            yield
+
+    def received(self, upload_id):
+        """Количество уже принятых байтов загрузки."""
+        try:
+            return os.path.getsize(self.part_path(upload_id))
+        except FileNotFoundError:
+            return 0
+
+    def write_chunk(self, upload_id, offset, stream, limit):
+        """
+        Дописывает часть загрузки из потока.
+
+        Args:
+            upload_id (str): Идентификатор загрузки.
+            offset (int): Смещение части в файле; должно совпадать с received().
+            stream: Поток с данными части (например, request.stream).
+            limit (int): Максимальное количество байтов, которое можно принять.
+
+        Returns:
+            int: Общее количество принятых байтов.
+
+        Raises:
+            UploadOffsetError: Если смещение не совпадает с принятым объемом.
+        """
+        self._ensure_dirs()
+        with open(self.part_path(upload_id), 'ab') as part, self._locked(upload_id, part):
+            received = part.seek(0, os.SEEK_END)
+            if offset != received:
+                raise UploadOffsetError(received)
+            while limit > 0:
+                block = stream.read(min(COPY_BUFFER, limit))
+                if not block:
+                    break
+                part.write(block)
+                limit -= len(block)
+            part.flush()
+            return part.tell()
+
+    def finalize(self, upload_id):
+        """
+        Завершает загрузку: считает SHA-256 и переносит файл в хранилище объектов.
+        Если объект с таким хешем уже есть, временный файл удаляется.
+
+        Returns:
+            tuple[str, int]: Хеш SHA-256 и размер файла.
+        """
+        path = self.part_path(upload_id)
+        digest = hashlib.sha256()
+        size = 0
+        with open(path, 'rb') as part:
+            for block in iter(lambda: part.read(COPY_BUFFER), b''):
+                digest.update(block)
+                size += len(block)
+
+        sha256 = digest.hexdigest()
+        target = self.object_path(sha256)
+        if os.path.exists(target):
+            os.remove(path)
+        else:
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            os.replace(path, target)
+        return sha256, size
+
+    def last_modified(self, upload_id):
+        """Время последней записи в загрузку (timestamp) или None, если данных нет."""
+        try:
+            return os.path.getmtime(self.part_path(upload_id))
+        except FileNotFoundError:
+            return None
+
+    def stale_uploads(self, before):
+        """
+        Идентификаторы незавершенных загрузок, в которые не писали с момента before.
+
+        Args:
+            before (float): Граница времени последней записи (timestamp).
+        """
+        try:
+            names = os.listdir(self.uploads_dir)
+        except FileNotFoundError:
+            return []
+        stale = []
+        for name in names:
+            upload_id, ext = os.path.splitext(name)
+            if ext == '.part' and (self.last_modified(upload_id) or before) < before:
+                stale.append(upload_id)
+        return stale
+
+    def discard(self, upload_id):
+        """Удаляет незавершенную загрузку."""
+        try:
+            os.remove(self.part_path(upload_id))
+        except FileNotFoundError:
+            pass
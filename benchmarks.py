@@ -0,0 +1,470 @@
+#!/usr/bin/env python3
+"""
+Бенчмарки подсистем портала.
+
+Запуск всех бенчмарков:   python benchmarks.py
+Запуск выбранных:         python benchmarks.py roles
+"""
+
+import random
+import sys
+import time
+
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    """Регистрирует функцию бенчмарка под указанным именем."""
+    def decorator(func):
+        BENCHMARKS[name] = func
+        return func
+    return decorator
+
+
+def measure(func, repeat):
+    """
+    Выполняет функцию repeat раз и возвращает среднее время вызова.
+
+    Returns:
+        float: Среднее время одного вызова в секундах.
+    """
+    started = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - started) / repeat
+
+
+def format_time(seconds):
+    """Форматирует длительность в наиболее подходящих единицах."""
+    if seconds < 1e-3:
+        return f"{seconds * 1e6:.2f} мкс"
+    if seconds < 1:
+        return f"{seconds * 1e3:.2f} мс"
+    return f"{seconds:.2f} с"
+
+
+@benchmark('roles')
+def bench_role_index():
+    """Подсчет и фильтрация по ролям для 100 000 пользователей."""
+    from role_index import RoleMembershipIndex
+
+    users = 100_000
+    pairs = [(random.randint(1, 5), user_id) for user_id in range(1, users + 1)]
+
+    index = RoleMembershipIndex()
+    load_time = measure(lambda: index.load(pairs), 3)
+
+    print(f"   Загрузка {users} назначений: {format_time(load_time)}")
+    print(f"   Подсчет пользователей роли: {format_time(measure(lambda: index.count(2), 100_000))}")
+    print(f"   Проверка принадлежности: {format_time(measure(lambda: index.has(2, 54_321), 100_000))}")
+    print(f"   Страница из 50 пользователей: {format_time(measure(lambda: index.members(2, 50_000, 50), 10_000))}")
+    print(f"   Добавление пользователя: {format_time(measure(lambda: index.add(3, random.randint(1, users)), 10_000))}")
+
+
+def make_large_form(size=250):
+    """Создает описание формы из size полей разных типов и подходящие данные."""
+    kinds = [
+        ({'type': 'text'}, 'Отчет'),
+        ({'type': 'number', 'min': 0}, 42),
+        ({'type': 'integer'}, 7),
+        ({'type': 'date'}, '2025-01-31'),
+        ({'type': 'select', 'options': ['да', 'нет', 'частично']}, 'да'),
+        ({'type': 'multiselect', 'options': ['a', 'b', 'c', 'd']}, ['a', 'c']),
+        ({'type': 'email'}, 'user@melsu.ru'),
+    ]
+    fields, data = [], {}
+    for i in range(size):
+        definition, value = kinds[i % len(kinds)]
+        fields.append({'name': f'field_{i}', 'label': f'Поле {i}', 'required': i % 3 == 0, **definition})
+        data[f'field_{i}'] = value
+    return fields, data
+
+
+@benchmark('forms')
+def bench_form_validation():
+    """Компиляция и проверка данных формы из 250 полей."""
+    import json
+    from form_schema import FormSchemaCache, compile_form
+
+    fields, data = make_large_form(250)
+    fields_json = json.dumps(fields)
+    cache = FormSchemaCache()
+    compiled = cache.get(1, fields_json)
+
+    print(f"   Компиляция схемы: {format_time(measure(lambda: compile_form(fields_json), 200))}")
+    print(f"   Получение схемы из кэша: {format_time(measure(lambda: cache.get(1, fields_json), 10_000))}")
+    print(f"   Проверка данных: {format_time(measure(lambda: compiled.validate(data), 2_000))}")
+
+
+@benchmark('submissions')
+def bench_submission_ingest():
+    """Пропускная способность приема ответов: построчные commit против групповой записи."""
+    import os
+    import tempfile
+    from concurrent.futures import ThreadPoolExecutor
+    from datetime import datetime
+    from sqlalchemy import create_engine
+    from sqlalchemy.dialects import sqlite
+    from app import FormSubmission
+    from submission_ingest import BatchWriter
+
+    table = FormSubmission.__table__
+    workers, per_worker = 16, 250
+    total = workers * per_worker
+
+    def make_row(worker, i):
+        now = datetime.utcnow()
+        return {'form_id': 1, 'user_id': worker * per_worker + i, 'department_id': worker,
+                'period': '2025-09', 'data': '{"value": 1}', 'created_at': now, 'updated_at': now}
+
+    def upsert():
+        stmt = sqlite.insert(table)
+        return stmt.on_conflict_do_update(index_elements=['form_id', 'period', 'user_id'],
+                                          set_={'data': stmt.excluded.data})
+
+    def run(engine, submit_one):
+        table.create(engine)
+        started = time.perf_counter()
+        with ThreadPoolExecutor(workers) as pool:
+            list(pool.map(lambda w: [submit_one(make_row(w, i)) for i in range(per_worker)], range(workers)))
+        return total / (time.perf_counter() - started)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        single = create_engine(f"sqlite:///{os.path.join(tmp, 'single.db')}",
+                               connect_args={'timeout': 30, 'check_same_thread': False})
+
+        def commit_each(row):
+            with single.begin() as connection:
+                connection.execute(upsert(), [row])
+
+        print(f"   Commit на каждый ответ: {run(single, commit_each):.0f} ответов/с")
+
+        batched = create_engine(f"sqlite:///{os.path.join(tmp, 'batched.db')}")
+
+        def write_batch(items):
+            with batched.begin() as connection:
+                connection.execute(upsert(), items)
+
+        writer = BatchWriter(write_batch)
+        print(f"   Групповая запись: {run(batched, lambda row: writer.submit(row).result()):.0f} ответов/с")
+
+
+@benchmark('reports')
+def bench_report_aggregation():
+    """Агрегация 1 000 000 ответов по всем ответам, подразделениям и поддеревьям."""
+    import json
+    import numpy as np
+    from report_aggregation import SubmissionFrame
+
+    rows, departments = 1_000_000, 60
+    rng = np.random.default_rng(1)
+    department_ids = rng.integers(1, departments + 1, rows)
+    values = rng.normal(100, 25, rows)
+    values[rng.random(rows) < 0.05] = np.nan
+    frame = SubmissionFrame(department_ids, {'value': values})
+
+    parents = {d: (None if d <= 5 else (d - 1) // 5) for d in range(1, departments + 1)}
+    descendants = {d: {d} for d in parents}
+    for d in parents:
+        parent = parents[d]
+        while parent is not None:
+            descendants[parent].add(d)
+            parent = parents[parent]
+
+    print(f"   Итоги по всем ответам: {format_time(measure(lambda: frame.summary('value'), 5))}")
+    print(f"   По подразделениям (первый расчет): {format_time(measure(lambda: frame.by_department('value'), 1))}")
+    print(f"   По подразделениям: {format_time(measure(lambda: frame.by_department('value'), 5))}")
+    print(f"   По поддеревьям: {format_time(measure(lambda: frame.by_subtree('value', descendants), 3))}")
+
+    sample = [(int(d), json.dumps({'value': float(v)})) for d, v in zip(department_ids[:100_000], values[:100_000])]
+    load = measure(lambda: SubmissionFrame.from_rows(sample, ['value'], len(sample)), 1)
+    print(f"   Загрузка 100 000 ответов из JSON: {format_time(load)}")
+
+
+@benchmark('schedule')
+def bench_schedule_index():
+    """Проверка конфликтов занятия и пакета по расписанию семестра из 50 000 занятий."""
+    from datetime import datetime, timedelta
+    from schedule_index import ScheduleIndex, resource_keys
+
+    groups, pairs, days = 100, 4, 125
+    base = datetime(2025, 9, 1, 8, 0)
+    slots = []
+    for day in range(days):
+        for group in range(groups):
+            for pair in range(pairs):
+                start = base + timedelta(days=day, hours=2 * pair)
+                slots.append((len(slots) + 1, start, start + timedelta(minutes=90),
+                              f'G{group}', group * pairs + pair + 1, f'{group}-{pair}'))
+
+    index = ScheduleIndex()
+    print(f"   Загрузка {len(slots)} занятий: {format_time(measure(lambda: index.load(slots), 3))}")
+
+    start = base + timedelta(days=60, hours=1)
+    keys = resource_keys('G7', 29, '7-1')
+    print(f"   Проверка конфликтов: {format_time(measure(lambda: index.conflicts(start, start + timedelta(minutes=90), keys), 100_000))}")
+    shift = timedelta(days=days)
+    batch = [(slot[1] + shift, slot[2] + shift, resource_keys(*slot[3:])) for slot in slots[:2000]]
+    print(f"   Проверка пакета из {len(batch)} занятий: {format_time(measure(lambda: index.batch_conflicts(batch), 100))}")
+
+
+@benchmark('tokens')
+def bench_token_validation():
+    """Проверка OAuth2 access token: запрос к БД на каждый вызов против кэша проверки."""
+    import os
+    import secrets
+    import tempfile
+    from types import SimpleNamespace
+    from sqlalchemy import bindparam, create_engine, select
+    import app  # noqa: F401 - регистрирует таблицы, на которые ссылается oauth2_token
+    from oauth_models import OAuth2Token, TokenCache, TokenRecord
+
+    table = OAuth2Token.__table__
+    tokens = [secrets.token_urlsafe(30) for _ in range(10_000)]
+    issued_at = int(time.time())
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{os.path.join(tmp, 'tokens.db')}")
+        table.create(engine)
+        with engine.begin() as connection:
+            connection.execute(table.insert(), [
+                {'client_id': 'bench', 'user_id': i, 'access_token': token, 'token_type': 'Bearer',
+                 'scope': 'read:profile', 'issued_at': issued_at, 'expires_in': 3600}
+                for i, token in enumerate(tokens)
+            ])
+
+        connection = engine.connect()
+        query = select(table).where(table.c.access_token == bindparam('access_token'))
+
+        def load(access_token):
+            row = connection.execute(query, {'access_token': access_token}).first()
+            return TokenRecord(SimpleNamespace(**row._mapping)) if row else None
+
+        cache = TokenCache()
+        for token in tokens:
+            cache.get(token, load)
+
+        calls = 20_000
+        uncached = measure(lambda: load(random.choice(tokens)), calls)
+        cached = measure(lambda: cache.get(random.choice(tokens), load), calls)
+        cache.get('unknown', load)
+        negative = measure(lambda: cache.get('unknown', load), calls)
+        connection.close()
+
+    print(f"   Запрос к БД: {1 / uncached:,.0f} проверок/с ({format_time(uncached)})")
+    print(f"   Кэш проверки: {1 / cached:,.0f} проверок/с ({format_time(cached)})")
+    print(f"   Неизвестный токен из кэша: {1 / negative:,.0f} проверок/с ({format_time(negative)})")
+
+
+@benchmark('codes')
+def bench_authorization_codes():
+    """Выдача и погашение кодов авторизации параллельными входами: таблица oauth2_code против TTL-хранилища в памяти."""
+    import os
+    import secrets
+    import tempfile
+    from concurrent.futures import ThreadPoolExecutor
+    from sqlalchemy import create_engine
+    import app  # noqa: F401 - регистрирует таблицы, на которые ссылается oauth2_code
+    from code_store import MemoryCodeStore
+    from oauth_models import OAuth2AuthorizationCode
+
+    table = OAuth2AuthorizationCode.__table__
+    workers, flows = 8, 2_000
+
+    def run_concurrently(flow):
+        start = time.perf_counter()
+        with ThreadPoolExecutor(workers) as pool:
+            list(pool.map(lambda _: flow(), range(flows)))
+        return flows / (time.perf_counter() - start)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{os.path.join(tmp, 'codes.db')}",
+                               connect_args={'timeout': 30, 'check_same_thread': False})
+        table.create(engine)
+
+        def database_flow():
+            code = secrets.token_urlsafe(36)
+            with engine.begin() as connection:
+                connection.execute(table.insert(), {'code': code, 'client_id': 'bench', 'user_id': 1,
+                                                    'scope': 'read:profile', 'auth_time': int(time.time())})
+            with engine.begin() as connection:
+                connection.execute(table.select().where(table.c.code == code)).first()
+            with engine.begin() as connection:
+                connection.execute(table.delete().where(table.c.code == code))
+
+        database = run_concurrently(database_flow)
+        engine.dispose()
+
+    store = MemoryCodeStore()
+
+    def memory_flow():
+        code = secrets.token_urlsafe(36)
+        store.put(('bench', code), {'user_id': 1, 'scope': 'read:profile'})
+        store.pop(('bench', code))
+
+    memory = run_concurrently(memory_flow)
+
+    print(f"   Таблица oauth2_code: {database:,.0f} кодов/с ({workers} потоков)")
+    print(f"   TTL-хранилище в памяти: {memory:,.0f} кодов/с ({workers} потоков)")
+
+
+def percentile(values, share):
+    """Значение перцентиля share (0..1) по отсортированному списку."""
+    return values[min(len(values) - 1, int(len(values) * share))]
+
+
+LOCAL_CLIENT_ID = 'bench'
+LOCAL_CLIENT_SECRET = 'bench-secret'
+LOCAL_REDIRECT_URI = 'http://localhost/callback'
+
+
+def _serve_portal(database_uri, queue, users):
+    """
+    Запускает портал на свободном порту с отдельной базой данных,
+    тестовым OAuth2 клиентом и users пользователями.
+    Выполняется в дочернем процессе.
+    """
+    import logging
+    import os
+    os.environ['DATABASE_URL'] = database_uri
+    sys.stdout = open(os.devnull, 'w')
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+
+    from flask_jwt_extended import create_access_token
+    from werkzeug.serving import WSGIRequestHandler, make_server
+    import app as portal
+
+    class KeepAliveHandler(WSGIRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+    with portal.app.app_context():
+        portal.db.create_all()
+        portal.create_default_roles()
+        accounts = [portal.User(email=f'bench{i}@university.local', username=f'bench{i}', is_verified=True)
+                    for i in range(users)]
+        portal.db.session.add_all(accounts)
+        portal.db.session.add(portal.OAuth2Client(
+            client_id=LOCAL_CLIENT_ID, client_secret=LOCAL_CLIENT_SECRET, client_name='bench',
+            redirect_uris=LOCAL_REDIRECT_URI, default_scopes=' '.join(portal.OAUTH_SCOPES)
+        ))
+        portal.db.session.commit()
+        access_tokens = [create_access_token(identity=str(account.id)) for account in accounts]
+
+    server = make_server('127.0.0.1', 0, portal.app, threaded=True, request_handler=KeepAliveHandler)
+    queue.put((server.server_port, access_tokens))
+    server.serve_forever()
+
+
+def start_local_portal(directory, users=1):
+    """
+    Запускает локальный экземпляр портала в дочернем процессе с базой SQLite в directory.
+    OAuth2 клиент: LOCAL_CLIENT_ID / LOCAL_CLIENT_SECRET с адресом LOCAL_REDIRECT_URI.
+
+    Returns:
+        tuple: Процесс (остановить через terminate()), порт и JWT пользователей портала.
+    """
+    import multiprocessing
+    import os
+
+    context = multiprocessing.get_context('spawn')
+    queue = context.Queue()
+    process = context.Process(target=_serve_portal, daemon=True,
+                              args=(f"sqlite:///{os.path.join(directory, 'portal.db')}", queue, users))
+    process.start()
+    port, access_tokens = queue.get(timeout=60)
+    return process, port, access_tokens
+
+
+@benchmark('token_endpoint')
+def bench_token_endpoint():
+    """Нагрузка на /oauth/token локального экземпляра портала: authorization_code и refresh_token параллельными клиентами."""
+    import http.client
+    import json
+    import tempfile
+    import threading
+    from concurrent.futures import ThreadPoolExecutor
+    from urllib.parse import parse_qs, urlencode, urlparse
+
+    workers, flows, refreshes = 8, 50, 10
+
+    with tempfile.TemporaryDirectory() as tmp:
+        server, port, (user_token,) = start_local_portal(tmp)
+        try:
+            local = threading.local()
+
+            def post(path, form, headers=None):
+                if not hasattr(local, 'connection'):
+                    local.connection = http.client.HTTPConnection('127.0.0.1', port)
+                started = time.perf_counter()
+                local.connection.request('POST', path, urlencode(form), dict(
+                    headers or {}, **{'Content-Type': 'application/x-www-form-urlencoded'}))
+                response = local.connection.getresponse()
+                body = json.loads(response.read() or b'null')
+                return response.status, body, time.perf_counter() - started
+
+            credentials = {'client_id': LOCAL_CLIENT_ID, 'client_secret': LOCAL_CLIENT_SECRET}
+            query = urlencode({'response_type': 'code', 'client_id': LOCAL_CLIENT_ID, 'scope': 'read:profile',
+                               'redirect_uri': LOCAL_REDIRECT_URI})
+
+            def authorize(_):
+                _, body, _ = post(f'/oauth/authorize?{query}', {'confirm': 'true'},
+                                  {'Authorization': f'Bearer {user_token}'})
+                return parse_qs(urlparse(body['redirect_to']).query)['code'][0]
+
+            def exchange(code):
+                return post('/oauth/token', dict(credentials, grant_type='authorization_code', code=code,
+                                                 redirect_uri=LOCAL_REDIRECT_URI))
+
+            def refresh_chain(refresh_token):
+                results = []
+                for _ in range(refreshes):
+                    result = post('/oauth/token', dict(credentials, grant_type='refresh_token',
+                                                       refresh_token=refresh_token))
+                    results.append(result)
+                    if result[0] != 200:
+                        break
+                    refresh_token = result[1]['refresh_token']
+                return results
+
+            def run(func, items):
+                started = time.perf_counter()
+                with ThreadPoolExecutor(workers) as pool:
+                    results = list(pool.map(func, items))
+                return results, time.perf_counter() - started
+
+            def report(title, results, elapsed):
+                latencies = sorted(latency for _, _, latency in results)
+                errors = sum(1 for status, _, _ in results if status != 200)
+                print(f"   {title}: {len(results) / elapsed:,.0f} токенов/с, "
+                      f"p50 {format_time(percentile(latencies, 0.5))}, "
+                      f"p99 {format_time(percentile(latencies, 0.99))}, ошибок {errors}")
+
+            codes, _ = run(authorize, range(workers * flows))
+            issued, elapsed = run(exchange, codes)
+            report('authorization_code', issued, elapsed)
+
+            chains = [body['refresh_token'] for status, body, _ in issued if status == 200][:workers * 4]
+            refreshed, elapsed = run(refresh_chain, chains)
+            report('refresh_token', [result for chain in refreshed for result in chain], elapsed)
+        finally:
+            server.terminate()
+            server.join()
+
+    print(f"   ({workers} параллельных клиентов, база SQLite)")
+
+
+def main():
+    names = sys.argv[1:] or list(BENCHMARKS)
+    unknown = [name for name in names if name not in BENCHMARKS]
+    if unknown:
+        print(f"❌ Неизвестные бенчмарки: {', '.join(unknown)}")
+        print(f"📋 Доступные: {', '.join(BENCHMARKS)}")
+        return
+
+    for name in names:
+        print(f"⏱️ {name}: {BENCHMARKS[name].__doc__}")
+        BENCHMARKS[name]()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+# code_store.py - хранилище одноразовых значений с ограниченным сроком жизни
+from collections import OrderedDict
+from threading import Lock
+import time
+
+
+class MemoryCodeStore:
+    """
+    TTL-хранилище в памяти процесса для одноразовых значений
+    (коды авторизации OAuth2).
+
+    Значение извлекается атомарной операцией pop: при параллельных
+    запросах с одним ключом значение получит только один из них.
+    Срок жизни одинаков для всех записей, поэтому порядок вставки
+    совпадает с порядком истечения и просроченные записи удаляются
+    с начала словаря без полного обхода.
+
+    Хранилище не разделяется между процессами: при нескольких
+    воркерах нужен общий бэкенд (см. DatabaseCodeStore в oauth_models.py).
+
+    Атрибуты:
+        ttl (int): Срок жизни записи в секундах.
+        max_entries (int): Максимальное количество записей; при переполнении вытесняются самые старые.
+    """
+
+    def __init__(self, ttl=300, max_entries=100_000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _purge_locked(self, now):
+        while self._entries:
+            key, (_, expires_at) = next(iter(self._entries.items()))
+            if expires_at > now and len(self._entries) <= self.max_entries:
+                break
+            del self._entries[key]
+
+    def put(self, key, value):
+        """Сохраняет значение на ttl секунд."""
+        now = time.monotonic()
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (value, now + self.ttl)
+            self._purge_locked(now)
+
+    def pop(self, key):
+        """
+        Извлекает и удаляет значение.
+
+        Returns:
+            Значение или None, если ключа нет или срок записи истек.
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        if entry is None or entry[1] <= now:
+            return None
+        return entry[0]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
@@ -0,0 +1,107 @@
+# db_engine.py - параметры движка SQLAlchemy для SQLite и PostgreSQL из переменных окружения
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+import os
+
+# Переменные окружения и значения по умолчанию
+SQLITE_DEFAULTS = {
+    'SQLITE_JOURNAL_MODE': 'WAL',
+    'SQLITE_SYNCHRONOUS': 'NORMAL',
+    'SQLITE_BUSY_TIMEOUT': '5000',        # мс ожидания блокировки вместо "database is locked"
+    'SQLITE_MMAP_SIZE': str(256 * 2**20),  # байт
+    'SQLITE_CACHE_SIZE': '-65536',        # отрицательное значение - размер в КиБ (64 МиБ)
+}
+JOURNAL_MODES = ('DELETE', 'TRUNCATE', 'PERSIST', 'MEMORY', 'WAL', 'OFF')
+SYNCHRONOUS_MODES = ('OFF', 'NORMAL', 'FULL', 'EXTRA')
+POSTGRES_DEFAULTS = {
+    'DB_POOL_SIZE': '10',
+    'DB_MAX_OVERFLOW': '20',
+    'DB_POOL_TIMEOUT': '30',
+    'DB_POOL_RECYCLE': '1800',
+    'DB_POOL_PRE_PING': 'true',
+}
+
+
+def _setting(environ, defaults, name):
+    return environ.get(name, defaults[name])
+
+
+def database_uri(environ=os.environ, default='sqlite:///university.db'):
+    """
+    Адрес базы данных из DATABASE_URL. Схема postgres:// (Heroku и др.)
+    заменяется на postgresql://, которую понимает SQLAlchemy.
+    """
+    uri = environ.get('DATABASE_URL', default)
+    if uri.startswith('postgres://'):
+        uri = 'postgresql://' + uri[len('postgres://'):]
+    return uri
+
+
+def sqlite_pragmas(environ=os.environ):
+    """
+    Returns:
+        dict: PRAGMA, выполняемые на каждом новом соединении SQLite.
+
+    Raises:
+        ValueError: Если задан неизвестный режим журнала или синхронизации.
+    """
+    pragmas = {
+        'journal_mode': _setting(environ, SQLITE_DEFAULTS, 'SQLITE_JOURNAL_MODE').upper(),
+        'synchronous': _setting(environ, SQLITE_DEFAULTS, 'SQLITE_SYNCHRONOUS').upper(),
+        'busy_timeout': int(_setting(environ, SQLITE_DEFAULTS, 'SQLITE_BUSY_TIMEOUT')),
+        'mmap_size': int(_setting(environ, SQLITE_DEFAULTS, 'SQLITE_MMAP_SIZE')),
+        'cache_size': int(_setting(environ, SQLITE_DEFAULTS, 'SQLITE_CACHE_SIZE')),
+    }
+    if pragmas['journal_mode'] not in JOURNAL_MODES:
+        raise ValueError(f"SQLITE_JOURNAL_MODE: неизвестный режим {pragmas['journal_mode']}")
+    if pragmas['synchronous'] not in SYNCHRONOUS_MODES:
+        raise ValueError(f"SQLITE_SYNCHRONOUS: неизвестный режим {pragmas['synchronous']}")
+    return pragmas
+
+
+def engine_options(uri, environ=os.environ):
+    """
+    Параметры create_engine (SQLALCHEMY_ENGINE_OPTIONS) для диалекта базы.
+
+    SQLite: ожидание блокировки задается и драйверу (timeout), чтобы
+    первое соединение не падало до выполнения PRAGMA busy_timeout.
+    PostgreSQL: размер пула, переполнение, таймаут ожидания соединения,
+    пересоздание старых соединений и проверка соединения перед выдачей.
+
+    Returns:
+        dict: Параметры движка.
+    """
+    backend = make_url(uri).get_backend_name()
+    if backend == 'sqlite':
+        busy_timeout = int(_setting(environ, SQLITE_DEFAULTS, 'SQLITE_BUSY_TIMEOUT'))
+        return {'connect_args': {'timeout': busy_timeout / 1000}}
+    if backend == 'postgresql':
+        return {
+            'pool_size': int(_setting(environ, POSTGRES_DEFAULTS, 'DB_POOL_SIZE')),
+            'max_overflow': int(_setting(environ, POSTGRES_DEFAULTS, 'DB_MAX_OVERFLOW')),
+            'pool_timeout': int(_setting(environ, POSTGRES_DEFAULTS, 'DB_POOL_TIMEOUT')),
+            'pool_recycle': int(_setting(environ, POSTGRES_DEFAULTS, 'DB_POOL_RECYCLE')),
+            'pool_pre_ping': _setting(environ, POSTGRES_DEFAULTS, 'DB_POOL_PRE_PING').lower() in ('1', 'true', 'yes'),
+        }
+    return {}
+
+
+def install_sqlite_pragmas(engine, pragmas):
+    """
+    Выполняет PRAGMA на каждом новом соединении движка SQLite.
+
+    journal_mode=WAL сохраняется в файле базы, остальные параметры
+    действуют только в пределах соединения, поэтому задаются в событии
+    connect. Для базы в памяти WAL недоступен, SQLite оставляет режим memory.
+    """
+    if engine.dialect.name != 'sqlite':
+        return
+
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in pragmas.items():
+                cursor.execute(f'PRAGMA {name}={value}')
+        finally:
+            cursor.close()
@@ -0,0 +1,187 @@
+# export_stream.py - потоковая выгрузка таблиц в CSV и XLSX
+from datetime import date, datetime
+from xml.sax.saxutils import escape
+import csv
+import io
+import math
+import re
+import zipfile
+
+CHUNK_ROWS = 1000
+
+CSV_MIMETYPE = 'text/csv; charset=utf-8'
+XLSX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+_INVALID_XML_CHARS = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+# Начальные символы, с которых табличные редакторы начинают формулу
+_FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+
+def _cell_text(value):
+    if value is None:
+        return ''
+    if isinstance(value, (list, tuple)):
+        return '; '.join(str(item) for item in value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return str(value)
+
+
+def _csv_cell(value):
+    # Числа пишутся как есть; текст, похожий на формулу, экранируется апострофом
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return _cell_text(value)
+    text = _cell_text(value)
+    return "'" + text if text.startswith(_FORMULA_PREFIXES) else text
+
+
+def csv_stream(header, rows, chunk_rows=CHUNK_ROWS):
+    """
+    Генератор CSV-файла по частям.
+    Файл начинается с BOM, чтобы Excel корректно открыл кириллицу.
+    Текстовые ячейки, начинающиеся с =, +, -, @, табуляции или перевода
+    строки, предваряются апострофом, чтобы редактор не выполнил их как формулу.
+
+    Args:
+        header (list[str]): Заголовки столбцов.
+        rows (iterable[list]): Строки таблицы.
+        chunk_rows (int): Количество строк в одной отдаваемой части.
+
+    Yields:
+        bytes: Очередная часть файла.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    buffer.write('\ufeff')
+    writer.writerow([_csv_cell(value) for value in header])
+
+    pending = 0
+    for row in rows:
+        writer.writerow([_csv_cell(value) for value in row])
+        pending += 1
+        if pending >= chunk_rows:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+            pending = 0
+
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+
+class _ChunkSink:
+    """Несдвигаемый приемник байтов для zipfile; накопленное забирается через take()."""
+
+    def __init__(self):
+        self._parts = []
+
+    def write(self, data):
+        self._parts.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b''.join(self._parts)
+        self._parts.clear()
+        return data
+
+
+_CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/xl/workbook.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+    '<Override PartName="/xl/worksheets/sheet1.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+    '</Types>'
+)
+
+_ROOT_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+    'Target="xl/workbook.xml"/>'
+    '</Relationships>'
+)
+
+_WORKBOOK = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+    'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+    '<sheets><sheet name="{name}" sheetId="1" r:id="rId1"/></sheets>'
+    '</workbook>'
+)
+
+_WORKBOOK_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+    'Target="worksheets/sheet1.xml"/>'
+    '</Relationships>'
+)
+
+
+def _xlsx_row(values):
+    cells = []
+    for value in values:
+        if value is None:
+            cells.append('<c/>')
+            continue
+        if isinstance(value, bool):
+            text = _cell_text(value)
+        elif isinstance(value, int) or (isinstance(value, float) and math.isfinite(value)):
+            cells.append(f'<c><v>{value!r}</v></c>')
+            continue
+        else:
+            text = _cell_text(value)
+        text = escape(_INVALID_XML_CHARS.sub('', text))
+        cells.append(f'<c t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>')
+    return '<row>' + ''.join(cells) + '</row>'
+
+
+def xlsx_stream(header, rows, sheet_name='Лист1', chunk_rows=CHUNK_ROWS):
+    """
+    Генератор XLSX-файла по частям с постоянным расходом памяти.
+    Лист пишется напрямую в ZIP-поток (строки inlineStr, без таблицы
+    общих строк), готовые сжатые данные отдаются каждые chunk_rows строк.
+
+    Args:
+        header (list[str]): Заголовки столбцов.
+        rows (iterable[list]): Строки таблицы.
+        sheet_name (str): Название листа.
+        chunk_rows (int): Количество строк между отдачами данных.
+
+    Yields:
+        bytes: Очередная часть файла.
+    """
+    sink = _ChunkSink()
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr('[Content_Types].xml', _CONTENT_TYPES)
+        archive.writestr('_rels/.rels', _ROOT_RELS)
+        archive.writestr('xl/workbook.xml', _WORKBOOK.format(name=escape(sheet_name[:31], {'"': '&quot;'})))
+        archive.writestr('xl/_rels/workbook.xml.rels', _WORKBOOK_RELS)
+
+        with archive.open('xl/worksheets/sheet1.xml', 'w', force_zip64=True) as sheet:
+            sheet.write((
+                '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+                '<sheetData>' + _xlsx_row(header)
+            ).encode('utf-8'))
+
+            pending = []
+            for row in rows:
+                pending.append(_xlsx_row(row))
+                if len(pending) >= chunk_rows:
+                    sheet.write(''.join(pending).encode('utf-8'))
+                    pending.clear()
+                    yield sink.take()
+
+            sheet.write((''.join(pending) + '</sheetData></worksheet>').encode('utf-8'))
+        yield sink.take()
+    yield sink.take()
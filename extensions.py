@@ -0,0 +1,4 @@
+# extensions.py - расширения Flask, общие для app.py и oauth_models.py
+from flask_sqlalchemy import SQLAlchemy
+
+db = SQLAlchemy()
@@ -0,0 +1,364 @@
+# form_schema.py - компиляция описаний полей форм и проверка данных
+from collections import OrderedDict
+from datetime import date
+from threading import Lock
+import hashlib
+import json
+import math
+import re
+
+
+class FormDefinitionError(ValueError):
+    """Описание полей формы некорректно и не может быть скомпилировано."""
+
+
+class FormValidationError(ValueError):
+    """
+    Данные формы не прошли проверку.
+
+    Атрибуты:
+        errors (dict): Сообщения об ошибках по ключам полей.
+    """
+
+    def __init__(self, errors):
+        super().__init__('Данные формы содержат ошибки')
+        self.errors = errors
+
+
+EMAIL_RE = re.compile(r'^[^\s@]+@[^\s@]+\.[^\s@]+$')
+PHONE_RE = re.compile(r'^\+?[\d\s()\-]{5,20}$')
+
+
+def _check_text(value, field):
+    if not isinstance(value, str):
+        return None, 'Ожидается строка'
+    if field.max_length is not None and len(value) > field.max_length:
+        return None, f'Не более {field.max_length} символов'
+    return value, None
+
+
+def _is_finite(value):
+    # Целое за пределами float (например, 10**400 из JSON) не считается числом
+    try:
+        return math.isfinite(float(value))
+    except (OverflowError, ValueError):
+        return False
+
+
+def _check_number(value, field):
+    if isinstance(value, bool):
+        return None, 'Ожидается число'
+    if isinstance(value, str):
+        try:
+            value = float(value.replace(',', '.'))
+        except ValueError:
+            return None, 'Ожидается число'
+    if not isinstance(value, (int, float)) or not _is_finite(value):
+        return None, 'Ожидается число'
+    if field.min_value is not None and value < field.min_value:
+        return None, f'Не меньше {field.min_value}'
+    if field.max_value is not None and value > field.max_value:
+        return None, f'Не больше {field.max_value}'
+    return value, None
+
+
+def _check_integer(value, field):
+    value, error = _check_number(value, field)
+    if error:
+        return None, error
+    if value != int(value):
+        return None, 'Ожидается целое число'
+    return int(value), None
+
+
+def _check_date(value, field):
+    if not isinstance(value, str):
+        return None, 'Ожидается дата в формате ГГГГ-ММ-ДД'
+    try:
+        date.fromisoformat(value)
+    except ValueError:
+        return None, 'Ожидается дата в формате ГГГГ-ММ-ДД'
+    return value, None
+
+
+def _check_email(value, field):
+    if not isinstance(value, str) or not EMAIL_RE.match(value):
+        return None, 'Неверный формат email'
+    return value, None
+
+
+def _check_phone(value, field):
+    if not isinstance(value, str) or not PHONE_RE.match(value):
+        return None, 'Неверный формат телефона'
+    return value, None
+
+
+def _check_boolean(value, field):
+    if not isinstance(value, bool):
+        return None, 'Ожидается логическое значение'
+    return value, None
+
+
+def _check_choice(value, field):
+    try:
+        if value not in field.options:
+            return None, 'Недопустимое значение'
+    except TypeError:
+        return None, 'Недопустимое значение'
+    return value, None
+
+
+def _check_multichoice(value, field):
+    if not isinstance(value, list):
+        return None, 'Ожидается список значений'
+    try:
+        if not field.options.issuperset(value):
+            return None, 'Недопустимое значение'
+    except TypeError:
+        return None, 'Недопустимое значение'
+    return value, None
+
+
+def _check_file(value, field):
+    if not isinstance(value, str) or not value:
+        return None, 'Ожидается идентификатор файла'
+    return value, None
+
+
+def _check_any(value, field):
+    return value, None
+
+
+FIELD_CHECKERS = {
+    'text': _check_text,
+    'string': _check_text,
+    'textarea': _check_text,
+    'number': _check_number,
+    'float': _check_number,
+    'integer': _check_integer,
+    'date': _check_date,
+    'email': _check_email,
+    'phone': _check_phone,
+    'tel': _check_phone,
+    'boolean': _check_boolean,
+    'checkbox': _check_boolean,
+    'select': _check_choice,
+    'radio': _check_choice,
+    'multiselect': _check_multichoice,
+    'checkboxes': _check_multichoice,
+    'file': _check_file,
+}
+
+CHOICE_TYPES = {'select', 'radio', 'multiselect', 'checkboxes'}
+NUMERIC_TYPES = {'number', 'float', 'integer'}
+
+
+class CompiledField:
+    """
+    Скомпилированное поле формы.
+
+    Атрибуты:
+        key (str): Ключ поля в данных формы.
+        label (str): Отображаемое название поля.
+        type (str): Тип поля.
+        required (bool): Обязательно ли поле для заполнения.
+        options (frozenset, optional): Допустимые значения для полей выбора.
+        check (callable): Функция проверки значения.
+    """
+    __slots__ = ('key', 'label', 'type', 'required', 'options', 'max_length',
+                 'min_value', 'max_value', 'check')
+
+    def __init__(self, definition, position):
+        if not isinstance(definition, dict):
+            raise FormDefinitionError(f'Поле №{position + 1} должно быть объектом')
+
+        key = definition.get('name') or definition.get('id') or definition.get('label')
+        if key is None or key == '':
+            raise FormDefinitionError(f'У поля №{position + 1} нет имени')
+
+        self.key = str(key)
+        self.label = definition.get('label') or self.key
+        self.type = str(definition.get('type') or 'text').lower()
+        self.required = bool(definition.get('required'))
+        self.max_length = definition.get('max_length')
+        self.min_value = definition.get('min')
+        self.max_value = definition.get('max')
+        if self.max_length is not None and (isinstance(self.max_length, bool) or not isinstance(self.max_length, int)
+                                            or self.max_length < 0):
+            raise FormDefinitionError(f"У поля '{self.label}' max_length должно быть неотрицательным целым числом")
+        for name, bound in (('min', self.min_value), ('max', self.max_value)):
+            if bound is not None and (isinstance(bound, bool) or not isinstance(bound, (int, float))
+                                      or not _is_finite(bound)):
+                raise FormDefinitionError(f"У поля '{self.label}' {name} должно быть числом")
+        self.check = FIELD_CHECKERS.get(self.type, _check_any)
+
+        self.options = None
+        if self.type in CHOICE_TYPES:
+            options = definition.get('options')
+            if not options:
+                raise FormDefinitionError(f"У поля '{self.label}' не заданы варианты выбора")
+            try:
+                self.options = frozenset(
+                    option.get('value', option.get('label')) if isinstance(option, dict) else option
+                    for option in options
+                )
+            except TypeError:
+                raise FormDefinitionError(
+                    f"У поля '{self.label}' варианты выбора должны быть скалярными значениями"
+                ) from None
+
+    @property
+    def is_numeric(self):
+        """Является ли поле числовым (используется при агрегации отчетов)."""
+        return self.type in NUMERIC_TYPES
+
+
+class CompiledForm:
+    """
+    Скомпилированное описание формы: упорядоченный набор проверяемых полей.
+
+    Атрибуты:
+        fields (tuple[CompiledField]): Поля формы в порядке описания.
+        content_hash (str): Хэш исходного описания полей.
+    """
+    __slots__ = ('fields', 'content_hash', '_required', '_by_key')
+
+    def __init__(self, definitions, content_hash=None):
+        if not isinstance(definitions, list):
+            raise FormDefinitionError('Описание полей должно быть списком')
+
+        self.fields = tuple(CompiledField(d, i) for i, d in enumerate(definitions))
+        self.content_hash = content_hash
+        self._by_key = {field.key: field for field in self.fields}
+        if len(self._by_key) != len(self.fields):
+            raise FormDefinitionError('Имена полей формы должны быть уникальными')
+        self._required = tuple(field for field in self.fields if field.required)
+
+    def field(self, key):
+        """Возвращает поле по ключу или None."""
+        return self._by_key.get(key)
+
+    def validate(self, data):
+        """
+        Проверяет данные формы.
+
+        Args:
+            data (dict): Значения полей по ключам.
+
+        Returns:
+            dict: Проверенные и приведенные значения (только известные поля).
+
+        Raises:
+            FormValidationError: Если данные содержат ошибки.
+        """
+        if not isinstance(data, dict):
+            raise FormValidationError({'': 'Ожидается объект с данными формы'})
+
+        errors = {}
+        cleaned = {}
+        by_key = self._by_key
+
+        for key, value in data.items():
+            field = by_key.get(key)
+            if field is None:
+                errors[key] = 'Неизвестное поле'
+                continue
+            if value is None or value == '' or value == []:
+                continue
+            value, error = field.check(value, field)
+            if error:
+                errors[key] = error
+            else:
+                cleaned[key] = value
+
+        for field in self._required:
+            if field.key not in cleaned and field.key not in errors:
+                errors[field.key] = 'Обязательное поле'
+
+        if errors:
+            raise FormValidationError(errors)
+        return cleaned
+
+
+def fields_hash(fields_json):
+    """Вычисляет хэш текстового описания полей формы."""
+    return hashlib.blake2b((fields_json or '').encode('utf-8'), digest_size=16).hexdigest()
+
+
+def compile_form(fields_json, content_hash=None):
+    """
+    Компилирует JSON-описание полей формы.
+
+    Raises:
+        FormDefinitionError: Если описание некорректно.
+    """
+    try:
+        definitions = json.loads(fields_json) if fields_json else []
+    except ValueError:
+        raise FormDefinitionError('Описание полей не является корректным JSON')
+    return CompiledForm(definitions, content_hash or fields_hash(fields_json))
+
+
+class FormSchemaCache:
+    """
+    LRU-кэш скомпилированных форм с ключом (id формы, хэш описания полей).
+    Изменение описания меняет хэш, поэтому устаревшая схема не используется
+    даже без явной инвалидации; invalidate() освобождает память сразу.
+    """
+
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._latest = {}
+        self._lock = Lock()
+
+    def get(self, form_id, fields_json):
+        """
+        Возвращает скомпилированную форму, компилируя ее при отсутствии в кэше.
+        Если описание совпадает с последним скомпилированным для этой формы,
+        хэш не пересчитывается.
+
+        Raises:
+            FormDefinitionError: Если описание некорректно.
+        """
+        with self._lock:
+            key = self._latest.get(form_id)
+            entry = self._entries.get(key) if key else None
+            if entry is not None and entry[0] == fields_json:
+                self._entries.move_to_end(key)
+                return entry[1]
+
+        key = (form_id, fields_hash(fields_json))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self._latest[form_id] = key
+                return entry[1]
+
+        compiled = compile_form(fields_json, key[1])
+        with self._lock:
+            self._drop(form_id)
+            self._entries[key] = (fields_json, compiled)
+            self._latest[form_id] = key
+            while len(self._entries) > self.maxsize:
+                (evicted_id, _), _ = self._entries.popitem(last=False)
+                if self._latest.get(evicted_id) not in self._entries:
+                    self._latest.pop(evicted_id, None)
+        return compiled
+
+    def _drop(self, form_id):
+        for key in [k for k in self._entries if k[0] == form_id]:
+            del self._entries[key]
+        self._latest.pop(form_id, None)
+
+    def invalidate(self, form_id):
+        """Удаляет из кэша все схемы формы."""
+        with self._lock:
+            self._drop(form_id)
+
+    def clear(self):
+        """Очищает кэш."""
+        with self._lock:
+            self._entries.clear()
+            self._latest.clear()
@@ -0,0 +1,17 @@
+# gunicorn.conf.py - запуск под gunicorn: gunicorn -c gunicorn.conf.py app:app
+import os
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:5000')
+workers = int(os.environ.get('GUNICORN_WORKERS', '4'))
+
+
+def on_starting(server):
+    """Подготовка базы один раз в главном процессе, до запуска рабочих."""
+    from app import init_database
+    init_database()
+
+
+def post_worker_init(worker):
+    """Кэши и фоновые потоки - в каждом рабочем процессе."""
+    from app import start_worker
+    start_worker()
@@ -0,0 +1,199 @@
+# oauth_keys.py - ключи подписи JWT access token и их ротация
+from contextlib import contextmanager
+from threading import Lock
+import base64
+import json
+import os
+import time
+
+from joserfc import jwt
+from joserfc.jwk import KeySet, RSAKey
+
+try:
+    import fcntl
+except ImportError:  # Windows: блокировка только в пределах процесса
+    fcntl = None
+
+SIGNING_ALG = 'RS256'
+
+
+def is_jwt(token):
+    """Проверяет, похожа ли строка токена на JWT (три части через точку)."""
+    return token.count('.') == 2
+
+
+def _decode_segment(segment):
+    return json.loads(base64.urlsafe_b64decode(segment + '=' * (-len(segment) % 4)))
+
+
+def jwt_header_unverified(token):
+    """Возвращает заголовок JWT без проверки подписи (алгоритм, kid)."""
+    return _decode_segment(token.split('.')[0])
+
+
+def jwt_claims_unverified(token):
+    """Возвращает claims JWT без проверки подписи (для служебных полей вроде jti)."""
+    return _decode_segment(token.split('.')[1])
+
+
+class SigningKeys:
+    """
+    Набор RSA-ключей для подписи JWT access token.
+
+    Ключи хранятся в JSON-файле (приватные JWK). Первый ключ набора -
+    текущий, им подписываются новые токены; предыдущие ключи остаются
+    в опубликованном JWKS, пока не истечет срок выданных ими токенов.
+    Файл перечитывается при изменении, поэтому ротация, выполненная
+    одним процессом, видна остальным. Создание и ротация ключа выполняются
+    под блокировкой файла <path>.lock с повторным чтением набора внутри
+    нее: параллельно запущенные процессы не затирают ключи друг друга.
+
+    Атрибуты:
+        path (str): Путь к файлу с ключами.
+        max_age (int): Возраст текущего ключа в секундах, после которого выполняется ротация.
+        retention (int): Сколько секунд хранить выведенный из использования ключ.
+    """
+    RELOAD_INTERVAL = 5
+
+    def __init__(self, path=None, max_age=30 * 86400, retention=86400):
+        self.path = path
+        self.max_age = max_age
+        self.retention = retention
+        self._state = None
+        self._version = None
+        self._checked_at = 0
+        self._lock = Lock()
+
+    def configure(self, path, max_age=None, retention=None):
+        self.path = path
+        if max_age is not None:
+            self.max_age = max_age
+        if retention is not None:
+            self.retention = retention
+        self._state = None
+
+    def _read(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        # Файл заменяется через os.replace, поэтому новая запись меняет inode
+        version = (stat.st_ino, stat.st_mtime_ns)
+        if self._state is not None and version == self._version:
+            return self._state
+        with open(self.path, encoding='utf-8') as f:
+            state = json.load(f)
+        state['signing'] = RSAKey.import_key(state['keys'][0])
+        state['public'] = KeySet.import_key_set(self._public_set(state['keys']))
+        self._version = version
+        return state
+
+    def _write(self, state):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        temp = f'{self.path}.tmp'
+        fd = os.open(temp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump({'keys': state['keys'], 'created': state['created'], 'retired': state['retired']}, f)
+        os.replace(temp, self.path)
+
+    @contextmanager
+    def _locked(self):
+        with self._lock:
+            if fcntl is None:
+                yield
+                return
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            fd = os.open(f'{self.path}.lock', os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                yield
+            finally:
+                os.close(fd)
+
+    def _needs_rotation(self, state, now):
+        return state is None or now - state['created'][state['keys'][0]['kid']] > self.max_age
+
+    def _current_state(self):
+        now = time.time()
+        if self._state is None or now - self._checked_at > self.RELOAD_INTERVAL:
+            with self._lock:
+                self._state = self._read()
+                self._checked_at = now
+            if self._needs_rotation(self._state, now):
+                with self._locked():
+                    # Другой процесс мог создать ключ, пока ожидалась блокировка
+                    self._state = self._read()
+                    if self._needs_rotation(self._state, now):
+                        self._rotate_locked(now)
+        return self._state
+
+    def ensure_key(self):
+        """Создает файл с ключом, если его еще нет (при запуске, до рабочих процессов)."""
+        self._current_state()
+
+    def _rotate_locked(self, now):
+        state = self._read() or {'keys': [], 'created': {}, 'retired': {}}
+        key = RSAKey.generate_key(2048, parameters={'use': 'sig', 'alg': SIGNING_ALG})
+        private = key.as_dict(private=True)
+        private['kid'] = key.thumbprint()
+
+        if state['keys']:
+            state['retired'].setdefault(state['keys'][0]['kid'], now)
+        keys = [private] + [
+            item for item in state['keys']
+            if now - state['retired'].get(item['kid'], now) < self.retention
+        ]
+        kids = {item['kid'] for item in keys}
+        state = {
+            'keys': keys,
+            'created': {kid: ts for kid, ts in state['created'].items() if kid in kids},
+            'retired': {kid: ts for kid, ts in state['retired'].items() if kid in kids}
+        }
+        state['created'][private['kid']] = now
+        self._write(state)
+        self._state = self._read()
+        self._checked_at = now
+        return private['kid']
+
+    def rotate(self):
+        """
+        Выпускает новый текущий ключ; прежний остается для проверки токенов.
+
+        Returns:
+            str: Идентификатор (kid) нового ключа.
+        """
+        with self._locked():
+            return self._rotate_locked(time.time())
+
+    @staticmethod
+    def _public_set(keys):
+        return {'keys': [
+            {name: value for name, value in key.items() if name in ('kty', 'kid', 'use', 'alg', 'n', 'e')}
+            for key in keys
+        ]}
+
+    def sign(self, claims, header=None):
+        """
+        Подписывает claims текущим ключом; kid ключа записывается в заголовок.
+
+        Returns:
+            str: JWT в компактной сериализации.
+        """
+        state = self._current_state()
+        header = dict(header or {}, alg=SIGNING_ALG, kid=state['keys'][0]['kid'])
+        return jwt.encode(header, claims, state['signing'])
+
+    def public_jwks(self):
+        """Публичная часть всех действующих ключей для JWKS endpoint."""
+        return self._public_set(self._current_state()['keys'])
+
+    def decode(self, token):
+        """
+        Проверяет подпись JWT ключами набора и срок действия, возвращает claims.
+
+        Raises:
+            joserfc.errors.JoseError: Если подпись, формат или срок действия токена неверны.
+        """
+        claims = jwt.decode(token, self._current_state()['public'], algorithms=[SIGNING_ALG]).claims
+        jwt.JWTClaimsRegistry(exp={'essential': True}).validate(claims)
+        return claims
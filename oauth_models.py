@@ -1,16 +1,37 @@
 # oauth_models.py - OAuth2 модели и сервер
 from authlib.integrations.flask_oauth2 import AuthorizationServer, ResourceProtector
 from authlib.oauth2.rfc6749 import grants
+from authlib.oauth2.rfc6749.errors import InvalidGrantError, InvalidScopeError
 from authlib.oauth2.rfc6749.models import ClientMixin, AuthorizationCodeMixin, TokenMixin
-from authlib.common.security import generate_token
-from werkzeug.security import gen_salt
-from flask import current_app
+from authlib.oauth2.rfc6750 import BearerTokenValidator
+from authlib.oauth2.rfc9068 import JWTBearerTokenGenerator
 from datetime import datetime
-import json
+from threading import Lock
+import copy
+import hashlib
+import hmac
+import os
+import time
+import uuid
+
+from code_store import MemoryCodeStore
+from extensions import db
+from oauth_keys import SigningKeys, is_jwt, jwt_claims_unverified
+
+# Способы аутентификации клиента на token endpoint
+CLIENT_AUTH_METHODS = ('client_secret_basic', 'client_secret_post')
+# Гранты, разрешенные клиентам
+CLIENT_GRANT_TYPES = frozenset({'authorization_code', 'refresh_token'})
+# Минимальный остаток срока действия служебного токена, при котором он выдается повторно
+SERVICE_TOKEN_REUSE_MARGIN = 60
+# Срок жизни кода авторизации в секундах
+AUTHORIZATION_CODE_TTL = 300
+# Сколько секунд помнить замененные refresh token для обнаружения повторного использования
+REFRESH_REUSE_RETENTION = 86400
+# Срок действия refresh token от момента выдачи (OAUTH2_REFRESH_TOKEN_EXPIRES_IN)
+REFRESH_TOKEN_EXPIRES_IN = 30 * 86400
 
 
-# Эти модели добавляем к основным в app.py
-
 class OAuth2Client(db.Model, ClientMixin):
     """OAuth2 клиенты (другие приложения университета)"""
     __tablename__ = 'oauth2_client'
@@ -24,6 +45,7 @@ class OAuth2Client(db.Model, ClientMixin):
     # OAuth2 параметры
     redirect_uris = db.Column(db.Text)  # разделенные пробелами
     default_scopes = db.Column(db.Text)  # разделенные пробелами
+    service_scopes = db.Column(db.Text)  # разделенные пробелами, для client_credentials
 
     # Мета-данные
     created_by = db.Column(db.Integer, db.ForeignKey('user.id'))
@@ -52,14 +74,16 @@ class OAuth2Client(db.Model, ClientMixin):
     def check_client_secret(self, client_secret):
         return self.client_secret == client_secret
 
-    def check_token_endpoint_auth_method(self, method):
-        return method in ['client_secret_post', 'client_secret_basic']
+    def check_endpoint_auth_method(self, method, endpoint):
+        return method in CLIENT_AUTH_METHODS
 
     def check_response_type(self, response_type):
         return response_type == 'code'
 
     def check_grant_type(self, grant_type):
-        return grant_type in ['authorization_code', 'refresh_token']
+        if grant_type == 'client_credentials':
+            return bool(self.service_scopes)
+        return grant_type in CLIENT_GRANT_TYPES
 
 
 class OAuth2AuthorizationCode(db.Model, AuthorizationCodeMixin):
@@ -82,7 +106,7 @@ class OAuth2AuthorizationCode(db.Model, AuthorizationCodeMixin):
     client = db.relationship('OAuth2Client')
 
     def is_expired(self):
-        return self.auth_time + 300 < datetime.utcnow().timestamp()  # 5 минут
+        return self.auth_time + AUTHORIZATION_CODE_TTL < datetime.utcnow().timestamp()  # 5 минут
 
     def get_redirect_uri(self):
         return self.redirect_uri
@@ -111,76 +135,558 @@ class OAuth2Token(db.Model, TokenMixin):
     scope = db.Column(db.Text)
     issued_at = db.Column(db.Integer, nullable=False, default=lambda: int(datetime.utcnow().timestamp()))
     expires_in = db.Column(db.Integer, nullable=False, default=3600)  # 1 час
+    # Цепочка токенов, полученных обновлением из одного кода авторизации
+    family = db.Column(db.String(32), index=True)
 
     user = db.relationship('User')
     client = db.relationship('OAuth2Client')
 
+    __table_args__ = (
+        db.Index('ix_oauth2_token_client_user', 'client_id', 'user_id'),
+    )
+
+    def check_client(self, client):
+        return self.client_id == client.get_client_id()
+
     def get_scope(self):
         return self.scope
 
     def get_expires_in(self):
         return self.expires_in
 
+    def get_user(self):
+        return self.user
+
     def is_expired(self):
         return self.issued_at + self.expires_in < datetime.utcnow().timestamp()
 
+    def is_refresh_token_expired(self):
+        return refresh_token_expires_at(self.issued_at) < datetime.utcnow().timestamp()
+
+    def is_revoked(self):
+        # Отозванные токены удаляются из таблицы
+        return False
+
+
+class OAuth2Consent(db.Model):
+    """Запомненные согласия пользователей на доступ приложений"""
+    __tablename__ = 'oauth2_consent'
+
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), primary_key=True)
+    client_id = db.Column(db.String(40), db.ForeignKey('oauth2_client.client_id', ondelete='CASCADE'),
+                          primary_key=True)
+    scope = db.Column(db.Text, nullable=False, default='')  # разделенные пробелами
+    granted_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def covers(self, scope):
+        """Проверяет, входят ли запрошенные области доступа в согласие."""
+        return set((scope or '').split()) <= set(self.scope.split())
+
+
+class WebhookSubscription(db.Model):
+    """Подписки OAuth2 клиентов на webhook-события об изменениях пользователей и подразделений"""
+    __tablename__ = 'webhook_subscription'
+
+    id = db.Column(db.Integer, primary_key=True)
+    client_id = db.Column(db.String(40), db.ForeignKey('oauth2_client.client_id', ondelete='CASCADE'),
+                          nullable=False, index=True)
+    url = db.Column(db.Text, nullable=False)
+    secret = db.Column(db.String(64), nullable=False)  # ключ подписи запросов
+    events = db.Column(db.Text)  # типы событий через пробел, пусто - все события
+    is_active = db.Column(db.Boolean, nullable=False, default=True)
+    created_by = db.Column(db.Integer, db.ForeignKey('user.id'))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class WebhookOutbox(db.Model):
+    """Webhook-события, записанные в транзакции изменения и ожидающие передачи диспетчеру"""
+    __tablename__ = 'webhook_outbox'
+
+    id = db.Column(db.Integer, primary_key=True)
+    payload = db.Column(db.Text, nullable=False)  # событие в JSON
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class OAuth2RetiredRefreshToken(db.Model):
+    """Замененные refresh token (хранится SHA-256) для обнаружения повторного использования"""
+    __tablename__ = 'oauth2_retired_refresh_token'
+
+    token_hash = db.Column(db.String(64), primary_key=True)
+    family = db.Column(db.String(32), nullable=False)
+    client_id = db.Column(db.String(40), nullable=False)
+    retired_at = db.Column(db.Integer, nullable=False, index=True)
+
+
+def refresh_token_hash(refresh_token):
+    return hashlib.sha256(refresh_token.encode()).hexdigest()
+
+
+class ClientRecord(ClientMixin):
+    """
+    Неизменяемая копия OAuth2Client для проверок authlib.
+    Области доступа и адреса перенаправления разобраны один раз при
+    загрузке в frozenset, поэтому проверки не разбирают строки заново.
+    """
+    __slots__ = ('id', 'client_id', 'client_secret', 'client_name',
+                 'redirect_uris', 'redirect_uri_set', 'scopes', 'service_scopes', 'grant_types')
+
+    def __init__(self, client):
+        self.id = client.id
+        self.client_id = client.client_id
+        self.client_secret = client.client_secret
+        self.client_name = client.client_name
+        self.redirect_uris = tuple((client.redirect_uris or '').split())
+        self.redirect_uri_set = frozenset(self.redirect_uris)
+        self.scopes = frozenset((client.default_scopes or '').split())
+        self.service_scopes = frozenset((client.service_scopes or '').split())
+        self.grant_types = CLIENT_GRANT_TYPES | {'client_credentials'} if self.service_scopes else CLIENT_GRANT_TYPES
+
+    def as_service(self):
+        """Копия клиента, которой разрешены служебные области доступа (для client_credentials)."""
+        service = copy.copy(self)
+        service.scopes = self.service_scopes
+        return service
+
+    def get_client_id(self):
+        return self.client_id
+
+    def get_default_redirect_uri(self):
+        return self.redirect_uris[0] if self.redirect_uris else None
+
+    def get_allowed_scope(self, scope):
+        if not scope:
+            return ''
+        allowed = self.scopes
+        return ' '.join(dict.fromkeys(s for s in scope.split() if s in allowed))
+
+    def check_redirect_uri(self, redirect_uri):
+        return redirect_uri in self.redirect_uri_set
+
+    def has_client_secret(self):
+        return bool(self.client_secret)
+
+    def check_client_secret(self, client_secret):
+        return hmac.compare_digest(self.client_secret.encode(), client_secret.encode())
+
+    def check_endpoint_auth_method(self, method, endpoint):
+        return method in CLIENT_AUTH_METHODS
+
+    def check_response_type(self, response_type):
+        return response_type == 'code'
+
+    def check_grant_type(self, grant_type):
+        return grant_type in self.grant_types
+
+
+class ClientRegistry:
+    """
+    Реестр OAuth2 клиентов в памяти.
+
+    Клиент загружается из БД при первом обращении и далее отдается из
+    памяти POSITIVE_TTL секунд; неизвестные client_id запоминаются на
+    NEGATIVE_TTL секунд. После создания, изменения или удаления клиента
+    запись сразу сбрасывается через invalidate() в текущем процессе,
+    остальные процессы перечитывают клиента по истечении POSITIVE_TTL:
+    удаленный клиент или замененный секрет перестают действовать везде
+    не позже чем через это время.
+    """
+    POSITIVE_TTL = 10
+    NEGATIVE_TTL = 10
+
+    def __init__(self):
+        self._records = {}
+        self._missing = {}
+        self._version = 0
+        self._lock = Lock()
+
+    def load(self):
+        """Загружает всех клиентов одним запросом."""
+        with self._lock:
+            version = self._version
+        expires = time.monotonic() + self.POSITIVE_TTL
+        records = {client.client_id: (ClientRecord(client), expires) for client in OAuth2Client.query.all()}
+        with self._lock:
+            if version == self._version:
+                self._records = records
+                self._missing = {}
+        return len(records)
+
+    def get(self, client_id):
+        """Возвращает ClientRecord или None, если клиент не зарегистрирован."""
+        if not client_id:
+            return None
+        now = time.monotonic()
+        entry = self._records.get(client_id)
+        if entry is not None and entry[1] > now:
+            return entry[0]
+        expires = self._missing.get(client_id)
+        if expires is not None and expires > now:
+            return None
+
+        with self._lock:
+            version = self._version
+        client = OAuth2Client.query.filter_by(client_id=client_id).first()
+        record = ClientRecord(client) if client else None
+        with self._lock:
+            if version == self._version:
+                if record is None:
+                    self._records.pop(client_id, None)
+                    self._missing[client_id] = now + self.NEGATIVE_TTL
+                else:
+                    self._records[client_id] = (record, now + self.POSITIVE_TTL)
+                    self._missing.pop(client_id, None)
+        return record
+
+    def invalidate(self, client_id=None):
+        """Сбрасывает запись клиента (или весь реестр, если client_id не указан)."""
+        with self._lock:
+            self._version += 1
+            if client_id is None:
+                self._records = {}
+                self._missing = {}
+            else:
+                self._records.pop(client_id, None)
+                self._missing.pop(client_id, None)
+
+
+client_registry = ClientRegistry()
+
+
+class TokenRecord(TokenMixin):
+    """Неизменяемая копия OAuth2Token для проверки токена без обращения к БД."""
+    __slots__ = ('id', 'access_token', 'client_id', 'user_id', 'scope', 'issued_at', 'expires_in', 'expires_at')
+
+    def __init__(self, token):
+        self.id = token.id
+        self.access_token = token.access_token
+        self.client_id = token.client_id
+        self.user_id = token.user_id
+        self.scope = token.scope
+        self.issued_at = token.issued_at
+        self.expires_in = token.expires_in
+        self.expires_at = token.issued_at + token.expires_in
+
+    @classmethod
+    def from_claims(cls, claims):
+        """Создает запись по claims проверенного JWT access token."""
+        record = cls.__new__(cls)
+        record.id = None
+        record.access_token = claims['jti']
+        record.client_id = claims['client_id']
+        subject = claims.get('sub')
+        record.user_id = int(subject) if subject and subject.isdigit() else None
+        record.scope = claims.get('scope')
+        record.issued_at = claims['iat']
+        record.expires_in = claims['exp'] - claims['iat']
+        record.expires_at = claims['exp']
+        return record
+
+    def check_client(self, client):
+        return self.client_id == client.get_client_id()
+
+    def get_client(self):
+        return client_registry.get(self.client_id)
+
+    def get_scope(self):
+        return self.scope
+
+    def get_expires_in(self):
+        return self.expires_in
+
+    def get_user(self):
+        user_model = OAuth2Token.user.property.mapper.class_
+        return db.session.get(user_model, self.user_id) if self.user_id else None
+
+    def is_expired(self):
+        return self.expires_at < time.time()
+
+    def is_revoked(self):
+        return False
+
+
+class TokenCache:
+    """
+    Кэш проверки access token.
+
+    Найденный токен хранится POSITIVE_TTL секунд (но не дольше срока
+    самого токена), неизвестный - NEGATIVE_TTL секунд. Отзыв и замена
+    токена при обновлении удаляют запись сразу через evict() в текущем
+    процессе; в остальных процессах отозванный токен перестает приниматься
+    не позже чем через POSITIVE_TTL секунд, когда запись перечитывается из БД.
+    При переполнении сначала удаляются истекшие записи, затем самые старые.
+    """
+    POSITIVE_TTL = 5
+    NEGATIVE_TTL = 5
+    MAX_ENTRIES = 100_000
+
+    def __init__(self):
+        self._entries = {}
+        self._version = 0
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, access_token, load):
+        """
+        Возвращает TokenRecord или None, загружая токен при отсутствии в кэше.
+
+        Args:
+            load (callable): Функция load(access_token) -> TokenRecord | None.
+        """
+        now = time.time()
+        entry = self._entries.get(access_token)
+        if entry is not None and entry[1] > now:
+            return entry[0]
+
+        with self._lock:
+            version = self._version
+        record = load(access_token)
+        expires_at = min(record.expires_at, now + self.POSITIVE_TTL) if record else now + self.NEGATIVE_TTL
+        if expires_at > now:
+            with self._lock:
+                if version == self._version:
+                    self._store(access_token, record, expires_at, now)
+        return record
+
+    def peek(self, access_token):
+        """
+        Возвращает запись из кэша без загрузки.
+
+        Returns:
+            tuple[bool, TokenRecord | None]: Признак наличия в кэше и запись (None - неизвестный токен).
+        """
+        entry = self._entries.get(access_token)
+        if entry is not None and entry[1] > time.time():
+            return True, entry[0]
+        return False, None
+
+    def put(self, record):
+        """Добавляет только что выданный токен."""
+        now = time.time()
+        with self._lock:
+            self._version += 1
+            if record.expires_at > now:
+                self._store(record.access_token, record, min(record.expires_at, now + self.POSITIVE_TTL), now)
+
+    def _store(self, access_token, record, expires_at, now):
+        if len(self._entries) >= self.MAX_ENTRIES and access_token not in self._entries:
+            self._entries = {key: entry for key, entry in self._entries.items() if entry[1] > now}
+            while len(self._entries) >= self.MAX_ENTRIES:
+                del self._entries[next(iter(self._entries))]
+        self._entries[access_token] = (record, expires_at)
+
+    def evict(self, *access_tokens):
+        """Удаляет токены из кэша (при отзыве или обновлении)."""
+        with self._lock:
+            self._version += 1
+            for access_token in access_tokens:
+                self._entries.pop(access_token, None)
+
+    def evict_client(self, client_id):
+        """Удаляет из кэша все токены клиента."""
+        with self._lock:
+            self._version += 1
+            self._entries = {
+                key: entry for key, entry in self._entries.items()
+                if entry[0] is None or entry[0].client_id != client_id
+            }
+
+
+token_cache = TokenCache()
+
+
+def refresh_token_expires_at(issued_at):
+    """Момент истечения refresh token, выданного в issued_at."""
+    return issued_at + REFRESH_TOKEN_EXPIRES_IN
+
+
+def load_token_record(access_token):
+    if is_jwt(access_token):
+        try:
+            record = TokenRecord.from_claims(signing_keys.decode(access_token))
+        except Exception:
+            return None
+        # Подпись не отражает отзыв: токен действителен, пока в БД есть запись с его jti
+        exists = db.session.query(OAuth2Token.id).filter_by(access_token=record.access_token).first()
+        return record if exists else None
+    token = OAuth2Token.query.filter_by(access_token=access_token).first()
+    return TokenRecord(token) if token else None
+
+
+signing_keys = SigningKeys()
+
+
+class JWTAccessTokenGenerator(JWTBearerTokenGenerator):
+    """
+    Генератор JWT access token по профилю RFC 9068.
+    Токен подписывается текущим ключом signing_keys, kid ключа
+    указывается в заголовке для выбора ключа из JWKS.
+    """
+
+    def access_token_generator(self, client, grant_type, user, scope):
+        now = int(time.time())
+        claims = {
+            'iss': self.issuer,
+            'exp': now + self._get_expires_in(client, grant_type),
+            'client_id': client.get_client_id(),
+            'iat': now,
+            'jti': self.get_jti(client, grant_type, user, scope),
+            'scope': scope,
+            'sub': str(user.id) if user else client.get_client_id(),
+            'aud': self.get_audiences(client, user, scope)
+        }
+        return signing_keys.sign(claims, {'typ': 'at+jwt'})
+
+
+class AuthorizationCodeRecord(AuthorizationCodeMixin):
+    """Код авторизации вне сессии БД: хранится в хранилище кодов."""
+    __slots__ = ('code', 'client_id', 'user_id', 'redirect_uri', 'response_type', 'scope',
+                 'nonce', 'auth_time', 'code_challenge', 'code_challenge_method')
+    FIELDS = __slots__
+
+    def __init__(self, **fields):
+        for name in self.FIELDS:
+            setattr(self, name, fields.get(name))
+
+    @property
+    def user(self):
+        user_model = OAuth2AuthorizationCode.user.property.mapper.class_
+        return db.session.get(user_model, self.user_id)
+
+    def is_expired(self):
+        return self.auth_time + AUTHORIZATION_CODE_TTL < time.time()
+
+    def get_redirect_uri(self):
+        return self.redirect_uri
+
+    def get_scope(self):
+        return self.scope
+
+    def get_auth_time(self):
+        return self.auth_time
+
+    def get_nonce(self):
+        return self.nonce
+
+
+class DatabaseCodeStore:
+    """
+    Хранилище кодов авторизации в таблице oauth2_code - для нескольких
+    процессов без общей памяти. Код извлекается одним DELETE ... RETURNING,
+    поэтому повторное использование кода невозможно и здесь.
+    """
+
+    def put(self, key, record):
+        db.session.add(OAuth2AuthorizationCode(**{name: getattr(record, name) for name in record.FIELDS}))
+        db.session.commit()
+
+    def pop(self, key):
+        client_id, code = key
+        table = OAuth2AuthorizationCode.__table__
+        row = db.session.execute(
+            table.delete()
+            .where(table.c.code == code, table.c.client_id == client_id)
+            .returning(*[table.c[name] for name in AuthorizationCodeRecord.FIELDS])
+        ).first()
+        db.session.commit()
+        if row is None:
+            return None
+        record = AuthorizationCodeRecord(**row._mapping)
+        return None if record.is_expired() else record
+
+
+code_store = MemoryCodeStore(ttl=AUTHORIZATION_CODE_TTL)
+
 
 # Функции для OAuth2 сервера
 def query_client(client_id):
-    return OAuth2Client.query.filter_by(client_id=client_id).first()
+    return client_registry.get(client_id)
 
 
 def save_authorization_code(code, request, *args, **kwargs):
-    nonce = request.data.get('nonce')
-    code_challenge = request.data.get('code_challenge')
-    code_challenge_method = request.data.get('code_challenge_method')
-
-    auth_code = OAuth2AuthorizationCode(
+    payload = request.payload
+    auth_code = AuthorizationCodeRecord(
         code=code,
         client_id=request.client.client_id,
-        redirect_uri=request.redirect_uri,
-        scope=request.scope,
+        redirect_uri=payload.redirect_uri,
+        response_type=payload.response_type,
+        scope=payload.scope,
         user_id=request.user.id,
-        code_challenge=code_challenge,
-        code_challenge_method=code_challenge_method,
-        nonce=nonce,
+        code_challenge=payload.data.get('code_challenge'),
+        code_challenge_method=payload.data.get('code_challenge_method'),
+        nonce=payload.data.get('nonce'),
+        auth_time=int(time.time())
     )
-    db.session.add(auth_code)
-    db.session.commit()
+    code_store.put((auth_code.client_id, code), auth_code)
     return auth_code
 
 
 def query_authorization_code(code, client):
-    auth_code = OAuth2AuthorizationCode.query.filter_by(
-        code=code, client_id=client.client_id).first()
-    if auth_code and not auth_code.is_expired():
-        return auth_code
+    # Код извлекается из хранилища сразу: даже при неудачной проверке
+    # параметров запроса он не может быть использован повторно
+    return code_store.pop((client.client_id, code))
 
 
 def delete_authorization_code(authorization_code):
-    db.session.delete(authorization_code)
-    db.session.commit()
+    # Код уже удален из хранилища в query_authorization_code
+    pass
+
+
+def save_bearer_token(token, request, *args, family=None, commit=True, **kwargs):
+    """
+    Сохраняет выданный токен.
+
+    Args:
+        family (str, optional): Цепочка токенов; по умолчанию начинается новая.
+        commit (bool): Завершить транзакцию. При False токен только добавляется
+            в сессию, а фиксирует его вызывающий код (ротация refresh token).
+
+    Returns:
+        OAuth2Token: Сохраненный токен.
+    """
+    self_contained = is_jwt(token['access_token'])
+    if self_contained:
+        # Для JWT в БД хранится только jti: токен проверяется по подписи
+        token = dict(token, access_token=jwt_claims_unverified(token['access_token'])['jti'])
+    oauth_token = OAuth2Token(
+        client_id=request.client.client_id,
+        user_id=request.user.id if request.user else None,  # None - служебный токен client_credentials
+        family=family or uuid.uuid4().hex,
+        **token
+    )
+    db.session.add(oauth_token)
+    if commit:
+        db.session.commit()
+        if not self_contained:
+            token_cache.put(TokenRecord(oauth_token))
+    return oauth_token
 
 
-def save_bearer_token(token, request, *args, **kwargs):
-    if request.user:
-        oauth_token = OAuth2Token(
-            client_id=request.client.client_id,
-            user_id=request.user.id,
-            **token
-        )
-        db.session.add(oauth_token)
-        db.session.commit()
+def revoke_token_family(family):
+    """
+    Отзывает все токены цепочки (при повторном использовании refresh token).
+
+    Returns:
+        int: Количество удаленных токенов.
+    """
+    tokens = OAuth2Token.query.filter_by(family=family).all()
+    for token in tokens:
+        db.session.delete(token)
+    db.session.commit()
+    token_cache.evict(*[token.access_token for token in tokens])
+    return len(tokens)
 
 
 # Классы грантов
 class AuthorizationCodeGrant(grants.AuthorizationCodeGrant):
-    def create_authorization_code(self, client, grant_user, request):
-        code = generate_token(48)
-        save_authorization_code(code, request, client=client, grant_user=grant_user)
-        return code
+    TOKEN_ENDPOINT_AUTH_METHODS = list(CLIENT_AUTH_METHODS)
+
+    def save_authorization_code(self, code, request):
+        return save_authorization_code(code, request)
 
-    def parse_authorization_code(self, code, client):
+    def query_authorization_code(self, code, client):
         return query_authorization_code(code, client)
 
     def delete_authorization_code(self, authorization_code):
@@ -191,36 +697,184 @@ class AuthorizationCodeGrant(grants.AuthorizationCodeGrant):
 
 
 class RefreshTokenGrant(grants.RefreshTokenGrant):
+    TOKEN_ENDPOINT_AUTH_METHODS = list(CLIENT_AUTH_METHODS)
+    # Старый токен удаляется, поэтому клиент получает новый refresh token
+    INCLUDE_NEW_REFRESH_TOKEN = True
+
     def authenticate_refresh_token(self, refresh_token):
         token = OAuth2Token.query.filter_by(refresh_token=refresh_token).first()
-        if token and not token.is_expired():
+        if token is None:
+            retired = db.session.get(OAuth2RetiredRefreshToken, refresh_token_hash(refresh_token))
+            if retired is not None:
+                # Замененный токен предъявлен повторно: он мог быть украден,
+                # поэтому отзывается вся цепочка, включая действующий токен
+                revoked = revoke_token_family(retired.family)
+                print(f"🚨 Повторное использование refresh token клиента {retired.client_id}: "
+                      f"отозвано токенов цепочки - {revoked}")
+            return None
+        if not token.is_refresh_token_expired():
             return token
 
     def authenticate_user(self, credential):
         return credential.user
 
+    def save_token(self, token):
+        # Новый токен фиксируется вместе с удалением старого в revoke_old_credential
+        self._self_contained = is_jwt(token['access_token'])
+        self._new_token = save_bearer_token(token, self.request, family=self.request.refresh_token.family,
+                                            commit=False)
+        return self._new_token
+
     def revoke_old_credential(self, credential):
-        db.session.delete(credential)
+        """
+        Заменяет refresh token в одной транзакции: новый токен добавлен
+        в save_token, старый удаляется и запоминается как замененный.
+        Если старый токен уже удален параллельным запросом, транзакция
+        откатывается и клиент получает invalid_grant.
+        """
+        now = int(time.time())
+        access_token, refresh_token = credential.access_token, credential.refresh_token
+        table = OAuth2Token.__table__
+        deleted = db.session.execute(table.delete().where(
+            table.c.id == credential.id,
+            table.c.refresh_token == refresh_token
+        )).rowcount
+        if not deleted:
+            db.session.rollback()
+            raise InvalidGrantError()
+
+        db.session.add(OAuth2RetiredRefreshToken(
+            token_hash=refresh_token_hash(refresh_token),
+            family=self._new_token.family,
+            client_id=credential.client_id,
+            retired_at=now
+        ))
+        retired = OAuth2RetiredRefreshToken.__table__
+        db.session.execute(retired.delete().where(retired.c.retired_at < now - REFRESH_REUSE_RETENTION))
         db.session.commit()
 
+        token_cache.evict(access_token)
+        if not self._self_contained:
+            token_cache.put(TokenRecord(self._new_token))
+
+
+class ServiceTokenStore:
+    """
+    Действующие служебные токены (client_credentials) по клиенту и набору
+    областей доступа. Пока у токена остается больше
+    SERVICE_TOKEN_REUSE_MARGIN секунд, клиент получает его повторно
+    вместо выпуска нового. Хранится полный ответ token endpoint, поэтому
+    повторно выдаются и JWT, которые в БД представлены только jti.
+    Непрозрачные токены, выпущенные другими процессами, находятся по БД.
+
+    Атрибуты:
+        lookup_database (bool): Искать токен в БД при отсутствии в памяти
+            (только для непрозрачных токенов).
+    """
+
+    def __init__(self):
+        self.lookup_database = True
+        self._tokens = {}
+        self._lock = Lock()
+
+    def get(self, client_id, scope):
+        """
+        Returns:
+            dict | None: Ответ token endpoint с оставшимся expires_in или None.
+        """
+        now = int(time.time())
+        entry = self._tokens.get((client_id, scope))
+        if entry is None and self.lookup_database:
+            entry = self._load(client_id, scope, now)
+        if entry is None or entry[1] - now <= SERVICE_TOKEN_REUSE_MARGIN:
+            return None
+        return dict(entry[0], expires_in=entry[1] - now)
+
+    def _load(self, client_id, scope, now):
+        token = OAuth2Token.query.filter(
+            OAuth2Token.client_id == client_id,
+            OAuth2Token.user_id.is_(None),
+            OAuth2Token.scope == scope,
+            OAuth2Token.issued_at + OAuth2Token.expires_in > now + SERVICE_TOKEN_REUSE_MARGIN
+        ).order_by(OAuth2Token.issued_at.desc()).first()
+        if token is None:
+            return None
+        entry = ({'access_token': token.access_token, 'token_type': token.token_type, 'scope': token.scope},
+                 token.issued_at + token.expires_in)
+        self.put(client_id, scope, entry[0], entry[1])
+        return entry
+
+    def put(self, client_id, scope, token, expires_at):
+        with self._lock:
+            self._tokens[(client_id, scope)] = (token, expires_at)
+
+    def evict_client(self, client_id):
+        with self._lock:
+            self._tokens = {key: entry for key, entry in self._tokens.items() if key[0] != client_id}
+
+
+service_tokens = ServiceTokenStore()
+
+
+class ClientCredentialsGrant(grants.ClientCredentialsGrant):
+    """
+    Служебные токены для сервисов без пользователя (импорт расписания,
+    синхронизация с кадровой системой). Клиенту доступны только его
+    service_scopes; без указания scope выдаются все они. Еще действующий
+    токен с тем же набором областей доступа выдается повторно.
+    """
+    TOKEN_ENDPOINT_AUTH_METHODS = list(CLIENT_AUTH_METHODS)
+
+    def create_token_response(self):
+        client = self.request.client
+        requested = set((self.request.payload.scope or '').split()) or set(client.service_scopes)
+        if not requested <= client.service_scopes:
+            raise InvalidScopeError()
+        scope = ' '.join(sorted(requested))
+
+        token = service_tokens.get(client.client_id, scope)
+        if token is None:
+            token = self.server.generate_token(grant_type=self.GRANT_TYPE, client=client.as_service(),
+                                               scope=scope, include_refresh_token=False)
+            self.save_token(token)
+            service_tokens.put(client.client_id, scope, {name: value for name, value in token.items()
+                                                         if name != 'expires_in'},
+                               int(time.time()) + token['expires_in'])
+        return 200, token, self.TOKEN_RESPONSE_HEADER
+
+
+class TokenValidator(BearerTokenValidator):
+    def authenticate_token(self, token_string):
+        return token_cache.get(token_string, load_token_record)
+
 
 # Инициализация OAuth2 сервера
 authorization = AuthorizationServer()
 require_oauth = ResourceProtector()
 
 
-def config_oauth(app, db_instance):
-    global db
-    db = db_instance
-
+def config_oauth(app):
+    global code_store, REFRESH_TOKEN_EXPIRES_IN
+    REFRESH_TOKEN_EXPIRES_IN = app.config.get('OAUTH2_REFRESH_TOKEN_EXPIRES_IN', REFRESH_TOKEN_EXPIRES_IN)
     authorization.init_app(app, query_client=query_client, save_token=save_bearer_token)
+    # Коды в памяти видны только выдавшему их процессу: 'memory' - лишь для запуска в одном процессе
+    if app.config.get('OAUTH2_CODE_STORE', 'database') == 'memory':
+        code_store = MemoryCodeStore(ttl=AUTHORIZATION_CODE_TTL)
+    else:
+        code_store = DatabaseCodeStore()
+    signing_keys.configure(os.path.join(app.instance_path, 'oauth_jwks.json'))
+    # Для JWT в БД хранится только jti, сам токен из нее восстановить нельзя
+    service_tokens.lookup_database = not app.config.get('OAUTH2_JWT_ACCESS_TOKENS')
+    if app.config.get('OAUTH2_JWT_ACCESS_TOKENS'):
+        bearer = authorization.create_bearer_token_generator(app.config)
+        authorization.register_token_generator('default', JWTAccessTokenGenerator(
+            issuer=app.config['OAUTH2_JWT_ISSUER'],
+            refresh_token_generator=bearer.refresh_token_generator,
+            expires_generator=bearer.expires_generator
+        ))
     authorization.register_grant(AuthorizationCodeGrant)
     authorization.register_grant(RefreshTokenGrant)
+    authorization.register_grant(ClientCredentialsGrant)
 
     # Resource protector
-    require_oauth.init_app(app)
-
-    def query_token(access_token):
-        return OAuth2Token.query.filter_by(access_token=access_token).first()
-
-    require_oauth.register_token_validator(query_token)
\ No newline at end of file
+    require_oauth.register_token_validator(TokenValidator())
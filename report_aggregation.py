@@ -0,0 +1,249 @@
+# report_aggregation.py - векторная агрегация ответов на отчетные формы
+from collections import OrderedDict
+from threading import Lock
+import json
+import time
+
+import numpy as np
+
+DEFAULT_PERCENTILES = (50, 90)
+
+
+def _stats(values, percentiles):
+    """
+    Считает показатели по массиву значений без пропусков.
+
+    Returns:
+        dict: count, sum, mean, min, max и перцентили (p50, p90, ...).
+    """
+    count = int(values.size)
+    if not count:
+        result = {'count': 0, 'sum': 0.0, 'mean': None, 'min': None, 'max': None}
+        result.update({f'p{p:g}': None for p in percentiles})
+        return result
+
+    total = float(values.sum())
+    result = {
+        'count': count,
+        'sum': total,
+        'mean': total / count,
+        'min': float(values.min()),
+        'max': float(values.max())
+    }
+    if percentiles:
+        for p, value in zip(percentiles, np.percentile(values, percentiles)):
+            result[f'p{p:g}'] = float(value)
+    return result
+
+
+class SubmissionFrame:
+    """
+    Колоночное представление ответов на форму за период.
+
+    Атрибуты:
+        department_ids (np.ndarray): Подразделение автора каждого ответа (-1, если не указано).
+        columns (dict[str, np.ndarray]): Значения числовых полей (NaN для незаполненных).
+        size (int): Количество ответов.
+    """
+    MAX_RESULTS = 256
+
+    def __init__(self, department_ids, columns):
+        self.department_ids = department_ids
+        self.columns = columns
+        self.size = int(department_ids.size)
+        self._codes = None
+        self._order = None
+        self._lock = Lock()
+        self._results = {}
+
+    @classmethod
+    def from_rows(cls, rows, keys, size_hint=0):
+        """
+        Строит таблицу из строк (department_id, data_json).
+        JSON каждой строки разбирается один раз, значения сразу
+        раскладываются по заранее выделенным массивам.
+
+        Args:
+            rows (iterable): Пары (department_id, JSON-строка с данными ответа).
+            keys (iterable[str]): Ключи числовых полей формы.
+            size_hint (int): Ожидаемое количество строк для предварительного выделения памяти.
+        """
+        keys = list(keys)
+        capacity = max(size_hint, 1024)
+        departments = np.empty(capacity, dtype=np.int64)
+        columns = {key: np.empty(capacity, dtype=np.float64) for key in keys}
+        loads = json.loads
+        nan = float('nan')
+
+        size = 0
+        for department_id, data in rows:
+            if size == capacity:
+                capacity *= 2
+                departments = np.resize(departments, capacity)
+                columns = {key: np.resize(column, capacity) for key, column in columns.items()}
+
+            departments[size] = -1 if department_id is None else department_id
+            values = loads(data) if data else {}
+            for key in keys:
+                value = values.get(key)
+                try:
+                    columns[key][size] = nan if value is None else value
+                except (TypeError, ValueError):
+                    columns[key][size] = nan
+            size += 1
+
+        return cls(departments[:size].copy(), {key: column[:size].copy() for key, column in columns.items()})
+
+    def _group_layout(self):
+        """Кодирует подразделения и сортирует строки по ним (вычисляется один раз)."""
+        if self._codes is None:
+            uniques, codes = np.unique(self.department_ids, return_inverse=True)
+            order = np.argsort(codes, kind='stable')
+            bounds = np.searchsorted(codes[order], np.arange(uniques.size + 1))
+            self._codes = (uniques, codes)
+            self._order = (order, bounds)
+        return self._codes, self._order
+
+    def cached(self, key, compute):
+        """
+        Возвращает сохраненный результат расчета или вычисляет и сохраняет его.
+        Хранится не более MAX_RESULTS результатов, при переполнении удаляются самые старые.
+        """
+        with self._lock:
+            if key in self._results:
+                return self._results[key]
+        result = compute()
+        with self._lock:
+            while len(self._results) >= self.MAX_RESULTS:
+                del self._results[next(iter(self._results))]
+            self._results[key] = result
+        return result
+
+    def summary(self, key, percentiles=DEFAULT_PERCENTILES):
+        """Показатели поля по всем ответам."""
+        column = self.columns[key]
+        return _stats(column[~np.isnan(column)], percentiles)
+
+    def by_department(self, key, percentiles=DEFAULT_PERCENTILES):
+        """
+        Показатели поля по каждому подразделению автора.
+
+        Returns:
+            dict[int, dict]: Показатели по идентификаторам подразделений (-1 - без подразделения).
+        """
+        (uniques, _), (order, bounds) = self._group_layout()
+        column = self.columns[key][order]
+        result = {}
+        for position, department_id in enumerate(uniques.tolist()):
+            values = column[bounds[position]:bounds[position + 1]]
+            result[department_id] = _stats(values[~np.isnan(values)], percentiles)
+        return result
+
+    def by_subtree(self, key, descendants, percentiles=DEFAULT_PERCENTILES):
+        """
+        Показатели поля по поддеревьям структуры.
+
+        Args:
+            key (str): Ключ числового поля.
+            descendants (dict[int, iterable[int]]): Для каждого подразделения - оно само и все дочерние.
+
+        Returns:
+            dict[int, dict]: Показатели по корням поддеревьев.
+        """
+        (uniques, codes), _ = self._group_layout()
+        column = self.columns[key]
+        valid = ~np.isnan(column)
+        position_of = {department_id: i for i, department_id in enumerate(uniques.tolist())}
+
+        result = {}
+        lookup = np.zeros(uniques.size, dtype=bool)
+        for root, members in descendants.items():
+            positions = [position_of[m] for m in members if m in position_of]
+            if not positions:
+                result[root] = _stats(column[:0], percentiles)
+                continue
+            lookup[:] = False
+            lookup[positions] = True
+            result[root] = _stats(column[lookup[codes] & valid], percentiles)
+        return result
+
+
+class AggregationCache:
+    """
+    Кэш колоночных таблиц ответов с ключом (id формы, период).
+
+    Таблица и все рассчитанные по ней показатели сбрасываются, когда
+    по форме и периоду поступают новые ответы. Сброс виден только
+    текущему процессу, поэтому таблица хранится не дольше ttl секунд:
+    ответы, принятые другими процессами, попадают в отчет не позже
+    чем через это время. Хранится не более max_entries таблиц, при
+    переполнении вытесняется давно не использованная.
+
+    Атрибуты:
+        ttl (int): Срок хранения таблицы в секундах.
+        max_entries (int): Максимальное количество таблиц.
+    """
+
+    def __init__(self, ttl=60, max_entries=64):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._frames = OrderedDict()
+        # Версии и счетчики хранятся только для ключей, таблицы которых сейчас загружаются
+        self._versions = {}
+        self._loading = {}
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._frames)
+
+    def invalidate(self, form_id, period):
+        """Отмечает, что по форме и периоду появились новые ответы."""
+        with self._lock:
+            self._invalidate_locked((form_id, period))
+
+    def invalidate_form(self, form_id):
+        """Сбрасывает все таблицы формы (например, при ее удалении)."""
+        with self._lock:
+            for key in {k for k in (*self._frames, *self._loading) if k[0] == form_id}:
+                self._invalidate_locked(key)
+
+    def _invalidate_locked(self, key):
+        self._frames.pop(key, None)
+        if key in self._loading:
+            # Таблица, загружаемая сейчас, могла не увидеть новые ответы и не сохраняется
+            self._versions[key] = self._versions.get(key, 0) + 1
+
+    def get(self, form_id, period, load):
+        """
+        Возвращает таблицу ответов, загружая ее при отсутствии в кэше.
+
+        Args:
+            load (callable): Функция без аргументов, строящая SubmissionFrame.
+        """
+        key = (form_id, period)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._frames.get(key)
+            version = self._versions.get(key, 0)
+            if entry is not None and entry[1] > now:
+                self._frames.move_to_end(key)
+                return entry[0]
+            if entry is not None:
+                del self._frames[key]
+            self._loading[key] = self._loading.get(key, 0) + 1
+
+        frame = None
+        try:
+            frame = load()
+        finally:
+            with self._lock:
+                if frame is not None and self._versions.get(key, 0) == version:
+                    self._frames[key] = (frame, time.monotonic() + self.ttl)
+                    self._frames.move_to_end(key)
+                    while len(self._frames) > self.max_entries:
+                        self._frames.popitem(last=False)
+                self._loading[key] -= 1
+                if not self._loading[key]:
+                    del self._loading[key]
+                    self._versions.pop(key, None)
+        return frame
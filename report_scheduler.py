@@ -0,0 +1,209 @@
+# report_scheduler.py - расписание отчетных периодов форм
+from datetime import datetime, timedelta
+from threading import Lock
+import heapq
+
+# Порядок важен: 'полугодие' должно распознаваться раньше, чем 'год'.
+PERIODICITY_MARKERS = (
+    ('daily', ('ежеднев', 'день', 'daily')),
+    ('weekly', ('еженедел', 'недел', 'weekly')),
+    ('monthly', ('ежемесяч', 'месяц', 'monthly')),
+    ('quarterly', ('ежекварт', 'квартал', 'quarter')),
+    ('semiannual', ('полугод', 'семестр', 'semester', 'half')),
+    ('yearly', ('ежегод', 'год', 'annual', 'year')),
+)
+
+
+def parse_periodicity(period):
+    """
+    Определяет периодичность по текстовому значению Form.period.
+
+    Args:
+        period (str): Например, 'Ежемесячно', 'квартал', 'yearly'.
+
+    Returns:
+        str | None: Код периодичности или None, если форма не периодическая.
+    """
+    if not period:
+        return None
+    text = period.strip().lower()
+    for code, markers in PERIODICITY_MARKERS:
+        if any(marker in text for marker in markers):
+            return code
+    return None
+
+
+def _add_months(moment, months):
+    index = moment.year * 12 + moment.month - 1 + months
+    return datetime(index // 12, index % 12 + 1, 1)
+
+
+def period_bounds(periodicity, moment):
+    """
+    Возвращает отчетный период, содержащий указанный момент.
+
+    Args:
+        periodicity (str): Код периодичности.
+        moment (datetime): Момент времени (UTC).
+
+    Returns:
+        tuple[str, datetime, datetime]: Метка периода, его начало и конец (срок сдачи).
+    """
+    day = datetime(moment.year, moment.month, moment.day)
+    if periodicity == 'daily':
+        return day.strftime('%Y-%m-%d'), day, day + timedelta(days=1)
+    if periodicity == 'weekly':
+        start = day - timedelta(days=day.weekday())
+        year, week, _ = start.isocalendar()
+        return f'{year}-W{week:02d}', start, start + timedelta(days=7)
+    if periodicity == 'monthly':
+        start = datetime(moment.year, moment.month, 1)
+        return start.strftime('%Y-%m'), start, _add_months(start, 1)
+    if periodicity == 'quarterly':
+        quarter = (moment.month - 1) // 3
+        start = datetime(moment.year, quarter * 3 + 1, 1)
+        return f'{moment.year}-Q{quarter + 1}', start, _add_months(start, 3)
+    if periodicity == 'semiannual':
+        half = (moment.month - 1) // 6
+        start = datetime(moment.year, half * 6 + 1, 1)
+        return f'{moment.year}-H{half + 1}', start, _add_months(start, 6)
+    if periodicity == 'yearly':
+        start = datetime(moment.year, 1, 1)
+        return str(moment.year), start, datetime(moment.year + 1, 1, 1)
+    raise ValueError(f'Неизвестная периодичность: {periodicity}')
+
+
+class ScheduledPeriod:
+    """
+    Очередной отчетный период формы в расписании.
+
+    Атрибуты:
+        opens_at (datetime): Момент выдачи заданий на период.
+        form_id (int): Идентификатор формы.
+        periodicity (str): Код периодичности.
+        label (str): Метка периода (совпадает с FormSubmission.period).
+        due_at (datetime): Срок сдачи отчета за период.
+    """
+    __slots__ = ('opens_at', 'form_id', 'periodicity', 'label', 'due_at', 'active')
+
+    def __init__(self, opens_at, form_id, periodicity, label, due_at):
+        self.opens_at = opens_at
+        self.form_id = form_id
+        self.periodicity = periodicity
+        self.label = label
+        self.due_at = due_at
+        self.active = True
+
+    def __lt__(self, other):
+        return (self.opens_at, self.form_id) < (other.opens_at, other.form_id)
+
+
+class ReportScheduler:
+    """
+    Расписание отчетных периодов на min-куче по моменту выдачи заданий.
+
+    Каждая форма имеет в куче ровно одну активную запись. Добавление и
+    удаление формы - O(log n) (удаление ленивое: запись помечается
+    неактивной и отбрасывается при извлечении), поэтому куча не
+    перестраивается и формы не пересматриваются на каждом такте.
+    """
+
+    def __init__(self):
+        self._heap = []
+        self._entries = {}
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def schedule(self, form_id, periodicity, now=None):
+        """
+        Добавляет форму в расписание, начиная с текущего периода.
+        Повторный вызов заменяет расписание формы.
+        """
+        now = now or datetime.utcnow()
+        label, _, due_at = period_bounds(periodicity, now)
+        entry = ScheduledPeriod(now, form_id, periodicity, label, due_at)
+        with self._lock:
+            self._deactivate(form_id)
+            self._entries[form_id] = entry
+            heapq.heappush(self._heap, entry)
+
+    def unschedule(self, form_id):
+        """Убирает форму из расписания."""
+        with self._lock:
+            self._deactivate(form_id)
+
+    def sync(self, periodicities, now=None):
+        """
+        Приводит расписание к набору форм: добавляет новые формы и формы с
+        измененной периодичностью, убирает отсутствующие. Расписание
+        остальных форм не меняется.
+
+        Args:
+            periodicities (dict[int, str]): Код периодичности по идентификатору формы.
+        """
+        with self._lock:
+            current = {form_id: entry.periodicity for form_id, entry in self._entries.items()}
+        for form_id in current.keys() - periodicities.keys():
+            self.unschedule(form_id)
+        for form_id, periodicity in periodicities.items():
+            if current.get(form_id) != periodicity:
+                self.schedule(form_id, periodicity, now)
+
+    def _deactivate(self, form_id):
+        entry = self._entries.pop(form_id, None)
+        if entry is not None:
+            entry.active = False
+
+    def pop_due(self, now=None):
+        """
+        Извлекает все периоды, задания на которые пора выдать, и ставит
+        в расписание следующие периоды тех же форм.
+
+        Returns:
+            list[ScheduledPeriod]: Периоды, по которым нужно создать задания.
+        """
+        now = now or datetime.utcnow()
+        due = []
+        with self._lock:
+            while self._heap and self._heap[0].opens_at <= now:
+                entry = heapq.heappop(self._heap)
+                if not entry.active:
+                    continue
+                due.append(entry)
+                label, _, due_at = period_bounds(entry.periodicity, entry.due_at)
+                following = ScheduledPeriod(entry.due_at, entry.form_id, entry.periodicity, label, due_at)
+                self._entries[entry.form_id] = following
+                heapq.heappush(self._heap, following)
+        return due
+
+    def restore(self, periods):
+        """
+        Возвращает в расписание периоды, извлеченные pop_due, если задания
+        по ним не удалось сохранить. Следующий период формы, поставленный
+        pop_due, снимается; формы, расписание которых с тех пор изменилось,
+        пропускаются.
+        """
+        with self._lock:
+            for entry in periods:
+                following = self._entries.get(entry.form_id)
+                if following is None or following.opens_at != entry.due_at:
+                    continue
+                following.active = False
+                restored = ScheduledPeriod(entry.opens_at, entry.form_id, entry.periodicity, entry.label,
+                                           entry.due_at)
+                self._entries[entry.form_id] = restored
+                heapq.heappush(self._heap, restored)
+
+    def upcoming(self, limit=50):
+        """Возвращает ближайшие запланированные периоды по возрастанию момента выдачи."""
+        with self._lock:
+            return heapq.nsmallest(limit, self._entries.values())
+
+    def next_wakeup(self):
+        """Момент ближайшей выдачи заданий или None, если расписание пусто."""
+        with self._lock:
+            while self._heap and not self._heap[0].active:
+                heapq.heappop(self._heap)
+            return self._heap[0].opens_at if self._heap else None
@@ -0,0 +1,107 @@
+# role_index.py - индекс принадлежности пользователей к ролям
+from array import array
+from bisect import bisect_left, bisect_right, insort
+from threading import RLock
+
+
+class RoleMembershipIndex:
+    """
+    Индекс принадлежности пользователей к ролям в памяти процесса.
+
+    Для каждой роли хранится отсортированный массив идентификаторов
+    пользователей, поэтому подсчет участников роли выполняется за O(1),
+    проверка принадлежности и постраничный вывод - за O(log n).
+    Индекс заполняется из таблицы user_roles при запуске и обновляется
+    событиями сессии после фиксации транзакции.
+    """
+
+    def __init__(self):
+        self._members = {}
+        self._lock = RLock()
+        self.loaded = False
+
+    def load(self, pairs):
+        """
+        Полностью перестраивает индекс.
+
+        Args:
+            pairs (iterable[tuple[int, int]]): Пары (role_id, user_id).
+        """
+        grouped = {}
+        for role_id, user_id in pairs:
+            grouped.setdefault(role_id, []).append(user_id)
+
+        members = {role_id: array('q', sorted(set(ids))) for role_id, ids in grouped.items()}
+        with self._lock:
+            self._members = members
+            self.loaded = True
+
+    def add(self, role_id, user_id):
+        """Добавляет пользователя в роль, если его там еще нет."""
+        with self._lock:
+            ids = self._members.setdefault(role_id, array('q'))
+            pos = bisect_left(ids, user_id)
+            if pos == len(ids) or ids[pos] != user_id:
+                insort(ids, user_id)
+
+    def remove(self, role_id, user_id):
+        """Удаляет пользователя из роли, если он в ней состоит."""
+        with self._lock:
+            ids = self._members.get(role_id)
+            if ids is None:
+                return
+            pos = bisect_left(ids, user_id)
+            if pos < len(ids) and ids[pos] == user_id:
+                del ids[pos]
+
+    def remove_user(self, user_id):
+        """Удаляет пользователя из всех ролей."""
+        with self._lock:
+            for role_id in list(self._members):
+                self.remove(role_id, user_id)
+
+    def count(self, role_id):
+        """Возвращает количество пользователей с ролью."""
+        ids = self._members.get(role_id)
+        return len(ids) if ids is not None else 0
+
+    def counts(self):
+        """Возвращает словарь {role_id: количество пользователей}."""
+        with self._lock:
+            return {role_id: len(ids) for role_id, ids in self._members.items()}
+
+    def has(self, role_id, user_id):
+        """Проверяет, состоит ли пользователь в роли."""
+        ids = self._members.get(role_id)
+        if not ids:
+            return False
+        pos = bisect_left(ids, user_id)
+        return pos < len(ids) and ids[pos] == user_id
+
+    def members(self, role_id, after=0, limit=None):
+        """
+        Возвращает отсортированные идентификаторы пользователей роли.
+
+        Args:
+            role_id (int): Идентификатор роли.
+            after (int): Вернуть только идентификаторы больше указанного (keyset-курсор).
+            limit (int, optional): Максимальное количество идентификаторов.
+
+        Returns:
+            list[int]: Идентификаторы пользователей по возрастанию.
+        """
+        with self._lock:
+            ids = self._members.get(role_id)
+            if not ids:
+                return []
+            start = bisect_right(ids, after)
+            end = len(ids) if limit is None else min(start + limit, len(ids))
+            return ids[start:end].tolist()
+
+    def union(self, role_ids):
+        """Возвращает отсортированные идентификаторы пользователей любой из ролей."""
+        with self._lock:
+            result = set()
+            for role_id in role_ids:
+                result.update(self._members.get(role_id, ()))
+            return sorted(result)
@@ -0,0 +1,137 @@
+# schedule_index.py - интервальный индекс расписания занятий
+from bisect import bisect_left, bisect_right
+
+RESOURCE_KINDS = ('group', 'teacher', 'room')
+
+
+def resource_keys(group_name, teacher_id, room):
+    """
+    Возвращает ключи ресурсов, занимаемых занятием.
+
+    Returns:
+        list[tuple]: Пары (вид ресурса, идентификатор) для группы, преподавателя и аудитории.
+    """
+    keys = []
+    if group_name:
+        keys.append(('group', group_name))
+    if teacher_id:
+        keys.append(('teacher', teacher_id))
+    if room:
+        keys.append(('room', room))
+    return keys
+
+
+class _Timeline:
+    """
+    Занятия одного ресурса: параллельные массивы начал, окончаний и
+    идентификаторов, отсортированные по началу. Занятия ресурса не
+    пересекаются, поэтому окончания упорядочены так же, как начала.
+    """
+    __slots__ = ('starts', 'ends', 'ids')
+
+    def __init__(self):
+        self.starts = []
+        self.ends = []
+        self.ids = []
+
+    def overlapping(self, start, end):
+        """Позиции занятий, пересекающихся с интервалом [start, end)."""
+        first = bisect_right(self.ends, start)
+        last = bisect_left(self.starts, end)
+        return range(first, last)
+
+
+class ScheduleIndex:
+    """
+    Интервальный индекс расписания по группам, преподавателям и аудиториям.
+
+    Строится на время запроса из занятий базы, пересекающихся с проверяемым
+    интервалом. Для каждого ресурса хранится упорядоченная по времени линия
+    занятий; проверка конфликта выполняется двоичным поиском - O(log n) на ресурс.
+    """
+
+    def __init__(self):
+        self._timelines = {}
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def load(self, slots):
+        """
+        Полностью перестраивает индекс.
+
+        Args:
+            slots (iterable): Кортежи (id, starts_at, ends_at, group_name, teacher_id, room).
+        """
+        grouped = {}
+        size = 0
+        for slot_id, start, end, group_name, teacher_id, room in slots:
+            size += 1
+            for key in resource_keys(group_name, teacher_id, room):
+                grouped.setdefault(key, []).append((start, end, slot_id))
+
+        timelines = {}
+        for key, items in grouped.items():
+            items.sort()
+            timeline = _Timeline()
+            timeline.starts = [item[0] for item in items]
+            timeline.ends = [item[1] for item in items]
+            timeline.ids = [item[2] for item in items]
+            timelines[key] = timeline
+
+        self._timelines = timelines
+        self._size = size
+
+    def conflicts(self, start, end, keys, ignore=None):
+        """
+        Находит занятия, пересекающиеся по времени и ресурсам с новым занятием.
+
+        Args:
+            start (datetime): Начало занятия.
+            end (datetime): Окончание занятия.
+            keys (list[tuple]): Ресурсы занятия (см. resource_keys).
+            ignore (int, optional): Идентификатор занятия, которое не учитывается (при переносе).
+
+        Returns:
+            list[tuple]: Тройки (вид ресурса, идентификатор ресурса, id занятия).
+        """
+        found = []
+        for key in keys:
+            timeline = self._timelines.get(key)
+            if timeline is None:
+                continue
+            for position in timeline.overlapping(start, end):
+                if timeline.ids[position] != ignore:
+                    found.append((key[0], key[1], timeline.ids[position]))
+        return found
+
+    def batch_conflicts(self, slots):
+        """
+        Проверяет пакет новых занятий на пересечения с индексом и между собой.
+
+        Args:
+            slots (list[tuple]): Кортежи (starts_at, ends_at, keys) в порядке пакета.
+
+        Returns:
+            list[dict]: Конфликты: позиция в пакете, ресурс и id занятия
+            из расписания или позиция другого занятия пакета.
+        """
+        found = []
+        grouped = {}
+        for position, (start, end, keys) in enumerate(slots):
+            for kind, value, slot_id in self.conflicts(start, end, keys):
+                found.append({'position': position, 'kind': kind, 'resource': value, 'slot_id': slot_id})
+            for key in keys:
+                grouped.setdefault(key, []).append((start, end, position))
+
+        for (kind, value), items in grouped.items():
+            items.sort()
+            latest_end, latest_position = None, None
+            for start, end, position in items:
+                if latest_end is not None and start < latest_end:
+                    found.append({'position': position, 'kind': kind, 'resource': value,
+                                  'with_position': latest_position})
+                if latest_end is None or end > latest_end:
+                    latest_end, latest_position = end, position
+        return found
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Клиент для сервисов, обращающихся к API университета без пользователя
+(импорт расписания, синхронизация с кадровой системой).
+
+Токен получается по grant_type=client_credentials и переиспользуется,
+пока до его истечения остается больше margin секунд, поэтому задания
+не обращаются к token endpoint на каждый запрос.
+
+Пример:
+    client = ServiceTokenClient('http://localhost:5000/oauth/token',
+                                CLIENT_ID, CLIENT_SECRET, scope='read:schedule')
+    response = client.get('http://localhost:5000/api/schedule', params={'group': 'ИВТ-21'})
+"""
+
+from threading import Lock
+import time
+
+import requests
+
+
+class ServiceTokenClient:
+    """
+    HTTP-клиент с кэшированием служебного access token.
+
+    Атрибуты:
+        token_url (str): Адрес token endpoint.
+        client_id (str): Идентификатор OAuth2 клиента.
+        client_secret (str): Секрет клиента.
+        scope (str, optional): Запрашиваемые служебные области доступа через пробел.
+        margin (int): За сколько секунд до истечения токен обновляется заранее.
+    """
+
+    def __init__(self, token_url, client_id, client_secret, scope=None, margin=60, session=None):
+        self.token_url = token_url
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.scope = scope
+        self.margin = margin
+        self.session = session or requests.Session()
+        self._token = None
+        self._expires_at = 0
+        self._lock = Lock()
+
+    def _fetch_token(self):
+        data = {'grant_type': 'client_credentials'}
+        if self.scope:
+            data['scope'] = self.scope
+        response = self.session.post(self.token_url, data=data, auth=(self.client_id, self.client_secret))
+        if response.status_code != 200:
+            raise RuntimeError(f"Ошибка получения токена: {response.status_code} {response.text}")
+        token = response.json()
+        self._token = token['access_token']
+        self._expires_at = time.monotonic() + token.get('expires_in', 0)
+
+    def get_token(self):
+        """
+        Возвращает действующий access token, при необходимости получая новый.
+
+        Returns:
+            str: Access token.
+        """
+        with self._lock:
+            if self._token is None or time.monotonic() > self._expires_at - self.margin:
+                self._fetch_token()
+            return self._token
+
+    def invalidate(self):
+        """Сбрасывает токен (например, после отзыва клиента)."""
+        with self._lock:
+            self._token = None
+
+    def request(self, method, url, **kwargs):
+        """
+        Выполняет запрос с заголовком Authorization. При ответе 401 токен
+        получается заново и запрос повторяется один раз.
+
+        Returns:
+            requests.Response: Ответ сервера.
+        """
+        headers = kwargs.pop('headers', None) or {}
+        for attempt in range(2):
+            response = self.session.request(
+                method, url, headers=dict(headers, Authorization=f'Bearer {self.get_token()}'), **kwargs
+            )
+            if response.status_code != 401 or attempt:
+                return response
+            self.invalidate()
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
@@ -0,0 +1,122 @@
+# submission_ingest.py - групповая запись данных форм
+from concurrent.futures import Future
+from queue import Empty, Queue
+from threading import Lock, Thread
+import time
+
+
+class BatchWriter:
+    """
+    Групповая запись: накапливает записи от параллельных запросов и
+    сохраняет их одной транзакцией раз в flush_interval секунд или при
+    наборе max_batch записей.
+
+    Записи ставятся в очередь группами: submit_many() передает записи
+    одного запроса, которые всегда попадают в один пакет целиком (группа
+    больше max_batch образует отдельный пакет). Каждая группа получает
+    Future, который завершается после фиксации транзакции, поэтому запрос
+    отвечает клиенту только когда данные действительно сохранены. Если
+    транзакция пакета из нескольких групп не удалась, каждая группа
+    записывается заново отдельной транзакцией: ошибка одной группы не
+    затрагивает записи других запросов.
+
+    Future группы, еще не взятой в запись, можно отменить (cancel()),
+    тогда ее записи не будут сохранены.
+
+    Атрибуты:
+        write_batch (callable): Функция записи пакета: write_batch(items) в одной транзакции.
+        on_commit (callable, optional): Вызывается с пакетом после успешной записи.
+        flush_interval (float): Максимальное время накопления пакета в секундах.
+        max_batch (int): Максимальный размер пакета.
+    """
+
+    def __init__(self, write_batch, on_commit=None, flush_interval=0.002, max_batch=500):
+        self.write_batch = write_batch
+        self.on_commit = on_commit
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self._queue = Queue()
+        self._carry = None
+        self._thread = None
+        self._lock = Lock()
+
+    def start(self):
+        """Запускает фоновый поток записи, если он еще не запущен."""
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = Thread(target=self._run, name='batch-writer', daemon=True)
+                self._thread.start()
+
+    def submit(self, item):
+        """
+        Ставит запись в очередь.
+
+        Returns:
+            Future: Завершается после фиксации пакета с этой записью.
+        """
+        return self.submit_many([item])
+
+    def submit_many(self, items):
+        """
+        Ставит в очередь записи одного запроса; они сохраняются одной транзакцией.
+
+        Returns:
+            Future: Завершается после фиксации всех записей группы.
+        """
+        future = Future()
+        self._queue.put((list(items), future))
+        if self._thread is None:
+            self.start()
+        return future
+
+    def _collect(self):
+        batch = [self._carry or self._queue.get()]
+        self._carry = None
+        size = len(batch[0][0])
+        deadline = time.monotonic() + self.flush_interval
+        while size < self.max_batch:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                group = self._queue.get(timeout=timeout)
+            except Empty:
+                break
+            if size + len(group[0]) > self.max_batch:
+                # Группа не делится между пакетами: она откроет следующий пакет
+                self._carry = group
+                break
+            batch.append(group)
+            size += len(group[0])
+        # Отмененные группы (истекло ожидание запроса) не записываются
+        return [group for group in batch if group[1].set_running_or_notify_cancel()]
+
+    def _write(self, batch):
+        items = [item for group, _ in batch for item in group]
+        self.write_batch(items)
+        if self.on_commit:
+            try:
+                self.on_commit(items)
+            except Exception as e:
+                print(f"❌ Ошибка обработчика записи пакета: {e}")
+        for _, future in batch:
+            future.set_result(True)
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            if not batch:
+                continue
+            try:
+                self._write(batch)
+                continue
+            except Exception as e:
+                if len(batch) == 1:
+                    batch[0][1].set_exception(e)
+                    continue
+
+            for group in batch:
+                try:
+                    self._write([group])
+                except Exception as e:
+                    group[1].set_exception(e)
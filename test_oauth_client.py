@@ -4,8 +4,15 @@
 через систему университета
 """
 
+from concurrent.futures import ThreadPoolExecutor
 from flask import Flask, request, redirect, session, jsonify, render_template_string
+from requests.adapters import HTTPAdapter
+from threading import Lock
+import argparse
 import requests
+import sys
+import tempfile
+import time
 import urllib.parse
 import secrets
 
@@ -362,7 +369,190 @@ def test_token():
         return jsonify({'error': str(e)}), 500
 
 
+"""
+================= НАГРУЗОЧНЫЙ РЕЖИМ =================
+Имитация N пользователей, параллельно проходящих OAuth2 flow:
+authorize -> обмен кода на токен -> userinfo -> refresh.
+Каждый пользователь работает через свою requests.Session с пулом
+соединений keep-alive. Для каждого этапа собираются задержки и по ним
+печатаются пропускная способность, перцентили и гистограмма.
+"""
+
+# Границы интервалов гистограммы задержек в секундах
+LATENCY_BUCKETS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0)
+LOAD_PHASES = ('authorize', 'token', 'userinfo', 'userinfo_304', 'refresh')
+
+
+class PhaseStats:
+    """Задержки и ошибки по этапам flow; пополняется из нескольких потоков."""
+
+    def __init__(self):
+        self.latencies = {phase: [] for phase in LOAD_PHASES}
+        self.errors = {phase: 0 for phase in LOAD_PHASES}
+        self._lock = Lock()
+
+    def record(self, phase, latency, ok):
+        with self._lock:
+            self.latencies[phase].append(latency)
+            if not ok:
+                self.errors[phase] += 1
+
+
+def _format_ms(seconds):
+    return f"{seconds * 1000:.1f} мс"
+
+
+def _histogram(latencies, width=40):
+    counts = [0] * (len(LATENCY_BUCKETS) + 1)
+    for latency in latencies:
+        counts[next((i for i, bound in enumerate(LATENCY_BUCKETS) if latency < bound), len(LATENCY_BUCKETS))] += 1
+    peak = max(counts) or 1
+    labels = [f"< {_format_ms(bound)}" for bound in LATENCY_BUCKETS] + [f">= {_format_ms(LATENCY_BUCKETS[-1])}"]
+    return [f"      {label:>12} | {'█' * round(count * width / peak):<{width}} {count}"
+            for label, count in zip(labels, counts) if count]
+
+
+def run_user_flow(base_url, user_token, iterations, stats, client_id, client_secret, redirect_uri):
+    """
+    Проводит одного пользователя через OAuth2 flow iterations раз.
+    Повторная авторизация того же приложения проходит по запомненному согласию.
+    """
+    http = requests.Session()
+    http.mount(base_url, HTTPAdapter(pool_connections=1, pool_maxsize=1))
+    user_headers = {'Authorization': f'Bearer {user_token}'}
+    params = {'response_type': 'code', 'client_id': client_id, 'redirect_uri': redirect_uri,
+              'scope': OAUTH_CONFIG['scope']}
+    credentials = {'client_id': client_id, 'client_secret': client_secret}
+
+    def call(phase, method, url, expected=200, **kwargs):
+        started = time.perf_counter()
+        try:
+            response = http.request(method, url, **kwargs)
+            ok = response.status_code == expected
+            if ok and expected == 200:
+                response.json()
+        except (requests.RequestException, ValueError):
+            response, ok = None, False
+        stats.record(phase, time.perf_counter() - started, ok)
+        return response if ok else None
+
+    def redirect_location(method, **kwargs):
+        # Этап authorize: None - ошибка, '' - требуется подтверждение согласия
+        try:
+            response = http.request(method, f'{base_url}/oauth/authorize', params=params,
+                                    headers=user_headers, **kwargs)
+            if response.status_code != 200:
+                return None
+            return response.json().get('redirect_to') or ''
+        except (requests.RequestException, ValueError, AttributeError):
+            return None
+
+    for _ in range(iterations):
+        started = time.perf_counter()
+        location = redirect_location('GET')
+        if location == '':
+            location = redirect_location('POST', data={'confirm': 'true'})
+        code = urllib.parse.parse_qs(urllib.parse.urlparse(location).query).get('code', [None])[0] \
+            if location else None
+        stats.record('authorize', time.perf_counter() - started, code is not None)
+        if not code:
+            continue
+
+        response = call('token', 'POST', f'{base_url}/oauth/token', data=dict(
+            credentials, grant_type='authorization_code', code=code, redirect_uri=redirect_uri))
+        if response is None:
+            continue
+        tokens = response.json()
+
+        bearer = {'Authorization': f"Bearer {tokens['access_token']}"}
+        response = call('userinfo', 'GET', f'{base_url}/api/oauth/user', headers=bearer)
+        if response is not None and response.headers.get('ETag'):
+            call('userinfo_304', 'GET', f'{base_url}/api/oauth/user', expected=304,
+                 headers=dict(bearer, **{'If-None-Match': response.headers['ETag']}))
+
+        call('refresh', 'POST', f'{base_url}/oauth/token', data=dict(
+            credentials, grant_type='refresh_token', refresh_token=tokens['refresh_token']))
+
+
+def report_load(stats, elapsed, users, max_p99=None):
+    """
+    Печатает результаты по этапам.
+
+    Returns:
+        bool: True, если ошибок нет и p99 каждого этапа не превышает max_p99 (мс).
+    """
+    passed = True
+    print(f"\n📊 Результаты: {users} пользователей, {elapsed:.2f} с")
+    for phase in LOAD_PHASES:
+        latencies = sorted(stats.latencies[phase])
+        if not latencies:
+            continue
+        p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+        print(f"   {phase}: {len(latencies) / elapsed:,.1f} запросов/с, ошибок {stats.errors[phase]}, "
+              f"p50 {_format_ms(latencies[len(latencies) // 2])}, "
+              f"p90 {_format_ms(latencies[min(len(latencies) - 1, int(len(latencies) * 0.9))])}, "
+              f"p99 {_format_ms(p99)}")
+        print("\n".join(_histogram(latencies)))
+        if stats.errors[phase] or (max_p99 is not None and p99 * 1000 > max_p99):
+            passed = False
+    return passed
+
+
+def run_load(users, iterations, base_url=None, user_tokens=None, max_p99=None):
+    """
+    Запускает нагрузку. Без base_url поднимает локальный экземпляр портала
+    с отдельной базой SQLite, пользователями и OAuth2 клиентом.
+
+    Returns:
+        bool: Результат report_load.
+    """
+    client_id, client_secret = OAUTH_CONFIG['client_id'], OAUTH_CONFIG['client_secret']
+    redirect_uri = OAUTH_CONFIG['redirect_uri']
+    with tempfile.TemporaryDirectory() as tmp:
+        portal = None
+        if base_url is None:
+            from benchmarks import LOCAL_CLIENT_ID, LOCAL_CLIENT_SECRET, LOCAL_REDIRECT_URI, start_local_portal
+            print(f"🚀 Запуск локального портала для {users} пользователей...")
+            portal, port, user_tokens = start_local_portal(tmp, users)
+            base_url = f'http://127.0.0.1:{port}'
+            client_id, client_secret, redirect_uri = LOCAL_CLIENT_ID, LOCAL_CLIENT_SECRET, LOCAL_REDIRECT_URI
+
+        try:
+            stats = PhaseStats()
+            started = time.perf_counter()
+            with ThreadPoolExecutor(users) as pool:
+                futures = [pool.submit(run_user_flow, base_url, token, iterations, stats,
+                                       client_id, client_secret, redirect_uri)
+                           for token in user_tokens[:users]]
+                for future in futures:
+                    future.result()
+            return report_load(stats, time.perf_counter() - started, users, max_p99)
+        finally:
+            if portal is not None:
+                portal.terminate()
+                portal.join()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Тестовое OAuth2 приложение и генератор нагрузки')
+    parser.add_argument('--load', action='store_true', help='нагрузочный режим вместо веб-приложения')
+    parser.add_argument('--users', type=int, default=20, help='количество одновременных пользователей')
+    parser.add_argument('--iterations', type=int, default=10, help='сколько раз каждый пользователь проходит flow')
+    parser.add_argument('--base-url', help='адрес уже запущенного портала (по умолчанию запускается локальный)')
+    parser.add_argument('--user-token', action='append', default=[],
+                        help='JWT пользователя портала для --base-url (можно указать несколько)')
+    parser.add_argument('--max-p99', type=float, help='допустимый p99 каждого этапа в мс')
+    return parser.parse_args()
+
+
 if __name__ == '__main__':
+    args = parse_args()
+    if args.load:
+        if args.base_url and not args.user_token:
+            sys.exit('❌ Для --base-url укажите хотя бы один --user-token')
+        tokens = [args.user_token[i % len(args.user_token)] for i in range(args.users)] if args.user_token else None
+        sys.exit(0 if run_load(args.users, args.iterations, args.base_url, tokens, args.max_p99) else 1)
+
     print("🧪 Тестовое OAuth2 приложение")
     print("📍 Доступно по адресу: http://localhost:3000")
     print("🔧 Настройте OAuth клиента в основном приложении:")
@@ -0,0 +1,262 @@
+# webhook_dispatcher.py - пакетная доставка webhook-событий OAuth2 клиентам
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from threading import Condition, Thread
+import hashlib
+import heapq
+import hmac
+import itertools
+import json
+import random
+import time
+import urllib.request
+import uuid
+
+# Подписка клиента: events - frozenset типов событий (пустой - все),
+# all_users - клиент получает события обо всех пользователях
+Subscription = namedtuple('Subscription', 'id client_id url secret events all_users')
+
+
+def sign_payload(secret, timestamp, body):
+    """
+    Подпись тела запроса: HMAC-SHA256 от '<timestamp>.<body>' секретом подписки.
+
+    Returns:
+        str: Подпись в шестнадцатеричном виде.
+    """
+    return hmac.new(secret.encode(), f'{timestamp}.'.encode() + body, hashlib.sha256).hexdigest()
+
+
+def post_json(url, body, headers, timeout):
+    """Отправляет POST с JSON-телом; ответ 4xx/5xx вызывает исключение."""
+    request = urllib.request.Request(url, data=body, method='POST',
+                                     headers=dict(headers, **{'Content-Type': 'application/json'}))
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return response.status
+
+
+def make_event(event_type, object_id):
+    """Создает событие об изменении объекта ('user.updated', 'department.deleted' и т.п.)."""
+    return {
+        'id': uuid.uuid4().hex,
+        'type': event_type,
+        'object': {'id': object_id},
+        'occurred_at': datetime.utcnow().isoformat() + 'Z'
+    }
+
+
+def _merge_event(previous, event):
+    """
+    Объединяет события об одном объекте: сохраняется последнее, но
+    created, за которым последовали изменения, остается created.
+    """
+    if previous is not None and previous['type'].endswith('.created') and event['type'].endswith('.updated'):
+        return dict(event, type=previous['type'])
+    return event
+
+
+class WebhookDispatcher:
+    """
+    Фоновая доставка событий подписчикам пакетами.
+
+    События поступают через publish() или забираются функцией fetch из
+    постоянного хранилища (outbox) раз в poll_interval секунд и сразу после
+    wake(). fetch(limit) возвращает не более limit событий и удаляет их из
+    хранилища: забранные события доставляются не более одного раза, при
+    остановке процесса до доставки они теряются.
+
+    События распределяются по подпискам
+    функцией route и накапливаются по подписке в течение window секунд;
+    несколько изменений одного объекта за это время сливаются в одно
+    событие. Пакет подписывается секретом подписки и отправляется пулом
+    потоков; одновременно для одного клиента выполняется не более
+    per_client доставок. Неудачная доставка повторяется с экспоненциальной
+    задержкой, после max_attempts попыток пакет отбрасывается.
+
+    Атрибуты:
+        route (callable): Принимает список событий и возвращает пары (Subscription, событие).
+        fetch (callable, optional): Забирает из хранилища не более limit событий: fetch(limit).
+        poll_interval (float): Интервал опроса хранилища в секундах.
+        max_fetch (int): Максимальное количество событий, забираемых за один опрос.
+        send (callable): Функция отправки (url, body, headers, timeout).
+        window (float): Интервал накопления событий в секундах.
+        max_batch (int): Максимальное количество событий в пакете.
+        max_attempts (int): Количество попыток доставки пакета.
+        retry_delay (float): Задержка перед первой повторной попыткой в секундах.
+        per_client (int): Максимальное число одновременных доставок одному клиенту.
+    """
+
+    def __init__(self, route, send=post_json, fetch=None, poll_interval=1.0, max_fetch=500, window=2.0,
+                 max_batch=100, max_attempts=6, retry_delay=2.0, per_client=2, workers=8, timeout=10):
+        self.route = route
+        self.send = send
+        self.fetch = fetch
+        self.poll_interval = poll_interval
+        self.max_fetch = max_fetch
+        self.window = window
+        self.max_batch = max_batch
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.per_client = per_client
+        self.workers = workers
+        self.timeout = timeout
+
+        self._condition = Condition()
+        self._inbox = []
+        self._wake = False
+        self._last_poll = 0.0
+        self._pending = {}
+        self._retries = []
+        self._sequence = itertools.count()
+        self._in_flight = {}
+        self._stats = {}
+        self._executor = None
+
+    @property
+    def running(self):
+        return self._executor is not None
+
+    def start(self):
+        """Запускает фоновый поток распределения и пул потоков доставки."""
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix='webhook')
+            Thread(target=self._run, name='webhook-dispatcher', daemon=True).start()
+
+    def publish(self, events):
+        """Передает события диспетчеру. Без запущенного диспетчера события отбрасываются."""
+        if not events or not self.running:
+            return
+        with self._condition:
+            self._inbox.extend(events)
+            self._condition.notify()
+
+    def wake(self):
+        """Запрашивает внеочередной опрос хранилища (после фиксации новых событий)."""
+        if not self.running:
+            return
+        with self._condition:
+            self._wake = True
+            self._condition.notify()
+
+    def stats(self, subscription_id):
+        """
+        Returns:
+            dict: Количество доставленных и отброшенных пакетов и последняя ошибка подписки.
+        """
+        with self._condition:
+            return dict(self._stats.get(subscription_id, {'delivered': 0, 'dropped': 0, 'last_error': None}))
+
+    def _next_due(self):
+        # Подписки клиентов без свободных слотов ждут уведомления о завершении доставки
+        moments = [entry['due'] for entry in self._pending.values()
+                   if self._in_flight.get(entry['subscription'].client_id, 0) < self.per_client]
+        if self._retries:
+            moments.append(self._retries[0][0])
+        return min(moments) if moments else None
+
+    def _poll_due(self):
+        if self.fetch is None:
+            return None
+        return self._last_poll + self.poll_interval
+
+    def _run(self):
+        while True:
+            with self._condition:
+                if not self._inbox and not self._wake:
+                    moments = [moment for moment in (self._next_due(), self._poll_due()) if moment is not None]
+                    self._condition.wait(max(min(moments) - time.monotonic(), 0) if moments else None)
+                inbox, self._inbox = self._inbox, []
+                poll = self.fetch is not None and (self._wake or time.monotonic() >= self._poll_due())
+                self._wake = False
+
+            if poll:
+                self._last_poll = time.monotonic()
+                try:
+                    fetched = self.fetch(self.max_fetch)
+                except Exception as e:
+                    print(f"❌ Ошибка чтения webhook-событий из хранилища: {e}")
+                    fetched = []
+                if len(fetched) >= self.max_fetch:
+                    # В хранилище остались события: следующий опрос без ожидания
+                    with self._condition:
+                        self._wake = True
+                inbox.extend(fetched)
+
+            if inbox:
+                try:
+                    self._coalesce(self.route(inbox))
+                except Exception as e:
+                    print(f"❌ Ошибка распределения webhook-событий: {e}")
+            self._dispatch_due()
+
+    def _coalesce(self, routed):
+        now = time.monotonic()
+        with self._condition:
+            for subscription, event in routed:
+                entry = self._pending.setdefault(subscription.id, {'events': {}, 'due': now + self.window})
+                entry['subscription'] = subscription
+                key = (event['type'].split('.')[0], event['object']['id'])
+                entry['events'][key] = _merge_event(entry['events'].get(key), event)
+
+    def _acquire(self, client_id):
+        if self._in_flight.get(client_id, 0) >= self.per_client:
+            return False
+        self._in_flight[client_id] = self._in_flight.get(client_id, 0) + 1
+        return True
+
+    def _dispatch_due(self):
+        now = time.monotonic()
+        batches = []
+        with self._condition:
+            for subscription_id, entry in list(self._pending.items()):
+                if entry['due'] > now or not self._acquire(entry['subscription'].client_id):
+                    continue
+                keys = list(entry['events'])[:self.max_batch]
+                batches.append((entry['subscription'], [entry['events'].pop(key) for key in keys], 1))
+                if not entry['events']:
+                    del self._pending[subscription_id]
+
+            postponed = []
+            while self._retries and self._retries[0][0] <= now:
+                item = heapq.heappop(self._retries)
+                subscription = item[2]
+                if self._acquire(subscription.client_id):
+                    batches.append(item[2:])
+                else:
+                    postponed.append(item)
+            for due, sequence, subscription, events, attempt in postponed:
+                heapq.heappush(self._retries, (now + self.window, sequence, subscription, events, attempt))
+
+        for subscription, events, attempt in batches:
+            self._executor.submit(self._deliver, subscription, events, attempt)
+
+    def _deliver(self, subscription, events, attempt):
+        timestamp = str(int(time.time()))
+        body = json.dumps({'delivery_id': uuid.uuid4().hex, 'attempt': attempt, 'events': events},
+                          ensure_ascii=False).encode()
+        headers = {
+            'X-Webhook-Timestamp': timestamp,
+            'X-Webhook-Signature': 'sha256=' + sign_payload(subscription.secret, timestamp, body)
+        }
+        error = None
+        try:
+            self.send(subscription.url, body, headers, self.timeout)
+        except Exception as e:
+            error = str(e) or e.__class__.__name__
+
+        with self._condition:
+            self._in_flight[subscription.client_id] -= 1
+            stats = self._stats.setdefault(subscription.id, {'delivered': 0, 'dropped': 0, 'last_error': None})
+            if error is None:
+                stats['delivered'] += 1
+            elif attempt < self.max_attempts:
+                stats['last_error'] = error
+                delay = self.retry_delay * 2 ** (attempt - 1) * random.uniform(0.5, 1.5)
+                heapq.heappush(self._retries, (time.monotonic() + delay, next(self._sequence),
+                                               subscription, events, attempt + 1))
+            else:
+                stats['last_error'] = error
+                stats['dropped'] += 1
+                print(f"❌ Webhook {subscription.url} не доставлен после {attempt} попыток: {error}")
+            self._condition.notify()